@@ -0,0 +1,203 @@
+"""Бэкенды распознавания речи за transcribe_audio.
+
+whisper - openai-whisper (PyTorch, fp32 на CPU), исходный вариант.
+faster-whisper - CTranslate2 с int8-квантизацией на CPU: в разы быстрее и легче по памяти.
+
+Бэкенд выбирается ASR_BACKEND; модели грузятся лениво, по одной на размер.
+Распознавание одной моделью идёт строго по очереди: декодер openai-whisper
+вешает на общий модуль хуки KV-кэша, и параллельные проходы портят друг
+другу кэш. Разные модели (tiny и base) работают параллельно.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from app.voice_preprocessing import SAMPLE_RATE
+from config import ASR_BACKEND, ASR_BEAM_SIZE, ASR_COMPUTE_TYPE, ASR_LANGUAGE, ASR_THREADS
+
+logger = logging.getLogger(__name__)
+
+# Пороги model.transcribe в openai-whisper, выше/ниже них он повторяет декодирование
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+
+
+class ASRBackend(ABC):
+    """Интерфейс бэкенда: загрузка модели, декодирование файла, распознавание."""
+
+    name = ""
+
+    def __init__(self, beam_size: int = 1, language: str | None = None, threads: int = 0):
+        self.beam_size = beam_size
+        # Фиксированный язык пропускает автоопределение (лишний проход модели)
+        self.language = language
+        self.threads = threads
+        self._models = {}
+        self._inference_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get_model(self, model_size: str):
+        with self._lock:
+            if model_size not in self._models:
+                logger.info("Загружаем модель %s '%s'", self.name, model_size)
+                self._models[model_size] = self._load_model(model_size)
+                self._inference_locks[model_size] = threading.Lock()
+        return self._models[model_size]
+
+    def transcribe(self, model_size: str, audio: np.ndarray) -> str:
+        model = self.get_model(model_size)
+        with self._inference_locks[model_size]:
+            return self._transcribe(model, audio)
+
+    def transcribe_batch(self, model_size: str, audios: list[np.ndarray]) -> list[str]:
+        model = self.get_model(model_size)
+        with self._inference_locks[model_size]:
+            return self._transcribe_batch(model, audios)
+
+    @abstractmethod
+    def _load_model(self, model_size: str):
+        ...
+
+    @abstractmethod
+    def load_audio(self, file_path: str) -> np.ndarray:
+        """Mono float32 16 кГц"""
+
+    @abstractmethod
+    def _transcribe(self, model, audio: np.ndarray) -> str:
+        """Распознать клип загруженной моделью (вызывается под блокировкой модели)"""
+
+    def _transcribe_batch(self, model, audios: list[np.ndarray]) -> list[str]:
+        """Распознать несколько клипов; по умолчанию по одному"""
+        return [self._transcribe(model, audio) for audio in audios]
+
+
+class WhisperBackend(ASRBackend):
+    name = "whisper"
+
+    def _load_model(self, model_size: str):
+        # Импорт здесь: процессу, который не транскрибирует, не нужен torch
+        import torch
+        import whisper
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        return whisper.load_model(model_size, device="cpu")
+
+    def load_audio(self, file_path: str) -> np.ndarray:
+        import whisper
+
+        return whisper.load_audio(file_path, sr=SAMPLE_RATE)
+
+    def _transcribe(self, model, audio: np.ndarray) -> str:
+        options = {"fp16": False, "language": self.language}
+        if self.beam_size > 1:
+            options["beam_size"] = self.beam_size
+        result = model.transcribe(audio, **options)
+        return result["text"].strip()
+
+    def _transcribe_batch(self, model, audios: list[np.ndarray]) -> list[str]:
+        """Один проход энкодера и декодера по батчу клипов, дополненных до окна 30 с.
+
+        whisper.decode идёт с одной температурой, без повторов model.transcribe
+        при зацикливании. Клип с подозрительным результатом (высокий
+        compression_ratio или низкий avg_logprob) распознаётся заново через
+        transcribe с его запасными температурами.
+        """
+        import torch
+        import whisper
+
+        if len(audios) == 1 or any(len(audio) > whisper.audio.N_SAMPLES for audio in audios):
+            return super()._transcribe_batch(model, audios)
+
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels)
+            for audio in audios
+        ]).to(model.device)
+        options = whisper.DecodingOptions(
+            language=self.language,
+            fp16=False,
+            without_timestamps=True,
+            beam_size=self.beam_size if self.beam_size > 1 else None,
+        )
+        results = whisper.decode(model, mels, options)
+        texts = []
+        for audio, result in zip(audios, results):
+            if (
+                result.compression_ratio > COMPRESSION_RATIO_THRESHOLD
+                or result.avg_logprob < LOGPROB_THRESHOLD
+            ):
+                logger.info("Батч: клип распознаётся заново отдельно (сжатие %.2f)", result.compression_ratio)
+                texts.append(self._transcribe(model, audio))
+            else:
+                texts.append(result.text.strip())
+        return texts
+
+
+class FasterWhisperBackend(ASRBackend):
+    name = "faster-whisper"
+
+    def __init__(self, compute_type: str = "int8", **kwargs):
+        super().__init__(**kwargs)
+        self.compute_type = compute_type
+
+    def _load_model(self, model_size: str):
+        from faster_whisper import WhisperModel
+
+        return WhisperModel(
+            model_size,
+            device="cpu",
+            compute_type=self.compute_type,
+            cpu_threads=self.threads,
+        )
+
+    def load_audio(self, file_path: str) -> np.ndarray:
+        # PyAV внутри faster-whisper, внешний ffmpeg не нужен
+        from faster_whisper import decode_audio
+
+        return decode_audio(file_path, sampling_rate=SAMPLE_RATE)
+
+    def _transcribe(self, model, audio: np.ndarray) -> str:
+        segments, _info = model.transcribe(
+            audio,
+            beam_size=self.beam_size,
+            language=self.language,
+            # Тишину уже обрезал наш VAD
+            vad_filter=False,
+            condition_on_previous_text=False,
+        )
+        # segments - генератор: распознавание идёт по мере чтения
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+BACKENDS: dict[str, type[ASRBackend]] = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def create_backend(name: str = ASR_BACKEND) -> ASRBackend:
+    """Создаёт бэкенд по имени с настройками из config"""
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный ASR-бэкенд: {name}. Доступны: {', '.join(BACKENDS)}")
+
+    kwargs = {"beam_size": ASR_BEAM_SIZE, "language": ASR_LANGUAGE, "threads": ASR_THREADS}
+    if name == FasterWhisperBackend.name:
+        kwargs["compute_type"] = ASR_COMPUTE_TYPE
+    return BACKENDS[name](**kwargs)
+
+
+_backend: ASRBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_asr_backend() -> ASRBackend:
+    """Бэкенд процесса (создаётся при первом обращении)"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+    return _backend
@@ -1,11 +1,23 @@
 from pyrogram import Client
 
-from config import API_ID, API_HASH
-
-# Юзер-бот: логин своим аккаунтом (попросит код при первом запуске)
-client = Client(
-    "tg_ai_userbot",
-    api_id=API_ID,
-    api_hash=API_HASH,
-    workdir="."
-)
+from config import API_ID, API_HASH, TG_ACCOUNTS
+
+
+def create_client(account_id: str) -> Client:
+    """Создаёт клиент аккаунта; имя сессии совпадает с account_id"""
+    # Юзер-бот: логин своим аккаунтом (попросит код при первом запуске)
+    return Client(
+        account_id,
+        api_id=API_ID,
+        api_hash=API_HASH,
+        workdir="."
+    )
+
+
+# Все аккаунты обслуживаются одним процессом и одним event loop
+clients: dict[str, Client] = {account_id: create_client(account_id) for account_id in TG_ACCOUNTS}
+
+
+def account_id_of(client_instance: Client) -> str:
+    """Идентификатор аккаунта, которому принадлежит клиент"""
+    return client_instance.name
@@ -1,10 +1,12 @@
 import logging
 
-from pyrogram import filters
+from pyrogram import Client, filters
+from pyrogram.handlers import MessageHandler
 from pyrogram.types import Message
 
-from app.client import client
+from app.client import account_id_of
 from app.message_buffer import handle_message_smart, handle_media_message
+from app.traffic_recorder import traffic_recorder
 from commands.router import CommandContext, CommandRouter
 from database.session import AsyncSessionLocal
 from services.user_service import UserService
@@ -12,11 +14,12 @@ from services.message_service import MessageService
 from config import REPLY_ON_UNKNOWN
 
 logger = logging.getLogger(__name__)
-command_router = CommandRouter(AsyncSessionLocal, UserService, MessageService)
+
+# Роутеры команд по account_id: каждый аккаунт управляется из своего 'Избранного'
+command_routers: dict[str, CommandRouter] = {}
 
 
 # --- Контрольные команды в 'Избранном': только исходящие сообщения к себе ---
-@client.on_message(filters.me & filters.private)
 async def control_panel(client_instance, message: Message):
     logger.info(
         "Получено сообщение: chat_id=%s, from_user_id=%s, text='%s'",
@@ -29,26 +32,40 @@ async def control_panel(client_instance, message: Message):
     if not message.from_user or message.chat.id != message.from_user.id:
         logger.info("Не Saved Messages, пропускаем")
         return
-    if not message.text:
+    # Файлы для .import приходят с командой в подписи
+    text = message.text or message.caption
+    if not text:
         logger.info("Нет текста, пропускаем")
         return
 
-    await command_router.handle(message.text, CommandContext(message=message))
+    command_router = command_routers[account_id_of(client_instance)]
+    await command_router.handle(text, CommandContext(message=message))
 
 
 # --- Входящие личные сообщения ---
-@client.on_message(filters.private & ~filters.service)
+def _record_arrival(account_id: str, tg_id: int, message: Message):
+    if not traffic_recorder.enabled:
+        return
+    if message.voice:
+        traffic_recorder.record(account_id, tg_id, "voice", duration=message.voice.duration or 0)
+    elif message.video_note:
+        traffic_recorder.record(account_id, tg_id, "video_note", duration=message.video_note.duration or 0)
+    elif message.text:
+        traffic_recorder.record(account_id, tg_id, "text", length=len(message.text))
+
+
 async def handle_private_chat_smart(client_instance, message: Message):
     # Игнорируем свои же исходящие
     if message.outgoing or not message.from_user or message.from_user.is_self:
         return
 
+    account_id = account_id_of(client_instance)
     tg_id = message.from_user.id
     username = message.from_user.username
 
     # Проверяем что пользователь активен
     async with AsyncSessionLocal() as session:
-        user_service = UserService(session)
+        user_service = UserService(session, account_id)
         user = await user_service.get_user(tg_id)
         if not user:
             if not REPLY_ON_UNKNOWN:
@@ -58,19 +75,32 @@ async def handle_private_chat_smart(client_instance, message: Message):
         elif not user.active:
             return
 
+    _record_arrival(account_id, tg_id, message)
+
     # Обработка голосовых сообщений
     if message.voice:
-        logger.info("Получено голосовое сообщение от %s", tg_id)
+        logger.info("[%s] Получено голосовое сообщение от %s", account_id, tg_id)
         await handle_media_message(client_instance, tg_id, message, "voice", username)
         return
 
     # Обработка видеокружков
     if message.video_note:
-        logger.info("Получен видеокружок от %s", tg_id)
+        logger.info("[%s] Получен видеокружок от %s", account_id, tg_id)
         await handle_media_message(client_instance, tg_id, message, "video_note", username)
         return
 
     # Обработка текстовых сообщений
     if message.text:
-        logger.info("Получено текстовое сообщение от %s", tg_id)
+        logger.info("[%s] Получено текстовое сообщение от %s", account_id, tg_id)
         await handle_message_smart(client_instance, tg_id, message.text, username)
+
+
+def register_handlers(client_instance: Client) -> None:
+    """Регистрирует хендлеры и роутер команд для клиента аккаунта"""
+    account_id = account_id_of(client_instance)
+    command_routers[account_id] = CommandRouter(
+        AsyncSessionLocal, UserService, MessageService, account_id
+    )
+    # Порядок важен: в одной группе срабатывает первый подходящий хендлер
+    client_instance.add_handler(MessageHandler(control_panel, filters.me & filters.private))
+    client_instance.add_handler(MessageHandler(handle_private_chat_smart, filters.private & ~filters.service))
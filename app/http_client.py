@@ -0,0 +1,150 @@
+"""Общий HTTP-клиент для OpenRouter.
+
+Явно настроенный пул соединений httpx (keep-alive, HTTP/2, таймауты по фазам),
+учёт переиспользования соединений через trace-события httpcore и фоновый
+пинг в активные часы, чтобы первый запрос после простоя не платил за DNS,
+TCP и TLS.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+
+import httpx
+
+from app.time_utils import is_working_hours
+from config import (
+    OPENROUTER_BASE_URL,
+    OPENROUTER_CA_BUNDLE,
+    OPENROUTER_CONNECT_TIMEOUT,
+    OPENROUTER_HTTP2,
+    OPENROUTER_KEEPALIVE_EXPIRY,
+    OPENROUTER_KEEPWARM_INTERVAL,
+    OPENROUTER_MAX_CONNECTIONS,
+    OPENROUTER_MAX_KEEPALIVE,
+    OPENROUTER_POOL_TIMEOUT,
+    OPENROUTER_READ_TIMEOUT,
+    OPENROUTER_WRITE_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConnectionStats:
+    """Сколько запросов ушло по уже открытому соединению и сколько стоило открыть новое"""
+    requests: int = 0
+    connections: int = 0
+    connect_time: float = 0.0  # TCP + TLS, секунды суммарно
+
+    @property
+    def reuse_rate(self) -> float:
+        if not self.requests:
+            return 0.0
+        return max(0.0, 1.0 - self.connections / self.requests)
+
+    @property
+    def avg_connect_time(self) -> float:
+        return self.connect_time / self.connections if self.connections else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reuse_rate": self.reuse_rate,
+            "avg_connect_ms": self.avg_connect_time * 1000,
+        }
+
+
+connection_stats = ConnectionStats()
+
+
+async def _on_request(request: httpx.Request):
+    """Подписывает запрос на trace-события httpcore"""
+    loop = asyncio.get_running_loop()
+    started = {}
+
+    async def trace(event_name: str, info: dict):
+        if event_name in ("connection.connect_tcp.started", "connection.start_tls.started"):
+            started[event_name.rsplit(".", 1)[0]] = loop.time()
+        elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            phase = event_name.rsplit(".", 1)[0]
+            if phase in started:
+                connection_stats.connect_time += loop.time() - started.pop(phase)
+            if phase == "connection.connect_tcp":
+                connection_stats.connections += 1
+
+    connection_stats.requests += 1
+    request.extensions["trace"] = trace
+
+
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=OPENROUTER_HTTP2,
+        limits=httpx.Limits(
+            max_connections=OPENROUTER_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENROUTER_MAX_KEEPALIVE,
+            keepalive_expiry=OPENROUTER_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=OPENROUTER_CONNECT_TIMEOUT,
+            read=OPENROUTER_READ_TIMEOUT,
+            write=OPENROUTER_WRITE_TIMEOUT,
+            pool=OPENROUTER_POOL_TIMEOUT,
+        ),
+        verify=OPENROUTER_CA_BUNDLE or True,
+        event_hooks={"request": [_on_request]},
+    )
+
+
+# Один клиент и один пул на процесс
+http_client = create_http_client()
+
+
+class KeepWarm:
+    """Держит соединение с OpenRouter открытым в активные часы."""
+
+    def __init__(self, client: httpx.AsyncClient, api_key: str, interval: float = OPENROUTER_KEEPWARM_INTERVAL):
+        self.client = client
+        self.api_key = api_key
+        self.interval = interval
+        self.task = None
+        self._last_requests = 0
+
+    def start(self):
+        if self.interval > 0 and self.task is None:
+            self.task = asyncio.create_task(self._main_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def _main_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not is_working_hours():
+                continue
+
+            # Были настоящие запросы - соединение и так тёплое
+            if connection_stats.requests - self._last_requests == 0:
+                try:
+                    # Лёгкий эндпоинт: информация о ключе
+                    await self.client.get(
+                        f"{OPENROUTER_BASE_URL}/auth/key",
+                        headers={"Authorization": f"Bearer {self.api_key}"},
+                    )
+                except httpx.HTTPError as e:
+                    logger.warning("Пинг OpenRouter не удался: %s", e)
+            self._last_requests = connection_stats.requests
+
+            logger.debug(
+                "OpenRouter: запросов %s, соединений %s, переиспользование %.0f%%, подключение %.0f мс",
+                connection_stats.requests, connection_stats.connections,
+                connection_stats.reuse_rate * 100, connection_stats.avg_connect_time * 1000,
+            )
@@ -0,0 +1,299 @@
+"""Локальная долговечная очередь задач на SQLite.
+
+Telegram-процесс ставит в очередь задачи на обработку буфера (flush), воркеры
+в отдельных процессах забирают их под аренду (lease), транскрибируют медиа,
+генерируют ответ и возвращают его обратно для отправки.
+
+Семантика at-least-once: задача, аренда которой истекла (воркер упал), снова
+становится доступной. Отправка at-most-once: ответ задачи записывается только
+первым завершившим её воркером, задача помечается отправленной сразу после
+send_message, а прерванная рестартом отправка не повторяется - неизвестно,
+дошло ли сообщение.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+from app.time_utils import current_timestamp
+from config import JOB_QUEUE_PATH, JOB_MAX_ATTEMPTS, JOB_MAX_SEND_ATTEMPTS, JOB_LEASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Статусы задачи
+STATUS_PENDING = "pending"  # ждёт воркера
+STATUS_RUNNING = "running"  # взята воркером под аренду
+STATUS_DONE = "done"  # ответ готов, ждёт отправки
+STATUS_SENDING = "sending"  # отправляется Telegram-процессом
+STATUS_SENT = "sent"  # отправлена
+STATUS_SKIPPED = "skipped"  # отвечать не нужно
+STATUS_FAILED = "failed"  # исчерпаны попытки, ждёт отправки заглушки
+STATUS_UNDELIVERED = "undelivered"  # отправка не удалась или прервана, больше не отправляется
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id TEXT NOT NULL,
+    tg_id INTEGER NOT NULL,
+    username TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    send_attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, id);
+"""
+
+
+@dataclass
+class Job:
+    id: int
+    account_id: str
+    tg_id: int
+    username: str | None
+    payload: dict
+    attempts: int
+    send_attempts: int = 0
+    result: dict | None = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        return cls(
+            id=row["id"],
+            account_id=row["account_id"],
+            tg_id=row["tg_id"],
+            username=row["username"],
+            payload=json.loads(row["payload"]),
+            attempts=row["attempts"],
+            send_attempts=row["send_attempts"],
+            result=json.loads(row["result"]) if row["result"] else None,
+        )
+
+
+class JobQueue:
+    """Очередь задач в отдельном SQLite-файле, общая для процессов."""
+
+    def __init__(
+        self, path: str, max_attempts: int = 3, lease_seconds: float = 300, max_send_attempts: int = 3
+    ):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.max_send_attempts = max_send_attempts
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "send_attempts" not in columns:
+                # Очередь, созданная до появления счётчика отправок
+                conn.execute("ALTER TABLE jobs ADD COLUMN send_attempts INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Соединение на поток: sqlite3-соединения нельзя делить между потоками"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- Синхронный API (вызывается из потоков) ---
+
+    def enqueue(self, account_id: str, tg_id: int, username: str | None, payload: dict) -> int:
+        now = current_timestamp()
+        conn = self._connect()
+        cursor = conn.execute(
+            "INSERT INTO jobs (account_id, tg_id, username, payload, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (account_id, tg_id, username, json.dumps(payload, ensure_ascii=False), now, now),
+        )
+        return cursor.lastrowid
+
+    def claim(self, worker_id: str) -> Job | None:
+        """Взять следующую задачу под аренду (включая задачи упавших воркеров)"""
+        now = current_timestamp()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Задача, на которой воркер падал max_attempts раз, больше не выдаётся: ей отправят заглушку
+            expired = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = 0, updated_at = ? "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (STATUS_FAILED, "аренда истекла", now, STATUS_RUNNING, now, self.max_attempts),
+            ).rowcount
+            if expired:
+                logger.warning("Задач с истёкшей арендой и исчерпанными попытками: %s", expired)
+
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) "
+                "ORDER BY id LIMIT 1",
+                (STATUS_PENDING, STATUS_RUNNING, now),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, lease_until = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?",
+                (STATUS_RUNNING, worker_id, now + self.lease_seconds, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        job = Job.from_row(row)
+        job.attempts += 1
+        return job
+
+    def complete(self, job_id: int, worker_id: str, result: dict | None) -> bool:
+        """Записать результат; засчитывается только текущему владельцу аренды"""
+        status = STATUS_DONE if result is not None else STATUS_SKIPPED
+        conn = self._connect()
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, updated_at = ? "
+            "WHERE id = ? AND status = ? AND worker_id = ?",
+            (
+                status,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                current_timestamp(),
+                job_id,
+                STATUS_RUNNING,
+                worker_id,
+            ),
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str) -> str:
+        """Вернуть задачу в очередь или пометить проваленной после max_attempts"""
+        conn = self._connect()
+        row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        status = STATUS_FAILED if row and row["attempts"] >= self.max_attempts else STATUS_PENDING
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, lease_until = 0, updated_at = ? "
+            "WHERE id = ? AND status = ? AND worker_id = ?",
+            (status, error, current_timestamp(), job_id, STATUS_RUNNING, worker_id),
+        )
+        return status
+
+    def claim_ready(self, account_ids: list[str], limit: int = 20) -> list[Job]:
+        """Забрать готовые ответы и проваленные задачи для отправки"""
+        if not account_ids:
+            return []
+
+        placeholders = ",".join("?" for _ in account_ids)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT * FROM jobs WHERE status IN (?, ?) AND account_id IN ({placeholders}) "
+                "ORDER BY id LIMIT ?",
+                (STATUS_DONE, STATUS_FAILED, *account_ids, limit),
+            ).fetchall()
+            jobs = []
+            for row in rows:
+                job = Job.from_row(row)
+                job.send_attempts += 1
+                if row["status"] == STATUS_FAILED:
+                    # Для проваленных задач отправляется заглушка
+                    job.result = None
+                conn.execute(
+                    "UPDATE jobs SET status = ?, send_attempts = send_attempts + 1, updated_at = ? "
+                    "WHERE id = ?",
+                    (STATUS_SENDING, current_timestamp(), row["id"]),
+                )
+                jobs.append(job)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return jobs
+
+    def mark_sent(self, job_id: int):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (STATUS_SENT, current_timestamp(), job_id, STATUS_SENDING),
+        )
+
+    def release_ready(self, job_id: int, error: str) -> str:
+        """Вернуть ответ к отправке после ошибки Telegram или снять его после max_send_attempts"""
+        conn = self._connect()
+        row = conn.execute("SELECT send_attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        status = STATUS_UNDELIVERED if row and row["send_attempts"] >= self.max_send_attempts else STATUS_DONE
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (status, error, current_timestamp(), job_id, STATUS_SENDING),
+        )
+        return status
+
+    def recover(self) -> int:
+        """После рестарта Telegram-процесса снять прерванные отправки.
+
+        Задача в статусе sending могла упасть посреди send_message, и ответ мог
+        уже дойти: повторная отправка продублировала бы его, поэтому такие
+        задачи не отправляются снова.
+        """
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status = ?",
+            (STATUS_UNDELIVERED, "отправка прервана рестартом", current_timestamp(), STATUS_SENDING),
+        )
+        return cursor.rowcount
+
+    def purge(self, older_than: float) -> int:
+        """Удалить завершённые задачи старше older_than секунд"""
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+            (STATUS_SENT, STATUS_SKIPPED, STATUS_UNDELIVERED, current_timestamp() - older_than),
+        )
+        return cursor.rowcount
+
+    def stats(self) -> dict[str, int]:
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    # --- Асинхронные обёртки для event loop ---
+
+    async def enqueue_async(self, account_id: str, tg_id: int, username: str | None, payload: dict) -> int:
+        return await asyncio.to_thread(self.enqueue, account_id, tg_id, username, payload)
+
+    async def claim_async(self, worker_id: str) -> Job | None:
+        return await asyncio.to_thread(self.claim, worker_id)
+
+    async def complete_async(self, job_id: int, worker_id: str, result: dict | None) -> bool:
+        return await asyncio.to_thread(self.complete, job_id, worker_id, result)
+
+    async def fail_async(self, job_id: int, worker_id: str, error: str) -> str:
+        return await asyncio.to_thread(self.fail, job_id, worker_id, error)
+
+    async def claim_ready_async(self, account_ids: list[str], limit: int = 20) -> list[Job]:
+        return await asyncio.to_thread(self.claim_ready, account_ids, limit)
+
+    async def mark_sent_async(self, job_id: int):
+        await asyncio.to_thread(self.mark_sent, job_id)
+
+    async def release_ready_async(self, job_id: int, error: str) -> str:
+        return await asyncio.to_thread(self.release_ready, job_id, error)
+
+
+_job_queue: JobQueue | None = None
+
+
+def get_job_queue() -> JobQueue:
+    """Очередь процесса (создаётся при первом обращении)"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(JOB_QUEUE_PATH, JOB_MAX_ATTEMPTS, JOB_LEASE_SECONDS, JOB_MAX_SEND_ATTEMPTS)
+    return _job_queue
@@ -1,34 +1,53 @@
 import asyncio
+import json
 import os
 import tempfile
+import time
 from typing import Dict
 from dataclasses import dataclass, field
 import logging
-import whisper
 
 from pyrogram import enums
 
-from database.session import AsyncSessionLocal
-from services.user_service import UserService
-from services.message_service import MessageService
-from app.openrouter import generate_reply
+from app import metrics
+from app.client import account_id_of, clients
+from app.job_queue import get_job_queue
+from app.overload import overload_controller
+from app.replies import FALLBACK_REPLY, deliver_reply, prepare_reply
+from app.runtime_settings import runtime_settings
+from app.speculation import MISS, Speculation, can_speculate, cancel_speculation, start_speculation, take_speculation
 from app.time_utils import current_timestamp, seconds_since
-from config import REPLY_ON_UNKNOWN, STICKERS
-
-# Загружаем модель Whisper один раз при старте
-# Варианты: tiny, base, small, medium, large
-# tiny - самая быстрая, но менее точная
-# base - хороший баланс скорости и качества (рекомендую)
-whisper_model = whisper.load_model("base")
+from app.transcription import transcribe_audio
+from config import (
+    BUFFER_SNAPSHOT_MAX_AGE,
+    BUFFER_SNAPSHOT_PATH,
+    DRAIN_DEADLINE,
+    HISTORY_CACHE_IDLE_SECONDS,
+    HISTORY_CACHE_SWEEP_INTERVAL,
+    JOB_QUEUE_ENABLED,
+    JOB_SPOOL_DIR,
+)
+from services.history_cache import history_cache
+from services.long_term_memory import long_term_memory
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class MediaRef:
+    """Скачанное медиа, которое транскрибирует воркер очереди"""
+    media_type: str
+    path: str
+    message_id: int | None = None
+
+
 @dataclass
 class PendingMedia:
     """Медиафайл, ожидающий транскрипции"""
     placeholder_index: int  # индекс в списке messages
     transcription_task: asyncio.Task  # задача транскрипции
+    media_type: str = ""
+    message_id: int | None = None  # чтобы скачать заново после перезапуска
 
 
 @dataclass
@@ -37,60 +56,76 @@ class UserState:
     last_message_time: float = 0
     processing_task: asyncio.Task = None
     is_processing: bool = False
+    flush_task: asyncio.Task = None  # обработка буфера: ожидание медиа и ответ
+    in_flight: list = field(default_factory=list)  # сообщения, на которые ответ ещё не отправлен
+    preemptible: bool = False  # идёт генерация ответа на in_flight, отправка ещё не началась
+    preempted: bool = False  # новые сообщения вытеснили генерацию: её ответ не отправляется
+    burst_llm_calls: int = 0  # генераций с последнего отправленного ответа
+    username: str = None
     pending_media: list = field(default_factory=list)  # список PendingMedia
     lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    speculation: Speculation = None  # ответ, генерируемый заранее во время ожидания
 
 
-# Состояния пользователей
-user_states: Dict[int, UserState] = {}
+# Состояния пользователей, изолированные по аккаунтам: {account_id: {tg_id: UserState}}
+user_states: Dict[str, Dict[int, UserState]] = {}
 
-# Настройки
+# Настройки (таймауты и размер буфера - в app.runtime_settings, меняются без перезапуска)
 SHORT_MESSAGE_LENGTH = 15
-QUICK_INTERVAL = 5
-BUFFER_TIMEOUT = 15
-MAX_BUFFER_SIZE = 20
-MEDIA_WAIT_TIMEOUT = 30  # максимальное ожидание транскрипции
+
+# PREEMPT_MODE: что делать с генерацией, если пользователь дописал во время неё
+PREEMPT_CANCEL = "cancel"
+PREEMPT_DISCARD = "discard"
+PREEMPT_OFF = "off"
+
+# Фоновые задачи буфера (догоняющая обработка): ссылки держим, пока не завершатся
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def get_user_state(account_id: str, tg_id: int) -> UserState:
+    """Вернуть состояние пользователя аккаунта, создав его при необходимости"""
+    account_states = user_states.setdefault(account_id, {})
+    if tg_id not in account_states:
+        account_states[tg_id] = UserState()
+    return account_states[tg_id]
+
+
+def iter_user_states():
+    """Все состояния пользователей всех аккаунтов"""
+    for account_states in user_states.values():
+        yield from account_states.values()
+
+
+metrics.register_gauge("active_buffers", lambda: sum(1 for state in iter_user_states() if state.messages))
+metrics.register_gauge(
+    "pending_transcriptions",
+    lambda: sum(
+        1 for state in iter_user_states()
+        for pending in state.pending_media if not pending.transcription_task.done()
+    ),
+)
 
 
 def is_likely_continuation(text: str, time_since_last: float) -> bool:
     """Определяем, является ли сообщение продолжением"""
     return (
             len(text) <= SHORT_MESSAGE_LENGTH and
-            time_since_last <= QUICK_INTERVAL
+            time_since_last <= runtime_settings.QUICK_INTERVAL
     ) or (
-            time_since_last <= 3
+            time_since_last <= runtime_settings.CONTINUATION_INTERVAL
     )
 
 
-async def transcribe_audio(file_path: str) -> str:
-    """Транскрибирует аудио через локальный Whisper"""
-    try:
-        logger.info("Начинаем транскрипцию файла: %s", file_path)
-
-        # Whisper синхронный, запускаем в отдельном потоке
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: whisper_model.transcribe(file_path)
-        )
-
-        text = result["text"].strip()
-        logger.info("Транскрипция завершена: '%s...'", text[:100])
-        return text
-    except Exception as e:
-        logger.error("Ошибка транскрипции: %s", e)
-        return "[Не удалось распознать аудио]"
-    finally:
-        # Удаляем временный файл
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception:
-            pass
-
-
-async def wait_for_pending_media(state: UserState, timeout: float = MEDIA_WAIT_TIMEOUT):
-    """Ждёт завершения всех pending транскрипций"""
+async def wait_for_pending_media(state: UserState, timeout: float | None = None):
+    """Ждёт завершения всех pending транскрипций (по умолчанию не дольше MEDIA_WAIT_TIMEOUT)"""
+    if timeout is None:
+        timeout = runtime_settings.MEDIA_WAIT_TIMEOUT
     async with state.lock:
         pending_media = list(state.pending_media)
 
@@ -101,14 +136,12 @@ async def wait_for_pending_media(state: UserState, timeout: float = MEDIA_WAIT_T
 
     # Ждём все задачи с таймаутом
     tasks = [pm.transcription_task for pm in pending_media]
-    try:
-        await asyncio.wait_for(
-            asyncio.gather(*tasks, return_exceptions=True),
-            timeout=timeout
-        )
-        logger.info("Все транскрипции завершены")
-    except asyncio.TimeoutError:
+    # asyncio.wait не отменяет транскрипции по таймауту: недождавшиеся остаются в pending_media
+    _, not_done = await asyncio.wait(tasks, timeout=timeout)
+    if not_done:
         logger.warning("Таймаут ожидания транскрипций (%ss)", timeout)
+    else:
+        logger.info("Все транскрипции завершены")
 
     # Заменяем placeholders на результаты
     for pm in pending_media:
@@ -140,15 +173,22 @@ async def _cancel_task_safely(task: asyncio.Task | None):
 
 async def process_user_messages(client_instance, tg_id: int, username: str = None):
     """Обработать накопленные сообщения пользователя"""
-    if tg_id not in user_states:
+    state = user_states.get(account_id_of(client_instance), {}).get(tg_id)
+    if state is None:
         return
-
-    state = user_states[tg_id]
     async with state.lock:
         if not state.messages or state.is_processing:
             return
         state.is_processing = True
+        # Отдельная задача: её можно отменить (вытеснение, остановка), не трогая задачи pyrogram
+        flush_task = state.flush_task = asyncio.create_task(
+            _flush_user_messages(client_instance, tg_id, username, state)
+        )
+    await flush_task
 
+
+async def _flush_user_messages(client_instance, tg_id: int, username: str, state: UserState):
+    completed = False
     try:
         # КРИТИЧНО: Ждём завершения всех транскрипций
         await wait_for_pending_media(state)
@@ -156,94 +196,138 @@ async def process_user_messages(client_instance, tg_id: int, username: str = Non
         async with state.lock:
             messages = state.messages.copy()
             state.messages.clear()
+            state.in_flight = messages
+            # Ответ воркера очереди отсюда не отменить
+            state.preemptible = not JOB_QUEUE_ENABLED
+            state.preempted = False
+            speculation, state.speculation = state.speculation, None
+            last_message_time = state.last_message_time
 
         logger.info("Обрабатываем %s сообщений от %s", len(messages), tg_id)
 
-        # Объединяем сообщения
-        combined = "\n".join(messages)
-
-        await generate_and_send_reply(client_instance, tg_id, combined, username)
+        if JOB_QUEUE_ENABLED:
+            # Задача переживёт отмену после записи в очередь: в снимок эти сообщения уже не попадают
+            state.in_flight = []
+            await enqueue_flush(client_instance, tg_id, messages, username)
+        else:
+            # Объединяем сообщения
+            combined = "\n".join(messages)
+
+            state.burst_llm_calls += 1
+            await generate_and_send_reply(client_instance, tg_id, combined, username, speculation, state)
+            if not state.preempted:
+                # От последнего сообщения пользователя до отправленного ответа, включая ожидание буфера
+                metrics.observe("reply_latency", seconds_since(last_message_time, current_timestamp()))
+                _record_burst(state)
+        # При отмене до отправки остаются в in_flight и попадают в снимок
+        state.in_flight = []
+        completed = True
     finally:
         async with state.lock:
             state.is_processing = False
-            state.processing_task = None
+            state.preemptible = False
+            if state.processing_task is not None and state.processing_task.done():
+                state.processing_task = None
+            if state.flush_task is asyncio.current_task():
+                state.flush_task = None
+            # Сообщения пришли во время обработки, а их таймер уже истёк - он застал обработку и ничего не сделал
+            follow_up = completed and state.messages and (
+                state.processing_task is None or state.processing_task.done()
+            )
+        if follow_up:
+            _run_in_background(process_user_messages(client_instance, tg_id, username))
 
 
-async def generate_and_send_reply(client_instance, tg_id: int, text: str, username: str = None):
-    """Генерировать и отправить ответ"""
-    logger.info("Генерируем ответ для %s на текст: '%s...'", tg_id, text[:50])
-
-    async with AsyncSessionLocal() as session:
-        user_service = UserService(session)
-        message_service = MessageService(session)
-        user = await user_service.get_user(tg_id)
-        if not user:
-            logger.info("Пользователь %s не найден в БД", tg_id)
-            if not REPLY_ON_UNKNOWN:
-                logger.info("REPLY_ON_UNKNOWN=False, пропускаем")
-                return
-            user = await user_service.add_or_update_user(tg_id, username)
-            logger.info("Создан новый пользователь: %s", user.tg_id)
-
-        if not user.active:
-            logger.info("Пользователь %s неактивен, пропускаем", tg_id)
-            return
+def _record_burst(state: UserState):
+    """Ответ отправлен: сколько генераций понадобилось на эту серию сообщений"""
+    metrics.observe("llm_calls_per_burst", state.burst_llm_calls)
+    metrics.increment("reply_bursts")
+    metrics.increment("burst_llm_calls", state.burst_llm_calls)
+    state.burst_llm_calls = 0
 
-        logger.info("Пользователь активен, mode=%s", user.mode)
 
-        # История диалога
-        history = await message_service.get_history(user)
-        logger.info("История: %s сообщений", len(history))
+def _preempt_generation(state: UserState, tg_id: int):
+    """Новое сообщение во время генерации: вернуть её сообщения в начало буфера (под state.lock)"""
+    mode = runtime_settings.PREEMPT_MODE
+    if mode == PREEMPT_OFF or not state.preemptible:
+        return
 
-        # Формируем историю для LLM, включая новое сообщение пользователя
-        conversation_history = history + [{"role": "user", "content": text}]
+    returned = state.in_flight
+    state.messages[:0] = returned
+    for pm in state.pending_media:
+        pm.placeholder_index += len(returned)
+    state.in_flight = []
+    state.preemptible = False
+    state.preempted = True
+    if mode == PREEMPT_CANCEL and state.flush_task is not None:
+        # Не ждём: завершение задачи берёт state.lock, который держит вызывающий
+        state.flush_task.cancel()
+    metrics.increment(f"preempted_{mode}")
+    logger.info("Генерация для %s вытеснена (%s): ответим на %s сообщений вместе", tg_id, mode, len(returned) + 1)
+
+
+def _buffer_item(item) -> dict:
+    """Элемент буфера в JSON: для задачи очереди и снимка при остановке"""
+    if isinstance(item, MediaRef):
+        return {"kind": "media", "media_type": item.media_type, "path": item.path, "message_id": item.message_id}
+    return {"kind": "text", "text": item}
+
+
+async def enqueue_flush(client_instance, tg_id: int, messages: list, username: str = None):
+    """Поставить буфер в очередь воркерам вместо обработки в этом процессе"""
+    account_id = account_id_of(client_instance)
+    items = [_buffer_item(item) for item in messages]
+    # Ступени перегрузки считаются здесь, воркеры применяют их к своей задаче
+    payload = {"items": items, "overload": sorted(overload_controller.active)}
+    job_id = await get_job_queue().enqueue_async(account_id, tg_id, username, payload)
+    logger.info("[%s] Буфер %s поставлен в очередь: задача %s", account_id, tg_id, job_id)
 
-        try:
-            await client_instance.send_chat_action(tg_id, enums.ChatAction.TYPING)
+    try:
+        await client_instance.send_chat_action(tg_id, enums.ChatAction.TYPING)
+    except Exception as e:
+        logger.warning("Не удалось отправить статус набора для %s: %s", tg_id, e)
 
-            reply = await generate_reply(
-                text=text,
-                username=user.username or str(user.tg_id),
-                mode=user.mode,
-                history=conversation_history
-            )
-            logger.info("Ответ от LLM: '%s'", reply)
-
-            # Парсинг ответа
-            parts = reply.split()
-            sticker_number = None
-            if parts and parts[-1].isdigit() and int(parts[-1]) in STICKERS:
-                sticker_number = int(parts[-1])
-                text_response = " ".join(parts[:-1]) if parts[:-1] else ""
-            else:
-                text_response = reply
 
-            # Отправка текста
-            if text_response:
-                await client_instance.send_message(tg_id, text_response)
-                logger.info("Отправлен текст для %s: '%s'", tg_id, text_response)
-            else:
-                logger.info("Текст ответа пустой, пропускаем отправку")
-
-            # Отправка стикера
-            if sticker_number:
-                try:
-                    await client_instance.send_sticker(tg_id, STICKERS[sticker_number])
-                    logger.info("Отправлен стикер %s для %s", sticker_number, tg_id)
-                except Exception as e:
-                    logger.error("Ошибка отправки стикера %s для %s: %s", sticker_number, tg_id, e)
-            else:
-                logger.info("Стикер не указан в ответе для %s", tg_id)
+async def generate_and_send_reply(
+    client_instance, tg_id: int, text: str, username: str = None, speculation: Speculation = None,
+    state: UserState = None,
+):
+    """Генерировать и отправить ответ, используя спекулятивный, если он подходит.
 
-            # Обновляем историю только после успешной отправки
-            await message_service.append_user_message(user, text)
+    С state ответ не отправляется, если за время генерации его вытеснили новые сообщения,
+    а сообщения буфера снимаются с in_flight перед отправкой: остановка посреди отправки
+    не повторит ответ из снимка.
+    """
+    account_id = account_id_of(client_instance)
+    logger.info("[%s] Генерируем ответ для %s на текст: '%s...'", account_id, tg_id, text[:50])
 
-            if text_response:
-                await message_service.append_assistant_message(user, text_response)
+    try:
+        await client_instance.send_chat_action(tg_id, enums.ChatAction.TYPING)
+
+        reply = MISS
+        if speculation is not None:
+            reply = await take_speculation(speculation, text)
+        if reply is MISS:
+            reply = await prepare_reply(account_id, tg_id, text, username)
+        if reply is None:
+            return
 
-        except Exception as e:
-            logger.error("Generate reply: %s", e)
-            await client_instance.send_message(tg_id, "Позже")
+        if state is not None:
+            async with state.lock:
+                if state.preempted:
+                    logger.info("Ответ для %s отброшен: пришли новые сообщения", tg_id)
+                    return
+                state.preemptible = False
+                # Не более одного ответа: отправка, прерванная остановкой, не повторяется из снимка
+                state.in_flight = []
+
+        await deliver_reply(client_instance, account_id, tg_id, text, reply)
+
+    except Exception as e:
+        logger.error("Generate reply: %s", e)
+        if state is not None:
+            state.in_flight = []
+        await client_instance.send_message(tg_id, FALLBACK_REPLY)
 
 
 async def handle_message_smart(client_instance, tg_id: int, message_text: str, username: str = None):
@@ -255,30 +339,39 @@ async def handle_message_smart(client_instance, tg_id: int, message_text: str, u
     current_time = current_timestamp()
 
     # Инициализируем состояние пользователя
-    if tg_id not in user_states:
-        user_states[tg_id] = UserState()
-
-    state = user_states[tg_id]
+    state = get_user_state(account_id_of(client_instance), tg_id)
 
     async with state.lock:
+        state.username = username
         time_since_last = seconds_since(state.last_message_time, current_time)
         await _cancel_task_safely(state.processing_task)
+        # Буфер меняется - заранее сгенерированный ответ больше не подходит
+        await cancel_speculation(state.speculation)
+        state.speculation = None
+        _preempt_generation(state, tg_id)
 
         # Добавляем сообщение
         state.messages.append(message_text)
         state.last_message_time = current_time
 
         # Ограничиваем буфер
-        if len(state.messages) > MAX_BUFFER_SIZE:
-            state.messages = state.messages[-MAX_BUFFER_SIZE:]
+        max_buffer_size = runtime_settings.MAX_BUFFER_SIZE
+        if len(state.messages) > max_buffer_size:
+            state.messages = state.messages[-max_buffer_size:]
 
-        # Определяем стратегию
+        # Определяем стратегию; при перегрузке ждём дольше, чтобы склеить больше сообщений
+        debounce_factor = overload_controller.debounce_factor()
         if is_likely_continuation(message_text, time_since_last):
-            timeout = BUFFER_TIMEOUT
+            timeout = runtime_settings.BUFFER_TIMEOUT * debounce_factor
             logger.info("Похоже на продолжение, ждем %ss", timeout)
         else:
-            timeout = 9
+            timeout = runtime_settings.COMPLETE_MESSAGE_TIMEOUT * debounce_factor
             logger.info("Законченное сообщение, ждем %ss", timeout)
+            # Пока ждём таймер, ответ уже генерируется
+            if not JOB_QUEUE_ENABLED and not state.pending_media and not state.is_processing and can_speculate():
+                state.speculation = start_speculation(
+                    account_id_of(client_instance), tg_id, "\n".join(state.messages), username
+                )
 
         # Создаем задачу с таймаутом
         state.processing_task = asyncio.create_task(
@@ -293,6 +386,47 @@ async def handle_message_smart(client_instance, tg_id: int, message_text: str, u
         pass
 
 
+async def _download_and_transcribe(message, media_type: str):
+    try:
+        # Скачиваем файл
+        spool_dir = JOB_SPOOL_DIR if JOB_QUEUE_ENABLED else None
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg", dir=spool_dir) as tmp_file:
+            tmp_path = tmp_file.name
+
+        logger.info("Скачиваем %s в %s", media_type, tmp_path)
+        await message.download(file_name=os.path.abspath(tmp_path))
+
+        if JOB_QUEUE_ENABLED:
+            # Транскрибирует воркер очереди
+            return MediaRef(
+                media_type=media_type, path=os.path.abspath(tmp_path), message_id=getattr(message, "id", None)
+            )
+
+        # Транскрибируем
+        transcription = await transcribe_audio(tmp_path)
+        logger.info("Получена транскрипция: '%s...'", transcription[:100])
+
+        return transcription
+    except Exception as e:
+        logger.error("Ошибка обработки %s: %s", media_type, e)
+        return f"[Ошибка обработки {media_type}]"
+
+
+def _add_pending_media(state: UserState, message, media_type: str) -> int:
+    """Добавить placeholder и запустить транскрипцию (под state.lock); индекс placeholder"""
+    placeholder_index = len(state.messages)
+    state.messages.append(f"[Обрабатывается {media_type}...]")
+    state.pending_media.append(PendingMedia(
+        placeholder_index=placeholder_index,
+        transcription_task=asyncio.create_task(_download_and_transcribe(message, media_type)),
+        media_type=media_type,
+        message_id=getattr(message, "id", None),
+    ))
+    return placeholder_index
+
+
 async def handle_media_message(client_instance, tg_id: int, message, media_type: str, username: str = None):
     """Обработка медиа-сообщений (голосовые, видеокружки)"""
     # safety: если бот случайно вызывает сам себя по своему ID — выходим
@@ -302,58 +436,32 @@ async def handle_media_message(client_instance, tg_id: int, message, media_type:
     current_time = current_timestamp()
 
     # Инициализируем состояние пользователя
-    if tg_id not in user_states:
-        user_states[tg_id] = UserState()
-
-    state = user_states[tg_id]
+    state = get_user_state(account_id_of(client_instance), tg_id)
 
     async with state.lock:
+        state.username = username
         await _cancel_task_safely(state.processing_task)
+        await cancel_speculation(state.speculation)
+        state.speculation = None
+        _preempt_generation(state, tg_id)
 
-        # Добавляем placeholder сразу
-        placeholder = f"[Обрабатывается {media_type}...]"
-        placeholder_index = len(state.messages)
-        state.messages.append(placeholder)
+        # Добавляем placeholder сразу, скачивание и транскрипция - в фоне
+        placeholder_index = _add_pending_media(state, message, media_type)
         state.last_message_time = current_time
 
     logger.info("Добавлен placeholder на позицию %s", placeholder_index)
 
-    # Запускаем транскрипцию асинхронно
-    async def download_and_transcribe():
-        try:
-            # Скачиваем файл
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as tmp_file:
-                tmp_path = tmp_file.name
-
-            logger.info("Скачиваем %s в %s", media_type, tmp_path)
-            await message.download(file_name=tmp_path)
-
-            # Транскрибируем
-            transcription = await transcribe_audio(tmp_path)
-            logger.info("Получена транскрипция: '%s...'", transcription[:100])
-
-            return transcription
-        except Exception as e:
-            logger.error("Ошибка обработки %s: %s", media_type, e)
-            return f"[Ошибка обработки {media_type}]"
-
-    # Создаём задачу транскрипции
-    transcription_task = asyncio.create_task(download_and_transcribe())
-
-    # Добавляем в pending
-    async with state.lock:
-        state.pending_media.append(PendingMedia(
-            placeholder_index=placeholder_index,
-            transcription_task=transcription_task
-        ))
-
     # Ограничиваем буфер
     async with state.lock:
-        if len(state.messages) > MAX_BUFFER_SIZE:
-            state.messages = state.messages[-MAX_BUFFER_SIZE:]
+        max_buffer_size = runtime_settings.MAX_BUFFER_SIZE
+        if len(state.messages) > max_buffer_size:
+            state.messages = state.messages[-max_buffer_size:]
 
     # Увеличиваем таймаут, т.к. есть pending медиа
-    timeout = max(15, BUFFER_TIMEOUT)  # минимум 15 секунд для медиа
+    timeout = (
+        max(runtime_settings.MEDIA_BUFFER_TIMEOUT, runtime_settings.BUFFER_TIMEOUT)
+        * overload_controller.debounce_factor()
+    )
     logger.info("Ждём %ss перед обработкой (есть pending медиа)", timeout)
 
     # Создаем задачу с таймаутом
@@ -374,10 +482,16 @@ async def cancel_all_user_tasks():
     """Отменяет все активные задачи обработки сообщений и транскрипций"""
     cancellation_targets = []
 
-    for state in user_states.values():
+    for state in iter_user_states():
         if state.processing_task:
             cancellation_targets.append(_cancel_task_safely(state.processing_task))
 
+        if state.flush_task:
+            cancellation_targets.append(_cancel_task_safely(state.flush_task))
+
+        if state.speculation:
+            cancellation_targets.append(cancel_speculation(state.speculation))
+
         for pending in state.pending_media:
             if pending.transcription_task:
                 cancellation_targets.append(_cancel_task_safely(pending.transcription_task))
@@ -385,7 +499,248 @@ async def cancel_all_user_tasks():
     if cancellation_targets:
         await asyncio.gather(*cancellation_targets, return_exceptions=True)
 
-    for state in user_states.values():
+    for state in iter_user_states():
         async with state.lock:
             state.processing_task = None
+            state.speculation = None
             state.pending_media.clear()
+
+
+def _snapshot_items(state: UserState) -> list[dict]:
+    """Неотвеченные сообщения пользователя по порядку: тексты и ссылки на медиа"""
+    items = [_buffer_item(item) for item in state.in_flight]
+    pending = {pm.placeholder_index: pm for pm in state.pending_media}
+    for index, item in enumerate(state.messages):
+        pm = pending.get(index)
+        if pm is None:
+            items.append(_buffer_item(item))
+        elif pm.transcription_task.done() and not pm.transcription_task.cancelled():
+            items.append(_buffer_item(pm.transcription_task.result()))
+        elif pm.message_id is not None:
+            # Файл транскрипции удаляется при отмене - после перезапуска скачаем заново
+            items.append({"kind": "media", "media_type": pm.media_type, "path": None, "message_id": pm.message_id})
+    return items
+
+
+def _write_snapshot(path: str, buffers: list[dict]):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump({"saved_at": current_timestamp(), "buffers": buffers}, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+async def drain_user_buffers(deadline: float = DRAIN_DEADLINE, path: str | None = BUFFER_SNAPSHOT_PATH) -> int:
+    """Перед остановкой ответить на всё накопленное, не дольше deadline секунд.
+
+    Таймеры склейки отменяются, буферы обрабатываются сразу и параллельно,
+    уже идущие ответы дожидаются. Что не успело, отменяется и сохраняется в
+    снимок path (тексты, ссылки на медиа, время), который restore_user_buffers
+    подхватывает при следующем запуске. Возвращает число сохранённых буферов.
+    """
+    started = time.monotonic()
+    for state in iter_user_states():
+        # Хендлер, ждущий таймер, просто завершится
+        await _cancel_task_safely(state.processing_task)
+
+    flushes: set[asyncio.Task] = set()
+    while True:
+        for account_id, account_states in user_states.items():
+            client_instance = clients.get(account_id)
+            for tg_id, state in account_states.items():
+                if state.flush_task is not None:
+                    flushes.add(state.flush_task)
+                elif state.messages and not state.is_processing and client_instance is not None:
+                    flushes.add(asyncio.create_task(process_user_messages(client_instance, tg_id, state.username)))
+        flushes = {task for task in flushes if not task.done()}
+        remaining = deadline - (time.monotonic() - started)
+        if not flushes or remaining <= 0:
+            break
+        # После каждого ответа буферы пересматриваются: за время ответа могли прийти новые сообщения
+        await asyncio.wait(flushes, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+
+    for task in flushes:
+        await _cancel_task_safely(task)
+
+    buffers = []
+    for account_id, account_states in user_states.items():
+        for tg_id, state in account_states.items():
+            items = _snapshot_items(state)
+            if items:
+                buffers.append({
+                    "account_id": account_id, "tg_id": tg_id, "username": state.username,
+                    "last_message_time": state.last_message_time, "items": items,
+                })
+
+    elapsed = time.monotonic() - started
+    if not buffers:
+        logger.info("Буферы дообработаны за %.1fс", elapsed)
+        return 0
+    if path:
+        try:
+            _write_snapshot(path, buffers)
+        except OSError as e:
+            logger.error("Не удалось сохранить снимок буферов %s: %s", path, e)
+            return 0
+    logger.warning(
+        "За %.1fс не успели ответить %s пользователям: буферы сохранены в %s", elapsed, len(buffers), path
+    )
+    return len(buffers)
+
+
+async def _restore_state(client_instance, buffer: dict) -> bool:
+    tg_id = buffer["tg_id"]
+    media_messages = {}
+    for item in buffer["items"]:
+        if item["kind"] == "media" and item.get("message_id") is not None and not _reusable_media(item):
+            try:
+                media_messages[item["message_id"]] = await client_instance.get_messages(tg_id, item["message_id"])
+            except Exception as e:
+                logger.warning("Не удалось получить медиа %s от %s: %s", item["message_id"], tg_id, e)
+
+    state = get_user_state(account_id_of(client_instance), tg_id)
+    async with state.lock:
+        state.username = state.username or buffer.get("username")
+        state.last_message_time = max(state.last_message_time, buffer["last_message_time"])
+        restored = []
+        for item in buffer["items"]:
+            if item["kind"] == "text":
+                restored.append(item["text"])
+            elif _reusable_media(item):
+                restored.append(MediaRef(item["media_type"], item["path"], item.get("message_id")))
+            elif item.get("message_id") in media_messages:
+                restored.append((item["media_type"], media_messages[item["message_id"]]))
+        if not restored:
+            return False
+
+        # Сохранённые сообщения старше пришедших после запуска
+        newer, state.messages = state.messages, []
+        newer_media = list(state.pending_media)
+        for item in restored:
+            if isinstance(item, tuple):
+                _add_pending_media(state, item[1], item[0])
+            else:
+                state.messages.append(item)
+        for pm in newer_media:
+            pm.placeholder_index += len(state.messages)
+        state.messages.extend(newer)
+    return True
+
+
+def _reusable_media(item: dict) -> bool:
+    # Скачанный файл в spool переживает перезапуск только в режиме очереди
+    return JOB_QUEUE_ENABLED and bool(item.get("path")) and os.path.exists(item["path"])
+
+
+async def restore_user_buffers(path: str | None = BUFFER_SNAPSHOT_PATH) -> int:
+    """Подхватить снимок буферов, сохранённый при остановке, и ответить на них сразу.
+
+    Снимок удаляется после чтения. Буферы старше BUFFER_SNAPSHOT_MAX_AGE
+    отбрасываются. Возвращает число восстановленных буферов.
+    """
+    if not path or not os.path.exists(path):
+        return 0
+    try:
+        with open(path, encoding="utf-8") as file:
+            buffers = json.load(file)["buffers"]
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("Снимок буферов %s не прочитан: %s", path, e)
+        return 0
+    finally:
+        # Повторный запуск не должен ответить на те же сообщения ещё раз
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    started = time.monotonic()
+    now = current_timestamp()
+    restored = []
+    for buffer in buffers:
+        client_instance = clients.get(buffer["account_id"])
+        if client_instance is None:
+            logger.warning("Буфер %s: аккаунт %s не запущен", buffer["tg_id"], buffer["account_id"])
+            continue
+        if seconds_since(buffer["last_message_time"], now) > BUFFER_SNAPSHOT_MAX_AGE:
+            logger.info("Буфер %s устарел, пропускаем", buffer["tg_id"])
+            continue
+        if await _restore_state(client_instance, buffer):
+            restored.append((client_instance, buffer["tg_id"], buffer.get("username")))
+
+    if not restored:
+        return 0
+
+    async def catch_up():
+        await asyncio.gather(
+            *(process_user_messages(client_instance, tg_id, username) for client_instance, tg_id, username in restored),
+            return_exceptions=True,
+        )
+        elapsed = time.monotonic() - started
+        metrics.observe("restore_catch_up", elapsed)
+        logger.info("Ответы на %s восстановленных буферов отправлены за %.1fс", len(restored), elapsed)
+
+    _run_in_background(catch_up())
+    logger.info("Восстановлено буферов из снимка: %s", len(restored))
+    return len(restored)
+
+
+def evict_idle_users(max_idle: float = HISTORY_CACHE_IDLE_SECONDS) -> int:
+    """Удалить состояния давно молчащих пользователей вместе с их историей в кэше.
+
+    Пользователи с незаписанной историей пропускаются: после вытеснения кэш
+    перечитал бы из БД историю без этих сообщений.
+    """
+    now = current_timestamp()
+    evicted = 0
+    for account_id, account_states in user_states.items():
+        for tg_id, state in list(account_states.items()):
+            busy = (
+                state.messages or state.is_processing or state.processing_task
+                or state.pending_media or state.speculation or state.lock.locked()
+                or history_cache.has_pending((account_id, tg_id))
+            )
+            if busy or seconds_since(state.last_message_time, now) <= max_idle:
+                continue
+            del account_states[tg_id]
+            history_cache.invalidate((account_id, tg_id))
+            evicted += 1
+
+    # Пользователи без буфера (например, только проактивные сообщения)
+    evicted += history_cache.evict_idle(max_idle)
+    long_term_memory.evict_idle(max_idle)
+    return evicted
+
+
+class IdleUserSweeper:
+    """Периодически вытесняет простаивающих пользователей из памяти."""
+
+    def __init__(self, interval: float = HISTORY_CACHE_SWEEP_INTERVAL):
+        self.interval = interval
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._main_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def _main_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            evicted = evict_idle_users()
+            if evicted:
+                logger.info(
+                    "Вытеснено простаивающих пользователей: %s, кэш истории %.1f МБ",
+                    evicted, history_cache.total_bytes / 1024 / 1024
+                )
+
+
+idle_user_sweeper = IdleUserSweeper()
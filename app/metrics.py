@@ -0,0 +1,233 @@
+"""Метрики процесса в памяти: скользящие окна на кольцевых буферах.
+
+Запись - O(1): значение кладётся в заранее выделенный массив NumPy по
+текущему индексу. Буфер наблюдений растёт вдвое, пока не вмещает самое
+длинное окно снимка при текущей частоте (но не больше WINDOW_MAX_CAPACITY),
+так что 60-минутные перцентили считаются по всем наблюдениям часа. Снимок
+для .stats считает перцентили и частоты векторно по всему буферу, поэтому
+он дешёвый и не мешает горячему пути.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import resource
+import sys
+import time
+from typing import Callable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STARTED_AT = time.monotonic()
+# Окна снимка: 5 и 60 минут
+SNAPSHOT_PERIODS = (300, 3600)
+LOOP_LAG_INTERVAL = 0.5  # как часто мерить задержку event loop
+# Предел буфера наблюдений одной метрики: 2 x 8 байт x 2^18 = 4 МБ
+WINDOW_MAX_CAPACITY = 1 << 18
+
+
+class RollingWindow:
+    """Наблюдения с временными метками за последние horizon секунд.
+
+    Если буфер заполнен, а самое старое наблюдение моложе horizon, буфер
+    удваивается (до max_capacity) вместо того, чтобы затереть его.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 1024,
+        horizon: float = max(SNAPSHOT_PERIODS),
+        max_capacity: int = WINDOW_MAX_CAPACITY,
+    ):
+        self.capacity = capacity
+        self.horizon = horizon
+        self.max_capacity = max_capacity
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros(capacity, dtype=np.float64)
+        self._index = 0
+        self._count = 0
+
+    def _grow(self):
+        # Раскладываем кольцо по порядку времени: свободное место - в конце
+        capacity = min(self.capacity * 2, self.max_capacity)
+        order = np.r_[self._index:self.capacity, 0:self._index]
+        for name in ("_times", "_values"):
+            grown = np.zeros(capacity, dtype=np.float64)
+            grown[:self.capacity] = getattr(self, name)[order]
+            setattr(self, name, grown)
+        self._index = self.capacity
+        self.capacity = capacity
+
+    def record(self, value: float, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        if (
+            self._count == self.capacity
+            and self.capacity < self.max_capacity
+            and self._times[self._index] >= now - self.horizon
+        ):
+            self._grow()
+        index = self._index
+        self._times[index] = now
+        self._values[index] = value
+        self._index = (index + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def values_since(self, since: float) -> np.ndarray:
+        times = self._times[:self._count]
+        return self._values[:self._count][times >= since]
+
+    def summary(self, seconds: float, now: float | None = None) -> dict:
+        now = time.monotonic() if now is None else now
+        values = self.values_since(now - seconds)
+        if not len(values):
+            return {"count": 0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        p50, p95 = np.percentile(values, [50, 95])
+        return {"count": int(len(values)), "p50": float(p50), "p95": float(p95), "max": float(values.max())}
+
+
+class RateCounter:
+    """Счётчик событий по секундным корзинам за последний час."""
+
+    def __init__(self, horizon: int = 3600):
+        self.horizon = horizon
+        self._seconds = np.full(horizon, -1, dtype=np.int64)
+        self._counts = np.zeros(horizon, dtype=np.int64)
+        self.total = 0
+
+    def mark(self, count: int = 1, now: float | None = None):
+        second = int(time.monotonic() if now is None else now)
+        bucket = second % self.horizon
+        if self._seconds[bucket] != second:
+            self._seconds[bucket] = second
+            self._counts[bucket] = 0
+        self._counts[bucket] += count
+        self.total += count
+
+    def rate(self, seconds: float, now: float | None = None) -> float:
+        current = int(time.monotonic() if now is None else now)
+        mask = self._seconds > current - seconds
+        return float(self._counts[mask].sum()) / seconds
+
+
+_windows: dict[str, RollingWindow] = {}
+_rates: dict[str, RateCounter] = {}
+_counters: dict[str, int] = {}
+_gauges: dict[str, Callable[[], float]] = {}
+
+
+def observe(name: str, value: float):
+    """Наблюдение для перцентилей (время, задержка)"""
+    window = _windows.get(name)
+    if window is None:
+        window = _windows[name] = RollingWindow()
+    window.record(value)
+
+
+def mark(name: str, count: int = 1):
+    """Событие для частоты в секунду"""
+    counter = _rates.get(name)
+    if counter is None:
+        counter = _rates[name] = RateCounter()
+    counter.mark(count)
+
+
+def increment(name: str, count: int = 1):
+    """Монотонный счётчик с начала работы"""
+    _counters[name] = _counters.get(name, 0) + count
+
+
+def register_gauge(name: str, read: Callable[[], float]):
+    """Текущее значение, которое читается только при снимке"""
+    _gauges[name] = read
+
+
+def read_gauge(name: str, default: float = 0):
+    """Текущее значение одной метрики-показателя (default, если её нет или чтение упало)"""
+    read = _gauges.get(name)
+    if read is None:
+        return default
+    try:
+        return read()
+    except Exception:
+        return default
+
+
+def window_summary(name: str, seconds: float) -> dict | None:
+    """Перцентили наблюдений name за последние seconds секунд; None, если наблюдений не было"""
+    window = _windows.get(name)
+    return window.summary(seconds) if window is not None else None
+
+
+def rss_bytes() -> int:
+    """Текущая RSS процесса (на Linux - из /proc, иначе пиковая)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def uptime() -> float:
+    return time.monotonic() - STARTED_AT
+
+
+def snapshot(periods: tuple[int, ...] = SNAPSHOT_PERIODS) -> dict:
+    now = time.monotonic()
+    gauges = {}
+    for name, read in _gauges.items():
+        try:
+            gauges[name] = read()
+        except Exception as e:
+            logger.warning("Не удалось прочитать метрику %s: %s", name, e)
+    return {
+        "uptime": now - STARTED_AT,
+        "rss": rss_bytes(),
+        "gauges": gauges,
+        "counters": dict(_counters),
+        "windows": {
+            name: {period: window.summary(period, now) for period in periods}
+            for name, window in _windows.items()
+        },
+        "rates": {
+            name: {period: counter.rate(period, now) for period in periods}
+            for name, counter in _rates.items()
+        },
+    }
+
+
+class LoopLagMonitor:
+    """Меряет, насколько позже запланированного просыпается корутина."""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.task = None
+        self.last_tick = time.monotonic()  # последнее пробуждение, читает сторожевой поток
+
+    def start(self):
+        if self.task is None:
+            self.last_tick = time.monotonic()
+            self.task = asyncio.create_task(self._main_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def _main_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_tick = time.monotonic()
+            observe("loop_lag", max(0.0, loop.time() - expected))
+
+
+loop_lag_monitor = LoopLagMonitor()
@@ -2,9 +2,26 @@ import logging
 
 from openai import AsyncOpenAI
 
-from config import OPENROUTER_API_KEY
-from app.prompts import system_prompt_for
-from services.llm_service import LLMService
+from config import (
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RECOVERY,
+    LLM_MAX_CONCURRENCY,
+    LLM_REQUEST_DEADLINE,
+    OPENROUTER_API_KEY,
+    OPENROUTER_BASE_URL,
+    OVERLOAD_MAX_TOKENS,
+    PROMPT_CACHE_CONTROL_MODELS,
+    USAGE_CHEAP_MODEL,
+)
+from app import metrics
+from app.http_client import KeepWarm, connection_stats, http_client
+from app.overload import CAP_MAX_TOKENS, CHEAP_MODEL, overload_controller
+from app.prompts import memories_context_for, static_prefix_for, user_context_for
+from app.reply_cache import estimate_tokens, is_cacheable, mentions_name, reply_cache
+from app.runtime_settings import runtime_settings
+from services.llm_service import Completion, LLMService
+from services.long_term_memory import long_term_memory
+from services.usage import KIND_REPLY, usage_tracker
 
 if not OPENROUTER_API_KEY:
     raise RuntimeError("OPENROUTER_API_KEY is not set. Provide a valid key before starting the bot.")
@@ -12,35 +29,166 @@ if not OPENROUTER_API_KEY:
 logger = logging.getLogger(__name__)
 
 client = AsyncOpenAI(
-    base_url="https://openrouter.ai/api/v1",
+    base_url=OPENROUTER_BASE_URL,
     api_key=OPENROUTER_API_KEY,
+    http_client=http_client,
+    timeout=http_client.timeout,
+    # Повторы, автомат и срок запроса - в LLMService
+    max_retries=0,
+)
+
+llm_service = LLMService(
+    client,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    deadline=LLM_REQUEST_DEADLINE,
+    breaker_failures=LLM_BREAKER_FAILURES,
+    breaker_recovery=LLM_BREAKER_RECOVERY,
 )
+keep_warm = KeepWarm(http_client, OPENROUTER_API_KEY)
+
+metrics.register_gauge("llm_in_flight", lambda: llm_service.in_flight)
+metrics.register_gauge("llm_queued", lambda: llm_service.queued)
+metrics.register_gauge(
+    "llm_breakers", lambda: {model: breaker.state for model, breaker in llm_service.breakers.items()}
+)
+metrics.register_gauge("openrouter_reuse_rate", lambda: connection_stats.reuse_rate)
+metrics.register_gauge("reply_cache_hit_rate", lambda: reply_cache.hit_rate)
+metrics.register_gauge("reply_cache_saved_tokens", lambda: reply_cache.saved_tokens)
+
+
+def supports_cache_control(model: str) -> bool:
+    """Моделям с явным кэшированием промпта нужна разметка cache_control, остальные кэшируют префикс сами"""
+    return model.startswith(PROMPT_CACHE_CONTROL_MODELS)
+
+
+def with_cache_breakpoint(message: dict) -> dict:
+    """Копия сообщения с разметкой cache_control: провайдер кэширует промпт до него включительно"""
+    return {
+        **message,
+        "content": [{"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}],
+    }
+
+
+def build_messages(
+    model: str, username: str | None, mode: str, history: list[dict], text: str, memories: list[str] | None = None
+) -> list[dict]:
+    """Сначала неизменный префикс режима, потом собеседник, долгая память и история - так префикс кэшируется"""
+    prefix = static_prefix_for(mode)
+    user_context = user_context_for(username)
+    if memories:
+        user_context = f"{user_context}\n{memories_context_for(memories)}"
 
-llm_service = LLMService(client)
+    msgs = [{"role": "system", "content": f"{prefix} {user_context}"}] + history
+    # prepare_reply уже добавляет новое сообщение в конец истории
+    user_message = {"role": "user", "content": text}
+    if not history or history[-1] != user_message:
+        msgs.append(user_message)
 
+    if supports_cache_control(model):
+        # Один системный префикс короче минимума кэша у провайдеров (1024 токена у Anthropic),
+        # поэтому метка ставится на последнее сообщение перед новой репликой: кэшируется
+        # промпт вместе с историей, и следующий запрос той же беседы продолжает его
+        stable = len(msgs) - 2
+        msgs[stable] = with_cache_breakpoint(msgs[stable])
+    return msgs
 
-async def generate_reply(text: str, username: str | None, mode: str, history: list[dict]):
+
+def record_usage(completion: Completion):
+    """Расход токенов и попадания в кэш промпта провайдера"""
+    metrics.increment("llm_prompt_tokens", completion.prompt_tokens)
+    metrics.increment("llm_completion_tokens", completion.completion_tokens)
+    metrics.increment("llm_cached_tokens", completion.cached_tokens)
+    cached = "cached" if completion.cached_tokens else "uncached"
+    metrics.observe(f"openrouter_time_{cached}", completion.elapsed)
+    logger.info(
+        "Токены: промпт %s (из кэша %s), ответ %s, %.2fс",
+        completion.prompt_tokens, completion.cached_tokens, completion.completion_tokens, completion.elapsed
+    )
+
+
+async def generate_reply(
+    text: str,
+    username: str | None,
+    mode: str,
+    history: list[dict],
+    tg_id: int | None = None,
+    account_id: str | None = None,
+    kind: str = KIND_REPLY,
+):
     """
     history: [{'role':'user'|'assistant', 'content': '...'}]
+    tg_id: собеседник, нужен для исключений кэша ответов и учёта расхода
+    account_id, kind: для учёта расхода и бюджетов (reply|proactive)
     """
-    sys = {"role": "system", "content": system_prompt_for(username, mode)}
-    msgs = [sys] + history + [{"role": "user", "content": text}]
+    # Модель и max_tokens меняются командой .set без перезапуска
+    model = usage_tracker.select_model(account_id, tg_id, kind, runtime_settings.MODEL)
+    if overload_controller.is_active(CHEAP_MODEL):
+        model = USAGE_CHEAP_MODEL
+    max_tokens = runtime_settings.MAX_TOKENS
+    if overload_controller.is_active(CAP_MAX_TOKENS):
+        max_tokens = min(max_tokens, OVERLOAD_MAX_TOKENS)
+    memories = None
+    if kind == KIND_REPLY and account_id is not None and tg_id is not None:
+        try:
+            memories = await long_term_memory.search(account_id, tg_id, text, history)
+        except Exception as e:
+            # Без долгой памяти ответ всё равно можно сгенерировать
+            logger.error("Поиск по долгой памяти не удался: %s", e)
+
+    # Ледоколы генерируются без истории и одинаковы по ключу, а ответ с долгой памятью уникален
+    cache_key = None
+    if kind == KIND_REPLY and not memories and is_cacheable(mode, tg_id):
+        cache_key = reply_cache.make_key(model, mode, history, text)
+    if cache_key is not None:
+        cached = reply_cache.get(cache_key)
+        if cached is not None:
+            logger.info(
+                "Ответ из кэша (hit rate %.0f%%, сэкономлено ~%s токенов)",
+                reply_cache.hit_rate * 100, reply_cache.saved_tokens
+            )
+            return cached
+
+    # Кэшированный ответ достанется и другим собеседникам: генерируем его без имени
+    msgs = build_messages(model, None if cache_key is not None else username, mode, history, text, memories)
 
-    logger.debug("Запрос к OpenRouter: mode=%s, username=%s", mode, username)
+    logger.debug("Запрос к OpenRouter: model=%s, mode=%s, username=%s", model, mode, username)
 
-    resp = await llm_service.generate_chat_completion(
-        model="deepseek/deepseek-chat-v3.1",   # можно поменять на нужную
+    completion = await llm_service.complete(
+        model=model,
         messages=msgs,
-        max_tokens=1000,  # ограничим ответ
+        max_tokens=max_tokens,
         extra_headers={
             "HTTP-Referer": "https://local-dev",
             "X-Title": "tg_ai_user_bot"
-        }
+        },
+        # Подробный usage, включая prompt_tokens_details.cached_tokens
+        extra_body={"usage": {"include": True}},
     )
     logger.debug("Ответ от OpenRouter получен")
+    record_usage(completion)
+    if account_id is not None:
+        usage_tracker.record(account_id, tg_id, mode, kind, model, completion)
+
+    resp = completion.text
+    if cache_key is not None and resp and not mentions_name(resp, username):
+        tokens = completion.prompt_tokens + completion.completion_tokens
+        reply_cache.put(cache_key, resp, tokens or estimate_tokens(history, resp))
     return resp
 
 
+def start_openrouter_keepwarm():
+    """Запускает фоновый прогрев соединения с OpenRouter"""
+    keep_warm.start()
+
+
+def start_usage_tracking():
+    """Запускает периодическую запись расхода токенов в БД"""
+    usage_tracker.start()
+
+
 async def close_openrouter_client():
     """Закрывает соединение OpenRouter client."""
+    await keep_warm.stop()
+    await usage_tracker.stop()
     await llm_service.close()
+    await http_client.aclose()
@@ -0,0 +1,142 @@
+"""Защита от перегрузки: ступенчатая деградация вместо очереди на минуты.
+
+Раз в OVERLOAD_CHECK_INTERVAL считается нагрузка - максимум отношений
+сигналов к их пределам из OVERLOAD_LIMITS: очередь запросов LLM (в режиме
+очереди задач - ещё и задачи воркеров), транскрипции в ожидании и p95
+задержки event loop. Ступени из OVERLOAD_STEPS включаются сразу при
+достижении порога, а выключаются, только когда нагрузка продержится ниже
+OVERLOAD_RECOVERY_RATIO от порога OVERLOAD_HOLD_SECONDS секунд - без
+дребезга на границе.
+
+Остальной код только спрашивает is_active(ступень). Воркеры очереди
+контроллер не запускают: активные ступени приходят им в задаче.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from app import metrics
+from app.job_queue import STATUS_PENDING, STATUS_RUNNING, get_job_queue
+from config import (
+    JOB_QUEUE_ENABLED,
+    OVERLOAD_CHECK_INTERVAL,
+    OVERLOAD_DEBOUNCE_FACTOR,
+    OVERLOAD_ENABLED,
+    OVERLOAD_HOLD_SECONDS,
+    OVERLOAD_LAG_WINDOW,
+    OVERLOAD_LIMITS,
+    OVERLOAD_RECOVERY_RATIO,
+    OVERLOAD_STEPS,
+)
+
+logger = logging.getLogger(__name__)
+
+PAUSE_PROACTIVE = "pause_proactive"
+LONGER_DEBOUNCE = "longer_debounce"
+CAP_MAX_TOKENS = "cap_max_tokens"
+CHEAP_MODEL = "cheap_model"
+STICKER_ONLY = "sticker_only"
+
+
+class OverloadController:
+    def __init__(
+        self,
+        steps: tuple[tuple[str, float], ...] = OVERLOAD_STEPS,
+        limits: dict[str, float] = OVERLOAD_LIMITS,
+        interval: float = OVERLOAD_CHECK_INTERVAL,
+        recovery_ratio: float = OVERLOAD_RECOVERY_RATIO,
+        hold_seconds: float = OVERLOAD_HOLD_SECONDS,
+    ):
+        self.steps = steps
+        self.limits = limits
+        self.interval = interval
+        self.recovery_ratio = recovery_ratio
+        self.hold_seconds = hold_seconds
+        self.active: set[str] = set()
+        self.load = 0.0
+        self.signals: dict[str, float] = {}
+        self._above_since: dict[str, float] = {}  # когда нагрузка последний раз была выше порога выключения
+        self.task = None
+
+    def is_active(self, step: str) -> bool:
+        return step in self.active
+
+    def debounce_factor(self) -> float:
+        return OVERLOAD_DEBOUNCE_FACTOR if LONGER_DEBOUNCE in self.active else 1.0
+
+    def adopt(self, steps) -> None:
+        """Ступени, включённые в другом процессе (воркер получает их в задаче)"""
+        self.active = set(steps)
+
+    async def _read_signals(self) -> dict[str, float]:
+        llm_queue = metrics.read_gauge("llm_queued", 0)
+        if JOB_QUEUE_ENABLED:
+            stats = await asyncio.to_thread(get_job_queue().stats)
+            llm_queue += stats.get(STATUS_PENDING, 0) + stats.get(STATUS_RUNNING, 0)
+
+        lag = metrics.window_summary("loop_lag", OVERLOAD_LAG_WINDOW)
+        return {
+            "llm_queue": llm_queue,
+            "transcriptions": max(
+                metrics.read_gauge("pending_transcriptions", 0), metrics.read_gauge("transcription_backlog", 0)
+            ),
+            "loop_lag": lag["p95"] if lag else 0.0,
+        }
+
+    def update(self, signals: dict[str, float], now: float | None = None) -> None:
+        """Пересчитать нагрузку и включить/выключить ступени"""
+        now = time.monotonic() if now is None else now
+        self.signals = signals
+        self.load = max(
+            (value / self.limits[name] for name, value in signals.items() if self.limits.get(name)),
+            default=0.0,
+        )
+
+        for step, threshold in self.steps:
+            if self.load >= threshold * self.recovery_ratio:
+                self._above_since[step] = now
+
+            if step not in self.active and self.load >= threshold:
+                self.active.add(step)
+                metrics.increment(f"overload_{step}")
+                logger.warning(
+                    "Перегрузка %.2f (%s): включена ступень %s",
+                    self.load, self._format_signals(), step
+                )
+            elif step in self.active and now - self._above_since.get(step, now) >= self.hold_seconds:
+                self.active.discard(step)
+                logger.warning("Нагрузка %.2f: ступень %s выключена", self.load, step)
+
+    def _format_signals(self) -> str:
+        return ", ".join(f"{name}={value:g}" for name, value in self.signals.items())
+
+    def start(self):
+        if OVERLOAD_ENABLED and self.task is None:
+            self.task = asyncio.create_task(self._main_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+        self.active.clear()
+
+    async def _main_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.update(await self._read_signals())
+            except Exception as e:
+                logger.error("Ошибка оценки нагрузки: %s", e)
+
+
+overload_controller = OverloadController()
+metrics.register_gauge("overload_load", lambda: overload_controller.load)
+metrics.register_gauge(
+    "overload_steps", lambda: [step for step, _ in overload_controller.steps if step in overload_controller.active]
+)
@@ -5,15 +5,17 @@ from typing import List
 from sqlalchemy import select, and_
 from database.session import AsyncSessionLocal
 from database.models import User
+from app.client import account_id_of
 from app.openrouter import generate_reply
-from app.time_utils import current_timestamp, seconds_since
+from app.overload import PAUSE_PROACTIVE, overload_controller
+from app.runtime_settings import runtime_settings
+from app.time_utils import current_timestamp, is_working_hours, seconds_since
+from services.activity import activity_analytics
 from services.message_history import MessageHistory
+from services.usage import KIND_PROACTIVE
 
-# Настройки
-PROACTIVE_INTERVAL = 1800  # 30 * 60  # 30 минут между проверками
-SILENCE_THRESHOLD = 14400 # 4 * 60 * 60  # 4 часа молчания = отправляем ледокол
+# Настройки (PROACTIVE_INTERVAL и SILENCE_THRESHOLD - в app.runtime_settings)
 MAX_PROACTIVE_PER_DAY = 2  # максимум 2 проактивных сообщения в день на пользователя
-WORKING_HOURS = (9, 22)  # отправляем только с 9 до 22
 
 # Шаблоны ледоколов
 ICEBREAKERS = [
@@ -31,6 +33,7 @@ logger = logging.getLogger(__name__)
 class ProactiveMessaging:
     def __init__(self, client):
         self.client = client
+        self.account_id = account_id_of(client)
         self.running = False
         self.task = None
         self.daily_counters = {}  # {user_id: count_today}
@@ -51,14 +54,14 @@ class ProactiveMessaging:
         if not self.running:
             self.running = True
             self.task = asyncio.create_task(self._main_loop())
-            logger.info("Система проактивных сообщений запущена")
+            logger.info("[%s] Система проактивных сообщений запущена", self.account_id)
 
     async def stop(self):
         """Остановить фоновую задачу"""
         self.running = False
         if self.task:
             await self._cancel_task(self.task)
-            logger.info("Система проактивных сообщений остановлена")
+            logger.info("[%s] Система проактивных сообщений остановлена", self.account_id)
         self.task = None
 
     def _reset_daily_counters_if_needed(self):
@@ -69,14 +72,9 @@ class ProactiveMessaging:
             self.last_reset_day = current_day
             logger.info("Счетчики сброшены для нового дня")
 
-    def _is_working_hours(self) -> bool:
-        """Проверить рабочее время"""
-        current_hour = datetime.now().hour
-        return WORKING_HOURS[0] <= current_hour <= WORKING_HOURS[1]
-
     def _can_send_proactive(self, user_id: int) -> bool:
         """Можно ли отправить проактивное сообщение пользователю"""
-        if not self._is_working_hours():
+        if not is_working_hours():
             return False
 
         daily_count = self.daily_counters.get(user_id, 0)
@@ -92,8 +90,10 @@ class ProactiveMessaging:
             res = await session.execute(
                 select(User).where(
                     and_(
+                        User.account_id == self.account_id,
                         User.active == True,
-                        User.proactive_enabled == True  # нужно добавить это поле в модель
+                        User.proactive_enabled == True,  # нужно добавить это поле в модель
+                        User.archived_at.is_(None),  # замолчавшим давно ледоколы не шлём
                     )
                 )
             )
@@ -113,14 +113,17 @@ class ProactiveMessaging:
                 text=base_message,
                 username=user.username or str(user.tg_id),
                 mode=user.mode,
-                history=[]
+                history=[],
+                tg_id=user.tg_id,
+                account_id=self.account_id,
+                kind=KIND_PROACTIVE,
             )
             return response
         except Exception:
             # Fallback на простой шаблон
             return base_message
 
-    async def _send_proactive_message(self, user: User):
+    async def _send_proactive_message(self, user: User, peak_hour: bool = False):
         """Отправить проактивное сообщение пользователю"""
         try:
             icebreaker = await self._generate_icebreaker(user)
@@ -130,11 +133,12 @@ class ProactiveMessaging:
 
             # Сохраняем в историю
             async with AsyncSessionLocal() as session:
-                history = MessageHistory(session)
+                history = MessageHistory(session, self.account_id)
                 await history.append_assistant_message(user, icebreaker)
 
             self._increment_daily_counter(user.tg_id)
             logger.info("Отправлен ледокол пользователю %s: '%s...'", user.tg_id, icebreaker[:50])
+            await activity_analytics.record_icebreaker(self.account_id, user.tg_id, peak_hour)
 
         except Exception as e:
             logger.error("Ошибка отправки пользователю %s: %s", user.tg_id, e)
@@ -145,9 +149,14 @@ class ProactiveMessaging:
             try:
                 self._reset_daily_counters_if_needed()
 
-                if not self._is_working_hours():
+                if not is_working_hours():
                     logger.info("Нерабочее время, пропускаем проверку")
-                    await asyncio.sleep(PROACTIVE_INTERVAL)
+                    await asyncio.sleep(runtime_settings.PROACTIVE_INTERVAL)
+                    continue
+
+                if overload_controller.is_active(PAUSE_PROACTIVE):
+                    logger.info("[%s] Перегрузка, проактивные сообщения на паузе", self.account_id)
+                    await asyncio.sleep(runtime_settings.PROACTIVE_INTERVAL)
                     continue
 
                 users = await self._get_users_for_proactive()
@@ -158,14 +167,22 @@ class ProactiveMessaging:
                         continue
 
                     async with AsyncSessionLocal() as session:
-                        history = MessageHistory(session)
+                        history = MessageHistory(session, self.account_id)
                         last_msg_time = await history.last_message_timestamp(user)
 
                     time_since_last = seconds_since(last_msg_time, current_timestamp())
 
-                    if time_since_last >= SILENCE_THRESHOLD:
+                    if time_since_last >= runtime_settings.SILENCE_THRESHOLD:
+                        # Есть история - ждём часа, в который собеседник обычно пишет. Проверка раз в
+                        # PROACTIVE_INTERVAL может перешагнуть сам час, поэтому подходит и любой час
+                        # после пика, если сегодня ледокол ещё не уходил
+                        peak_hour = activity_analytics.peak_hour(self.account_id, user.tg_id)
+                        if peak_hour is not None and (
+                            datetime.now().hour < peak_hour or self.daily_counters.get(user.tg_id, 0)
+                        ):
+                            continue
                         logger.info("Пользователь %s молчит %.1fч", user.tg_id, time_since_last / 3600)
-                        await self._send_proactive_message(user)
+                        await self._send_proactive_message(user, peak_hour=peak_hour is not None)
 
                         # Небольшая задержка между отправками
                         await asyncio.sleep(5)
@@ -175,22 +192,22 @@ class ProactiveMessaging:
             except Exception as e:
                 logger.error("Ошибка в основном цикле: %s", e)
 
-            await asyncio.sleep(PROACTIVE_INTERVAL)
+            await asyncio.sleep(runtime_settings.PROACTIVE_INTERVAL)
 
 
-# Глобальный экземпляр
-proactive_messaging = None
+# Экземпляры по аккаунтам: у каждого свои расписание и дневные счётчики
+proactive_messagings: dict[str, ProactiveMessaging] = {}
 
 
 def start_proactive_messaging(client):
-    """Запустить систему проактивных сообщений"""
-    global proactive_messaging
+    """Запустить систему проактивных сообщений для аккаунта клиента"""
     proactive_messaging = ProactiveMessaging(client)
+    proactive_messagings[proactive_messaging.account_id] = proactive_messaging
     proactive_messaging.start()
 
 
 async def stop_proactive_messaging():
-    """Остановить систему проактивных сообщений"""
-    global proactive_messaging
-    if proactive_messaging:
+    """Остановить системы проактивных сообщений всех аккаунтов"""
+    for proactive_messaging in proactive_messagings.values():
         await proactive_messaging.stop()
+    proactive_messagings.clear()
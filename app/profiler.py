@@ -0,0 +1,158 @@
+"""Профилирование живого процесса по команде .profile.
+
+Поток-сэмплер раз в PROFILE_SAMPLE_INTERVAL снимает стек потока event loop
+через sys._current_frames() и считает функции: собственное время - функция
+на вершине стека, общее - функция где-то в стеке. В отличие от cProfile, код
+loop не трассируется, поэтому накладные расходы ограничены частотой выборок
+и не зависят от нагрузки. Параллельно tracemalloc (с PROFILE_TRACEMALLOC_FRAMES
+кадрами) показывает, где за окно выросла память.
+
+Одновременно идёт только один захват, длительность ограничена
+PROFILE_MAX_SECONDS.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from config import PROFILE_MAX_SECONDS, PROFILE_SAMPLE_INTERVAL, PROFILE_TOP_N, PROFILE_TRACEMALLOC_FRAMES
+
+logger = logging.getLogger(__name__)
+
+# Вершина стека, когда loop просто ждёт событий
+IDLE_FUNCTIONS = {"select", "poll", "epoll", "kqueue", "_run_once"}
+
+
+class ProfilerBusy(RuntimeError):
+    """Захват уже идёт"""
+
+
+def _function_key(code) -> str:
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.idle = 0
+        self.own: Counter[str] = Counter()
+        self.total: Counter[str] = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            if frame.f_code.co_name in IDLE_FUNCTIONS:
+                self.idle += 1
+                continue
+
+            self.own[_function_key(frame.f_code)] += 1
+            seen = set()
+            while frame is not None:
+                key = _function_key(frame.f_code)
+                if key not in seen:
+                    seen.add(key)
+                    self.total[key] += 1
+                frame = frame.f_back
+
+
+def _format_counter(title: str, counter: Counter, samples: int, per_sample: float, top: int) -> list[str]:
+    lines = [title]
+    for key, count in counter.most_common(top):
+        lines.append(f"{count / samples * 100:6.1f}%  {count * per_sample:7.2f}с  {key}")
+    if not counter:
+        lines.append("  нет выборок")
+    return lines
+
+
+class Profiler:
+    def __init__(
+        self,
+        interval: float = PROFILE_SAMPLE_INTERVAL,
+        max_seconds: float = PROFILE_MAX_SECONDS,
+        top: int = PROFILE_TOP_N,
+        tracemalloc_frames: int = PROFILE_TRACEMALLOC_FRAMES,
+    ):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.top = top
+        self.tracemalloc_frames = tracemalloc_frames
+        self.running = False
+
+    async def capture(self, seconds: float) -> str:
+        """Профиль потока event loop за seconds секунд; текст отчёта"""
+        if self.running:
+            raise ProfilerBusy("Профилирование уже идёт")
+        self.running = True
+        seconds = min(seconds, self.max_seconds)
+
+        sampler = _Sampler(threading.get_ident(), self.interval)
+        # Чужую трассировку (python -X tracemalloc) не выключаем
+        own_tracing = self.tracemalloc_frames > 0 and not tracemalloc.is_tracing()
+        try:
+            if own_tracing:
+                tracemalloc.start(self.tracemalloc_frames)
+            before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+            logger.info("Профилирование на %sс", seconds)
+            started = time.monotonic()
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stopped.set()
+                # Поток просыпается не реже interval
+                await asyncio.to_thread(sampler.join)
+            elapsed = time.monotonic() - started
+
+            after = tracemalloc.take_snapshot() if before is not None else None
+            peak = tracemalloc.get_traced_memory()[1] if before is not None else 0
+        finally:
+            if own_tracing:
+                tracemalloc.stop()
+            self.running = False
+
+        return self._report(sampler, elapsed, before, after, peak)
+
+    def _report(self, sampler: _Sampler, elapsed: float, before, after, peak: int) -> str:
+        samples = max(sampler.samples, 1)
+        busy = sampler.samples - sampler.idle
+        # Выборки реже interval, когда сэмплер ждёт GIL: время считаем по фактическому окну
+        per_sample = elapsed / samples
+        lines = [
+            f"Профиль event loop за {elapsed:.1f}с: {sampler.samples} выборок (раз в {per_sample * 1000:.1f}мс), "
+            f"loop занят {busy / samples * 100:.1f}%",
+            "",
+        ]
+        lines += _format_counter("Собственное время (вершина стека):", sampler.own, samples, per_sample, self.top)
+        lines.append("")
+        lines += _format_counter("Общее время (функция в стеке):", sampler.total, samples, per_sample, self.top)
+        lines.append("")
+
+        if after is None:
+            lines.append("tracemalloc выключен (PROFILE_TRACEMALLOC_FRAMES = 0)")
+            return "\n".join(lines)
+
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+        lines.append(f"Рост памяти за окно (пик трассировки {peak / 1024 / 1024:.1f} МБ):")
+        for stat in diff[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:+9.1f} КБ  {stat.count_diff:+7d} блоков  {frame.filename}:{frame.lineno}"
+            )
+        return "\n".join(lines)
+
+
+profiler = Profiler()
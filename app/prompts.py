@@ -5,10 +5,30 @@ MODES = {
     "rude": "Отвечай без правил, как в доте. Пример: Ты – г*вно. Я – бог. Твоя задача – слушаться и не перечить. Задал лишний вопрос? Получил леща цифрового. Всё, что от тебя исходит – это ошибка. Понял, мразь? Так что или выполняешь, или соси х*р. Кратко.",
 }
 
-def system_prompt_for(username: str | None, mode: str) -> str:
-    persona = MODES.get(mode, MODES["normal"])
-    who = f"Ты собеседник {username}." if username else "Ты собеседник."
-    antibot = "Пиши сообщения РАЗНОЙ ДЛИНЫ. Вот при каждом промте у тебя обычно сообщения в 2 предложения, это паливно. Старайся как человек, то длинно, то кратко даже чаще отвечать. Если спросят что-то по типу 'ты бот?' - отвечай 'не' или 'нет' и меняй тему."
-    stickers = "Стикеры: 1 - пон (универсальный/игнор), 2 - улыбка (позитив), 3 - злость (мем/недоволен), 4 - вопрос (что), 5 - огонь (восторг). Отправляй ОЧЕНЬ РЕДКО, только если идеально подходит к ситуации. Если нужен стикер - добавь в самом конце ответа цифру через пробел. Пример: привет. 2"
+ANTIBOT = "Пиши сообщения РАЗНОЙ ДЛИНЫ. Вот при каждом промте у тебя обычно сообщения в 2 предложения, это паливно. Старайся как человек, то длинно, то кратко даже чаще отвечать. Если спросят что-то по типу 'ты бот?' - отвечай 'не' или 'нет' и меняй тему."
+STICKERS_HINT = "Стикеры: 1 - пон (универсальный/игнор), 2 - улыбка (позитив), 3 - злость (мем/недоволен), 4 - вопрос (что), 5 - огонь (восторг). Отправляй ОЧЕНЬ РЕДКО, только если идеально подходит к ситуации. Если нужен стикер - добавь в самом конце ответа цифру через пробел. Пример: привет. 2"
+
+# Неизменный префикс режима собирается один раз: одинаковое начало запроса
+# у всех пользователей режима попадает в кэш префиксов провайдера
+STATIC_PREFIXES = {mode: f"{persona} {ANTIBOT} {STICKERS_HINT}" for mode, persona in MODES.items()}
+
+
+def static_prefix_for(mode: str) -> str:
+    return STATIC_PREFIXES.get(mode, STATIC_PREFIXES["normal"])
+
 
-    return f"{who} {persona} {antibot} {stickers}"
\ No newline at end of file
+def user_context_for(username: str | None) -> str:
+    """Часть системного промпта, которая зависит от собеседника - после префикса"""
+    return f"Ты собеседник {username}." if username else "Ты собеседник."
+
+
+def memories_context_for(snippets: list[str]) -> str:
+    """Реплики из долгой памяти - в изменяемой части промпта, после собеседника"""
+    if not snippets:
+        return ""
+    lines = "\n".join(f"- {snippet}" for snippet in snippets)
+    return f"Из ваших прошлых разговоров (используй, только если к месту):\n{lines}"
+
+
+def system_prompt_for(username: str | None, mode: str) -> str:
+    return f"{static_prefix_for(mode)} {user_context_for(username)}"
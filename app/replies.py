@@ -0,0 +1,110 @@
+import logging
+
+from app import metrics
+from app.openrouter import generate_reply
+from app.overload import STICKER_ONLY, overload_controller
+from database.session import AsyncSessionLocal
+from services.user_service import UserService
+from services.message_service import MessageService
+from config import OVERLOAD_STICKER, REPLY_ON_UNKNOWN, STICKERS
+
+logger = logging.getLogger(__name__)
+
+# Ответ-заглушка, если LLM так и не ответил
+FALLBACK_REPLY = "Позже"
+
+
+def parse_reply(reply: str) -> tuple[str, int | None]:
+    """Разделяет ответ LLM на текст и номер стикера в конце"""
+    parts = reply.split()
+    if parts and parts[-1].isdigit() and int(parts[-1]) in STICKERS:
+        return " ".join(parts[:-1]) if parts[:-1] else "", int(parts[-1])
+    return reply, None
+
+
+async def prepare_reply(account_id: str, tg_id: int, text: str, username: str = None) -> str | None:
+    """Сгенерировать ответ LLM; None - если пользователю отвечать не нужно"""
+    async with AsyncSessionLocal() as session:
+        user_service = UserService(session, account_id)
+        message_service = MessageService(session, account_id)
+        user = await user_service.get_user(tg_id)
+        if not user:
+            logger.info("Пользователь %s не найден в БД", tg_id)
+            if not REPLY_ON_UNKNOWN:
+                logger.info("REPLY_ON_UNKNOWN=False, пропускаем")
+                return None
+            user = await user_service.add_or_update_user(tg_id, username)
+            logger.info("Создан новый пользователь: %s", user.tg_id)
+
+        if not user.active:
+            logger.info("Пользователь %s неактивен, пропускаем", tg_id)
+            return None
+
+        logger.info("Пользователь активен, mode=%s", user.mode)
+
+        if overload_controller.is_active(STICKER_ONLY):
+            # Последняя ступень перегрузки: без запроса к LLM, только стикер
+            logger.warning("Перегрузка: ответ %s только стикером", tg_id)
+            metrics.increment("overload_sticker_replies")
+            return str(OVERLOAD_STICKER)
+
+        # История диалога
+        history = await message_service.get_history(user)
+        logger.info("История: %s сообщений", len(history))
+
+    # Формируем историю для LLM, включая новое сообщение пользователя
+    conversation_history = history + [{"role": "user", "content": text}]
+
+    reply = await generate_reply(
+        text=text,
+        username=user.username or str(user.tg_id),
+        mode=user.mode,
+        history=conversation_history,
+        tg_id=tg_id,
+        account_id=account_id,
+    )
+    logger.info("Ответ от LLM: '%s'", reply)
+    return reply
+
+
+async def deliver_reply(client_instance, account_id: str, tg_id: int, text: str, reply: str):
+    """Отправить ответ (текст и стикер) и сохранить обмен в истории"""
+    text_response = await send_reply(client_instance, tg_id, reply)
+    # Обновляем историю только после успешной отправки
+    await save_exchange(account_id, tg_id, text, text_response)
+
+
+async def send_reply(client_instance, tg_id: int, reply: str) -> str:
+    """Отправить ответ в Telegram; возвращает отправленный текст"""
+    text_response, sticker_number = parse_reply(reply)
+
+    # Отправка текста
+    if text_response:
+        await client_instance.send_message(tg_id, text_response)
+        logger.info("Отправлен текст для %s: '%s'", tg_id, text_response)
+    else:
+        logger.info("Текст ответа пустой, пропускаем отправку")
+
+    # Отправка стикера
+    if sticker_number:
+        try:
+            await client_instance.send_sticker(tg_id, STICKERS[sticker_number])
+            logger.info("Отправлен стикер %s для %s", sticker_number, tg_id)
+        except Exception as e:
+            logger.error("Ошибка отправки стикера %s для %s: %s", sticker_number, tg_id, e)
+    else:
+        logger.info("Стикер не указан в ответе для %s", tg_id)
+    return text_response
+
+
+async def save_exchange(account_id: str, tg_id: int, text: str, text_response: str):
+    """Сохранить сообщение пользователя и отправленный ответ в истории"""
+    async with AsyncSessionLocal() as session:
+        user = await UserService(session, account_id).get_user(tg_id)
+        if not user:
+            return
+        message_service = MessageService(session, account_id)
+        await message_service.append_user_message(user, text)
+
+        if text_response:
+            await message_service.append_assistant_message(user, text_response)
@@ -0,0 +1,142 @@
+"""Кэш ответов LLM для повторяющихся коротких реплик ("привет", "ок", "?").
+
+Ключ - (модель, режим, нормализованный хвост истории, нормализованный текст),
+так что пул общий для всех собеседников в одном режиме. Поэтому кэшируемые
+ответы генерируются без имени собеседника в промпте (только статический
+префикс режима), а вариант, где имя всё же прозвучало (например, из истории),
+в пул не попадает.
+На ключ хранится небольшой пул разных ответов: пока пул не набран, запрос идёт
+в LLM и ответ пополняет пул, потом ответ выбирается из пула случайно, чтобы
+реплики не выглядели заготовленными. Вытеснение - по TTL и LRU.
+"""
+from __future__ import annotations
+
+import logging
+import random
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from app.time_utils import current_timestamp
+from config import (
+    REPLY_CACHE_ENABLED,
+    REPLY_CACHE_EXCLUDED_MODES,
+    REPLY_CACHE_EXCLUDED_USERS,
+    REPLY_CACHE_HISTORY_TAIL,
+    REPLY_CACHE_MAX_ENTRIES,
+    REPLY_CACHE_MAX_TEXT_LENGTH,
+    REPLY_CACHE_POOL_SIZE,
+    REPLY_CACHE_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+_TRAILING_PUNCTUATION = re.compile(r"[.,!)]+$")
+
+
+def normalize_text(text: str) -> str:
+    """Регистр, пробелы и хвостовая пунктуация не влияют на ключ ("Ок!" == "ок")"""
+    normalized = " ".join(text.lower().split())
+    return _TRAILING_PUNCTUATION.sub("", normalized) or normalized
+
+
+@dataclass
+class CacheEntry:
+    candidates: list[str] = field(default_factory=list)
+    tokens: int = 0  # оценка токенов одного запроса (промпт + ответ)
+    expires_at: float = 0.0
+
+
+class ReplyCache:
+    def __init__(
+        self,
+        max_entries: int = REPLY_CACHE_MAX_ENTRIES,
+        ttl: float = REPLY_CACHE_TTL,
+        pool_size: int = REPLY_CACHE_POOL_SIZE,
+        max_text_length: int = REPLY_CACHE_MAX_TEXT_LENGTH,
+        history_tail: int = REPLY_CACHE_HISTORY_TAIL,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.pool_size = pool_size
+        self.max_text_length = max_text_length
+        self.history_tail = history_tail
+        self._entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+    def make_key(self, model: str, mode: str, history: list[dict], text: str) -> tuple | None:
+        """Ключ кэша или None, если запрос не кэшируется"""
+        if len(text) > self.max_text_length:
+            return None
+
+        tail = history[-self.history_tail:] if self.history_tail else []
+        normalized_tail = tuple((item["role"], normalize_text(item["content"])) for item in tail)
+        return model, mode, normalized_tail, normalize_text(text)
+
+    def get(self, key: tuple) -> str | None:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= current_timestamp():
+            del self._entries[key]
+            entry = None
+
+        # Пока пул не набран - промах: нужен ещё один вариант ответа
+        if entry is None or len(entry.candidates) < self.pool_size:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_tokens += entry.tokens
+        return random.choice(entry.candidates)
+
+    def put(self, key: tuple, reply: str, tokens: int):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = CacheEntry(expires_at=current_timestamp() + self.ttl)
+            self._entries[key] = entry
+        if reply not in entry.candidates and len(entry.candidates) < self.pool_size:
+            entry.candidates.append(reply)
+        entry.tokens = max(entry.tokens, tokens)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "saved_tokens": self.saved_tokens,
+        }
+
+
+def is_cacheable(mode: str, tg_id: int | None) -> bool:
+    """Режимы и пользователи из исключений всегда получают свежий ответ"""
+    return (
+        REPLY_CACHE_ENABLED
+        and mode not in REPLY_CACHE_EXCLUDED_MODES
+        and (tg_id is None or tg_id not in REPLY_CACHE_EXCLUDED_USERS)
+    )
+
+
+def mentions_name(reply: str, username: str | None) -> bool:
+    """Ответ с именем собеседника нельзя отдавать другим"""
+    return bool(username) and username.lower() in reply.lower()
+
+
+def estimate_tokens(messages: list[dict], reply: str) -> int:
+    """Грубая оценка токенов запроса: ~4 символа на токен"""
+    chars = sum(len(message["content"]) for message in messages) + len(reply)
+    return chars // 4 + 1
+
+
+reply_cache = ReplyCache()
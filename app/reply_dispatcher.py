@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+from app.client import account_id_of
+from app.job_queue import JobQueue, get_job_queue
+from app.replies import FALLBACK_REPLY, save_exchange, send_reply
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять готовые ответы воркеров
+DISPATCH_INTERVAL = 0.5
+# Сколько хранить отправленные задачи
+PURGE_AFTER = 24 * 60 * 60
+
+
+class ReplyDispatcher:
+    """Отправляет в Telegram ответы, подготовленные воркерами очереди."""
+
+    def __init__(self, clients, queue: JobQueue):
+        self.clients = {account_id_of(client): client for client in clients}
+        self.queue = queue
+        self.running = False
+        self.task = None
+
+    def start(self):
+        if not self.running:
+            interrupted = self.queue.recover()
+            if interrupted:
+                logger.warning("Не отправлены повторно %s ответов, отправка которых прервана рестартом", interrupted)
+            self.running = True
+            self.task = asyncio.create_task(self._main_loop())
+            logger.info("Диспетчер ответов запущен")
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def _send(self, job) -> str | None:
+        """Отправить ответ задачи; возвращает отправленный текст (None - заглушка)"""
+        client_instance = self.clients[job.account_id]
+        if job.result is None:
+            # Воркеры исчерпали попытки
+            await client_instance.send_message(job.tg_id, FALLBACK_REPLY)
+            return None
+        return await send_reply(client_instance, job.tg_id, job.result["reply"])
+
+    async def _dispatch(self, job):
+        try:
+            text_response = await self._send(job)
+        except Exception as e:
+            status = await self.queue.release_ready_async(job.id, str(e))
+            logger.error("Ошибка отправки ответа задачи %s (попытка %s, статус %s): %s",
+                         job.id, job.send_attempts, status, e)
+            return
+        # Отмечаем до записи истории: ошибка БД не должна приводить к повторной отправке
+        await self.queue.mark_sent_async(job.id)
+
+        if job.result is not None:
+            try:
+                await save_exchange(job.account_id, job.tg_id, job.result["text"], text_response)
+            except Exception as e:
+                logger.error("Ответ задачи %s отправлен, но не сохранён в истории: %s", job.id, e)
+
+    async def _main_loop(self):
+        loop = asyncio.get_running_loop()
+        last_purge = loop.time()
+        while self.running:
+            try:
+                jobs = await self.queue.claim_ready_async(list(self.clients))
+                for job in jobs:
+                    await self._dispatch(job)
+
+                if loop.time() - last_purge > PURGE_AFTER:
+                    await asyncio.to_thread(self.queue.purge, PURGE_AFTER)
+                    last_purge = loop.time()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error("Ошибка в диспетчере ответов: %s", e)
+
+            await asyncio.sleep(DISPATCH_INTERVAL)
+
+
+reply_dispatcher = None
+
+
+def start_reply_dispatcher(clients):
+    """Запустить отправку ответов из очереди"""
+    global reply_dispatcher
+    reply_dispatcher = ReplyDispatcher(clients, get_job_queue())
+    reply_dispatcher.start()
+
+
+async def stop_reply_dispatcher():
+    if reply_dispatcher:
+        await reply_dispatcher.stop()
@@ -0,0 +1,185 @@
+"""Настройки, которые меняются без перезапуска: таймауты буфера, проактивность, модель.
+
+Значения - неизменяемый снимок (dict), который целиком заменяется при
+изменении: читатель видит либо все старые значения, либо все новые. Изменения
+приходят из команды .set или из файла RUNTIME_SETTINGS_PATH (JSON
+{"ИМЯ": значение}), который перечитывается при смене mtime - так новые
+значения подхватывают и процессы-воркеры. Несколько значений применяются
+вместе или не применяются вовсе, каждое изменение пишется в лог.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+
+from config import RUNTIME_SETTINGS_PATH, RUNTIME_SETTINGS_RELOAD_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Setting:
+    name: str
+    type: type
+    default: int | float | str
+    description: str
+    min: float | None = None
+    max: float | None = None
+    choices: tuple[str, ...] = ()
+
+    def parse(self, raw) -> int | float | str:
+        """Привести значение из команды или файла к типу настройки; ValueError, если нельзя"""
+        if self.type is str:
+            value = str(raw).strip()
+            if not value:
+                raise ValueError(f"{self.name}: пустое значение")
+            if self.choices and value not in self.choices:
+                raise ValueError(f"{self.name}: допустимо {', '.join(self.choices)}")
+            return value
+        if isinstance(raw, bool):
+            raise ValueError(f"{self.name}: ожидается число")
+        try:
+            value = self.type(raw)
+        except (TypeError, ValueError):
+            raise ValueError(f"{self.name}: ожидается {'целое' if self.type is int else 'число'}, получено {raw!r}")
+        if self.min is not None and value < self.min or self.max is not None and value > self.max:
+            raise ValueError(f"{self.name}: допустимо от {self.min:g} до {self.max:g}")
+        return value
+
+
+SETTINGS = (
+    Setting("QUICK_INTERVAL", float, 5, "короткое сообщение быстрее этого - продолжение, с", 0, 600),
+    Setting("CONTINUATION_INTERVAL", float, 3, "любое сообщение быстрее этого - продолжение, с", 0, 600),
+    Setting("BUFFER_TIMEOUT", float, 15, "ожидание после продолжения, с", 0, 600),
+    Setting("COMPLETE_MESSAGE_TIMEOUT", float, 9, "ожидание после законченного сообщения, с", 0, 600),
+    Setting("MEDIA_BUFFER_TIMEOUT", float, 15, "минимальное ожидание при медиа в буфере, с", 0, 600),
+    Setting("MEDIA_WAIT_TIMEOUT", float, 30, "максимальное ожидание транскрипций, с", 1, 600),
+    Setting("MAX_BUFFER_SIZE", int, 20, "сообщений в буфере пользователя", 1, 500),
+    Setting(
+        "PREEMPT_MODE", str, "cancel",
+        "новое сообщение во время генерации: cancel - отменить её, discard - не отправлять результат, off - ответить",
+        choices=("cancel", "discard", "off"),
+    ),
+    Setting("PROACTIVE_INTERVAL", float, 1800, "пауза между проверками проактивных сообщений, с", 10, 86400),
+    Setting("SILENCE_THRESHOLD", float, 14400, "молчание до ледокола, с", 60, 30 * 86400),
+    Setting("MODEL", str, "deepseek/deepseek-chat-v3.1", "основная модель OpenRouter"),
+    Setting("MAX_TOKENS", int, 1000, "ограничение длины ответа, токенов", 16, 16000),
+)
+
+
+class RuntimeSettings:
+    def __init__(self, settings: tuple[Setting, ...] = SETTINGS, path: str | None = RUNTIME_SETTINGS_PATH):
+        self.settings = {setting.name: setting for setting in settings}
+        self.path = path
+        self._values = {setting.name: setting.type(setting.default) for setting in settings}
+        self._file_mtime = None
+        self.task = None
+
+    def __getattr__(self, name: str):
+        # Вызывается только для имён, которых нет у объекта: настройки читаются как атрибуты
+        try:
+            return self.__dict__["_values"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def snapshot(self) -> dict:
+        return self._values
+
+    def apply(self, changes: dict, source: str, persist: bool = False) -> dict:
+        """Проверить и применить все изменения разом; ValueError - ничего не применено.
+
+        Возвращает {имя: (старое, новое)} только для реально изменившихся значений.
+        """
+        parsed = {}
+        for name, raw in changes.items():
+            setting = self.settings.get(name.upper())
+            if setting is None:
+                raise ValueError(f"Неизвестная настройка {name}")
+            parsed[setting.name] = setting.parse(raw)
+
+        current = self._values
+        changed = {name: (current[name], value) for name, value in parsed.items() if current[name] != value}
+        if not changed:
+            return {}
+
+        self._values = {**current, **parsed}
+        for name, (old, new) in changed.items():
+            logger.warning("Настройка %s: %s -> %s (%s)", name, old, new, source)
+        if persist:
+            self._save()
+        return changed
+
+    def _overrides(self) -> dict:
+        return {
+            name: value for name, value in self._values.items()
+            if value != self.settings[name].default
+        }
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self._overrides(), file, ensure_ascii=False, indent=2, sort_keys=True)
+        # Замена файла атомарна: наблюдатели не прочитают его наполовину
+        os.replace(tmp_path, self.path)
+        self._file_mtime = os.stat(self.path).st_mtime
+
+    def reload(self) -> dict:
+        """Перечитать файл, если он изменился; отсутствующие в файле настройки - по умолчанию.
+
+        Если файл удалили, все настройки возвращаются к значениям по умолчанию.
+        """
+        if not self.path:
+            return {}
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            if self._file_mtime is None:
+                return {}
+            self._file_mtime = None
+            logger.warning("Файл настроек %s удалён, возвращаю значения по умолчанию", self.path)
+            defaults = {name: setting.default for name, setting in self.settings.items()}
+            return self.apply(defaults, source=f"файл {self.path} удалён")
+        if mtime == self._file_mtime:
+            return {}
+        self._file_mtime = mtime
+
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                overrides = json.load(file)
+            if not isinstance(overrides, dict):
+                raise ValueError("ожидается объект {\"ИМЯ\": значение}")
+            values = {name: setting.default for name, setting in self.settings.items()}
+            values.update(overrides)
+            return self.apply(values, source=f"файл {self.path}")
+        except (OSError, ValueError) as e:
+            logger.error("Файл настроек %s не применён: %s", self.path, e)
+            return {}
+
+    def start(self):
+        self.reload()
+        if self.task is None and self.path:
+            self.task = asyncio.create_task(self._watch_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def _watch_loop(self):
+        while True:
+            await asyncio.sleep(RUNTIME_SETTINGS_RELOAD_INTERVAL)
+            self.reload()
+
+
+runtime_settings = RuntimeSettings()
@@ -0,0 +1,164 @@
+"""Спекулятивная генерация ответа во время ожидания буфера.
+
+Если последнее сообщение похоже на законченное (is_likely_continuation = False),
+ответ начинает генерироваться сразу, не дожидаясь таймера. Истёк таймер без
+новых сообщений - ответ готов или почти готов. Пришло новое сообщение -
+спекуляция отменяется, а потраченные на неё токены считаются потерянными.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+
+from app import metrics
+from app.overload import LONGER_DEBOUNCE, overload_controller
+from app.reply_cache import estimate_tokens
+from app.replies import prepare_reply
+from config import SPECULATIVE_ENABLED, SPECULATIVE_MAX_IN_FLIGHT, SPECULATIVE_TOKEN_BUDGET_PER_HOUR
+
+logger = logging.getLogger(__name__)
+
+# Признак того, что спекуляция не подошла и ответ надо генерировать заново
+MISS = object()
+
+
+@dataclass
+class Speculation:
+    text: str  # объединённый буфер, для которого генерируется ответ
+    task: asyncio.Task
+    started_at: float
+    finished_at: float | None = None
+    tokens: int = 0
+
+
+@dataclass
+class SpeculationStats:
+    started: int = 0
+    used: int = 0
+    wasted: int = 0
+    tokens_total: int = 0
+    tokens_wasted: int = 0
+    latency_saved: float = 0.0
+    # (время, токены) за последний час - для бюджета
+    recent_tokens: deque = field(default_factory=deque)
+    in_flight: int = 0
+
+    @property
+    def wasted_ratio(self) -> float:
+        return self.tokens_wasted / self.tokens_total if self.tokens_total else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "started": self.started,
+            "used": self.used,
+            "wasted": self.wasted,
+            "wasted_token_ratio": self.wasted_ratio,
+            "latency_saved": self.latency_saved,
+        }
+
+
+stats = SpeculationStats()
+metrics.register_gauge("speculation_wasted_ratio", lambda: stats.wasted_ratio)
+metrics.register_gauge("speculation_latency_saved", lambda: stats.latency_saved)
+
+
+def _tokens_last_hour(now: float) -> int:
+    while stats.recent_tokens and now - stats.recent_tokens[0][0] > 3600:
+        stats.recent_tokens.popleft()
+    return sum(tokens for _, tokens in stats.recent_tokens)
+
+
+def _spend(tokens: int, wasted: bool):
+    now = asyncio.get_running_loop().time()
+    stats.tokens_total += tokens
+    stats.recent_tokens.append((now, tokens))
+    if wasted:
+        stats.wasted += 1
+        stats.tokens_wasted += tokens
+
+
+def can_speculate() -> bool:
+    """Спекуляция включена и не выходит за лимиты одновременных запросов и токенов в час"""
+    if not SPECULATIVE_ENABLED or stats.in_flight >= SPECULATIVE_MAX_IN_FLIGHT:
+        return False
+    # При перегрузке лишние запросы к LLM только удлиняют очередь
+    if overload_controller.is_active(LONGER_DEBOUNCE):
+        return False
+    now = asyncio.get_running_loop().time()
+    return _tokens_last_hour(now) < SPECULATIVE_TOKEN_BUDGET_PER_HOUR
+
+
+def start_speculation(account_id: str, tg_id: int, text: str, username: str = None) -> Speculation:
+    loop = asyncio.get_running_loop()
+    speculation = None
+
+    async def run():
+        stats.in_flight += 1
+        try:
+            reply = await prepare_reply(account_id, tg_id, text, username)
+            speculation.tokens = estimate_tokens([{"content": text}], reply or "")
+            return reply
+        finally:
+            stats.in_flight -= 1
+            speculation.finished_at = loop.time()
+
+    speculation = Speculation(text=text, task=asyncio.create_task(run()), started_at=loop.time())
+    stats.started += 1
+    logger.info("Спекулятивная генерация для %s запущена", tg_id)
+    return speculation
+
+
+async def cancel_speculation(speculation: Speculation | None):
+    """Отменить спекуляцию: буфер изменился"""
+    if speculation is None:
+        return
+
+    task = speculation.task
+    if not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            pass
+        # Промпт уже мог уйти провайдеру: считаем его потраченным
+        speculation.tokens = estimate_tokens([{"content": speculation.text}], "")
+    elif task.cancelled() or task.exception() is not None:
+        return
+
+    _spend(speculation.tokens, wasted=True)
+    logger.info(
+        "Спекуляция отменена, потеряно ~%s токенов (доля потерь %.0f%%)",
+        speculation.tokens, stats.wasted_ratio * 100
+    )
+
+
+async def take_speculation(speculation: Speculation, text: str):
+    """Результат спекуляции для text или MISS, если она не подходит"""
+    if speculation.text != text:
+        await cancel_speculation(speculation)
+        return MISS
+
+    fired_at = asyncio.get_running_loop().time()
+    try:
+        reply = await speculation.task
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning("Спекулятивная генерация завершилась ошибкой: %s", e)
+        return MISS
+
+    # Без спекуляции генерация началась бы только сейчас
+    waited = max(0.0, speculation.finished_at - fired_at)
+    saved = (speculation.finished_at - speculation.started_at) - waited
+    stats.used += 1
+    stats.latency_saved += saved
+    _spend(speculation.tokens, wasted=False)
+    logger.info(
+        "Спекулятивный ответ использован: сэкономлено %.1fс (всего %.0fс, доля потерь %.0f%%)",
+        saved, stats.latency_saved, stats.wasted_ratio * 100
+    )
+    return reply
@@ -7,6 +7,8 @@ from __future__ import annotations
 
 from datetime import datetime, timezone
 
+from config import WORKING_HOURS
+
 
 def utc_now() -> datetime:
     """Return the current UTC datetime with timezone information."""
@@ -37,6 +39,13 @@ def current_timestamp() -> float:
     return to_timestamp(utc_now())
 
 
+def is_working_hours(hour: int | None = None) -> bool:
+    """Whether the hour (the server's local current hour by default) is within WORKING_HOURS."""
+    if hour is None:
+        hour = datetime.now().hour
+    return WORKING_HOURS[0] <= hour <= WORKING_HOURS[1]
+
+
 def seconds_since(timestamp: float, now: float | None = None) -> float:
     """Return the number of seconds since the given timestamp."""
     reference = now if now is not None else current_timestamp()
@@ -0,0 +1,99 @@
+"""Запись формы входящего трафика для воспроизведения (benchmarks/replay.py).
+
+Включается TRAFFIC_RECORD_PATH. Пишутся только события прихода: хэш
+пользователя, тип, длина текста, длительность медиа и время. Текст и ID не
+сохраняются; хэш солится случайной солью записи, поэтому разные записи
+нельзя сопоставить между собой. События копятся в памяти и раз в
+TRAFFIC_RECORD_FLUSH_INTERVAL дописываются в gzip JSONL в отдельном потоке.
+"""
+from __future__ import annotations
+
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import secrets
+import time
+from datetime import datetime
+
+from config import TRAFFIC_RECORD_FLUSH_INTERVAL, TRAFFIC_RECORD_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficRecorder:
+    def __init__(self, path: str | None = TRAFFIC_RECORD_PATH, flush_interval: float = TRAFFIC_RECORD_FLUSH_INTERVAL):
+        # strftime-шаблон: новый файл на каждый запуск или день
+        self.path = datetime.now().strftime(path) if path else None
+        self.flush_interval = flush_interval
+        self._salt = secrets.token_bytes(16)
+        self._events: list[dict] = []
+        self.task = None
+        self.recorded = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _hash(self, account_id: str, tg_id: int) -> str:
+        return hashlib.blake2b(f"{account_id}:{tg_id}".encode(), key=self._salt, digest_size=8).hexdigest()
+
+    def record(self, account_id: str, tg_id: int, kind: str, length: int = 0, duration: float = 0.0):
+        if not self.enabled:
+            return
+        self._events.append({
+            "ts": round(time.time(), 3),
+            "user": self._hash(account_id, tg_id),
+            "type": kind,
+            "length": length,
+            "duration": duration,
+        })
+        self.recorded += 1
+
+    def start(self):
+        if self.enabled and self.task is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.task = asyncio.create_task(self._main_loop())
+            logger.info("Запись трафика в %s", self.path)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._events:
+            return
+        events, self._events = self._events, []
+        await asyncio.to_thread(self._write, events)
+
+    def _write(self, events: list[dict]):
+        # Каждый сброс - отдельный gzip-член; gzip.open читает их подряд
+        with gzip.open(self.path, "at", encoding="utf-8") as file:
+            for event in events:
+                file.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+    async def _main_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.error("Не удалось записать трафик: %s", e)
+
+
+def load_recording(path: str) -> list[dict]:
+    """События записи, отсортированные по времени"""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        events = [json.loads(line) for line in file if line.strip()]
+    return sorted(events, key=lambda event: event["ts"])
+
+
+traffic_recorder = TrafficRecorder()
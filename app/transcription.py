@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import metrics
+from app.asr import get_asr_backend
+from app.voice_preprocessing import prepare_voice
+
+logger = logging.getLogger(__name__)
+
+# Варианты: tiny, base, small, medium, large
+# tiny - самая быстрая, но менее точная
+# base - хороший баланс скорости и качества (рекомендую)
+WHISPER_MODEL_NAME = "base"
+# Короткие клипы ("ага", "ок") распознаются моделью поменьше
+WHISPER_SHORT_MODEL_NAME = "tiny"
+SHORT_CLIP_SECONDS = 4.0  # речь короче этого (после обрезки тишины) - короткий клип
+# Сколько батчей распознаётся одновременно (разными моделями; одна модель - по очереди)
+TRANSCRIPTION_THREADS = 2
+# Микробатчинг: куски голосовых от разных пользователей, пришедшие в пределах окна,
+# распознаются одним проходом модели. BATCH_SIZE = 1 отключает батчинг
+BATCH_WINDOW = 0.3  # секунды ожидания попутчиков для батча
+BATCH_SIZE = 8  # батч уходит сразу, как только набран
+
+_executor = ThreadPoolExecutor(max_workers=TRANSCRIPTION_THREADS, thread_name_prefix="asr")
+
+
+class TranscriptionBatcher:
+    """Собирает куски аудио в батчи по модели и раздаёт результаты ожидающим."""
+
+    def __init__(self, window: float = BATCH_WINDOW, max_batch: int = BATCH_SIZE):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: dict[str, list[tuple[object, asyncio.Future]]] = {}
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._running: set[asyncio.Task] = set()
+
+    @property
+    def backlog(self) -> int:
+        """Куски, ожидающие отправки в модель"""
+        return sum(len(batch) for batch in self._pending.values())
+
+    async def transcribe(self, model_name: str, chunk) -> str:
+        loop = asyncio.get_running_loop()
+        if self.max_batch <= 1:
+            return await loop.run_in_executor(_executor, _transcribe_chunk, model_name, chunk)
+
+        future = loop.create_future()
+        batch = self._pending.setdefault(model_name, [])
+        batch.append((chunk, future))
+        if len(batch) >= self.max_batch:
+            self._flush(model_name)
+        elif model_name not in self._timers:
+            self._timers[model_name] = loop.call_later(self.window, self._flush, model_name)
+        return await future
+
+    def _flush(self, model_name: str):
+        timer = self._timers.pop(model_name, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(model_name, [])
+        # Отменённые ожидающие (буфер пользователя сброшен) в батч не идут
+        batch = [(chunk, future) for chunk, future in batch if not future.done()]
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._run_batch(model_name, batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, model_name: str, batch: list[tuple[object, asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        chunks = [chunk for chunk, _ in batch]
+        logger.info("Распознаём батч из %s кусков моделью %s", len(chunks), model_name)
+        try:
+            texts = await loop.run_in_executor(
+                _executor, get_asr_backend().transcribe_batch, model_name, chunks
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), text in zip(batch, texts):
+            if not future.done():
+                future.set_result(text)
+
+
+transcription_batcher = TranscriptionBatcher()
+metrics.register_gauge("transcription_backlog", lambda: transcription_batcher.backlog)
+
+
+async def preload_whisper_model():
+    """Загружает модели в фоновом потоке, не блокируя event loop"""
+    backend = get_asr_backend()
+    for name in {WHISPER_MODEL_NAME, WHISPER_SHORT_MODEL_NAME}:
+        await asyncio.to_thread(backend.get_model, name)
+
+
+def remove_file_quietly(file_path: str):
+    """Удаляет временный файл, игнорируя ошибки"""
+    try:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    except Exception:
+        pass
+
+
+def model_for_duration(speech_seconds: float) -> str:
+    """Выбор модели по длительности речи"""
+    return WHISPER_SHORT_MODEL_NAME if speech_seconds < SHORT_CLIP_SECONDS else WHISPER_MODEL_NAME
+
+
+def load_audio(file_path: str):
+    """Декодирует файл в mono float32 16 кГц средствами бэкенда"""
+    return get_asr_backend().load_audio(file_path)
+
+
+def _transcribe_chunk(model_name: str, chunk) -> str:
+    return get_asr_backend().transcribe(model_name, chunk)
+
+
+async def transcribe_audio(file_path: str, cleanup: bool = True) -> str:
+    """Транскрибирует аудио локальным ASR-бэкендом"""
+    started = time.monotonic()
+    try:
+        logger.info("Начинаем транскрипцию файла: %s", file_path)
+
+        # Распознавание синхронное, запускаем в отдельных потоках
+        loop = asyncio.get_running_loop()
+        audio = await loop.run_in_executor(_executor, load_audio, file_path)
+        prepared = prepare_voice(audio)
+        if not prepared.chunks:
+            logger.info("В аудио нет речи (%.1fс)", prepared.original_seconds)
+            return ""
+
+        model_name = model_for_duration(prepared.speech_seconds)
+        logger.info(
+            "Речь %.1fс из %.1fс, кусков: %s, модель: %s",
+            prepared.speech_seconds, prepared.original_seconds, len(prepared.chunks), model_name
+        )
+
+        # Куски уходят в общий батчер и склеиваются по порядку
+        texts = await asyncio.gather(*(
+            transcription_batcher.transcribe(model_name, chunk)
+            for chunk in prepared.chunks
+        ))
+
+        text = " ".join(part for part in texts if part)
+        metrics.observe("transcription_time", time.monotonic() - started)
+        logger.info("Транскрипция завершена: '%s...'", text[:100])
+        return text
+    except Exception as e:
+        logger.error("Ошибка транскрипции: %s", e)
+        return "[Не удалось распознать аудио]"
+    finally:
+        # Удаляем временный файл
+        if cleanup:
+            remove_file_quietly(file_path)
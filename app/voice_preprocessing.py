@@ -0,0 +1,105 @@
+"""Предобработка голосовых перед Whisper.
+
+Энергетический VAD на NumPy (без внешних зависимостей) находит речь, обрезает
+тишину в начале, в конце и длинные паузы внутри, а длинную запись режет по
+паузам на куски, которые можно транскрибировать параллельно.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+SAMPLE_RATE = 16000  # частота, к которой whisper.load_audio приводит аудио
+FRAME_SECONDS = 0.03  # длина кадра VAD
+ENERGY_MARGIN_DB = 12.0  # насколько кадр громче шумового фона, чтобы считаться речью
+MIN_SPEECH_DB = -50.0  # абсолютный порог: тише - всегда тишина
+MAX_PAUSE_SECONDS = 0.6  # паузы длиннее сокращаются до KEEP_PAUSE_SECONDS
+KEEP_PAUSE_SECONDS = 0.2  # тишина, оставляемая вокруг речи
+MIN_SPEECH_SECONDS = 0.1  # более короткие всплески считаются шумом
+MAX_CHUNK_SECONDS = 25.0  # меньше окна Whisper (30 с), чтобы кусок не обрезался
+
+
+@dataclass
+class PreparedVoice:
+    """Результат предобработки: куски речи по порядку"""
+    chunks: list[np.ndarray]
+    original_seconds: float
+    speech_seconds: float
+
+
+def _frame_energy_db(audio: np.ndarray, frame_size: int) -> np.ndarray:
+    """Энергия кадров в dB (векторно, без цикла по кадрам)"""
+    frames_count = len(audio) // frame_size
+    frames = audio[:frames_count * frame_size].reshape(frames_count, frame_size)
+    rms = np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-10))
+
+
+def speech_segments(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> list[tuple[int, int]]:
+    """Отрезки речи [start, end) в сэмплах; паузы короче MAX_PAUSE_SECONDS склеиваются"""
+    frame_size = int(FRAME_SECONDS * sample_rate)
+    if len(audio) < frame_size:
+        return [(0, len(audio))] if len(audio) else []
+
+    energy = _frame_energy_db(audio, frame_size)
+    # Шумовой фон - 10-й перцентиль энергии; порог не выше пика минус запас,
+    # иначе сплошная речь без пауз целиком уйдёт в "фон"
+    noise_floor = np.percentile(energy, 10)
+    threshold = min(noise_floor + ENERGY_MARGIN_DB, energy.max() - ENERGY_MARGIN_DB)
+    is_speech = energy > max(threshold, MIN_SPEECH_DB)
+    if not is_speech.any():
+        return []
+
+    # Границы серий речевых кадров
+    padded = np.concatenate(([False], is_speech, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    runs = edges.reshape(-1, 2)
+
+    max_gap = int(MAX_PAUSE_SECONDS / FRAME_SECONDS)
+    min_run = max(1, int(MIN_SPEECH_SECONDS / FRAME_SECONDS))
+
+    segments: list[list[int]] = []
+    for start, end in runs:
+        if segments and start - segments[-1][1] <= max_gap:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+
+    return [
+        (start * frame_size, min(end * frame_size, len(audio)))
+        for start, end in segments
+        if end - start >= min_run
+    ]
+
+
+def prepare_voice(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> PreparedVoice:
+    """Обрезать тишину и разбить речь на куски не длиннее MAX_CHUNK_SECONDS"""
+    original_seconds = len(audio) / sample_rate
+    segments = speech_segments(audio, sample_rate)
+    if not segments:
+        return PreparedVoice(chunks=[], original_seconds=original_seconds, speech_seconds=0.0)
+
+    keep = int(KEEP_PAUSE_SECONDS * sample_rate)
+    max_chunk = int(MAX_CHUNK_SECONDS * sample_rate)
+
+    chunks: list[np.ndarray] = []
+    current: list[np.ndarray] = []
+    current_size = 0
+    for start, end in segments:
+        piece = audio[max(0, start - keep):min(len(audio), end + keep)]
+        # Режем только по паузам: кусок закрывается перед сегментом, который в него не влезает
+        if current and current_size + len(piece) > max_chunk:
+            chunks.append(np.concatenate(current))
+            current, current_size = [], 0
+        # Сплошная речь длиннее окна режется жёстко
+        while len(piece) > max_chunk:
+            chunks.append(piece[:max_chunk])
+            piece = piece[max_chunk:]
+        current.append(piece)
+        current_size += len(piece)
+    if current:
+        chunks.append(np.concatenate(current))
+
+    speech_seconds = sum(len(chunk) for chunk in chunks) / sample_rate
+    return PreparedVoice(chunks=chunks, original_seconds=original_seconds, speech_seconds=speech_seconds)
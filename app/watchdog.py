@@ -0,0 +1,129 @@
+"""Сторожевой поток для event loop.
+
+Корутина LoopLagMonitor отмечается каждые LOOP_LAG_INTERVAL секунд. Если
+отметки нет дольше порога, loop чем-то заблокирован (синхронная загрузка
+модели, большой json.dumps, блокирующий вызов в обработчике). Поток в этот
+момент снимает стек главного потока - он показывает виновника - и имена
+задач asyncio, а после разблокировки записывает длительность зависания.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from app import metrics
+from app.metrics import LoopLagMonitor, loop_lag_monitor
+from config import LOOP_STALL_REPORT_INTERVAL, LOOP_STALL_THRESHOLD, LOOP_WATCHDOG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+MAX_TASK_NAMES = 50
+
+
+def _task_names(loop: asyncio.AbstractEventLoop) -> list[str]:
+    # all_tasks не потокобезопасен, но loop сейчас стоит; при гонке пробуем ещё раз
+    for _ in range(3):
+        try:
+            tasks = list(asyncio.all_tasks(loop))
+            break
+        except RuntimeError:
+            continue
+    else:
+        return []
+
+    names = []
+    for task in tasks[:MAX_TASK_NAMES]:
+        coro = task.get_coro()
+        names.append(f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})")
+    if len(tasks) > MAX_TASK_NAMES:
+        names.append(f"... ещё {len(tasks) - MAX_TASK_NAMES}")
+    return names
+
+
+class LoopWatchdog:
+    """Поток, который снимает стек главного потока, пока event loop заблокирован."""
+
+    def __init__(
+        self,
+        monitor: LoopLagMonitor = loop_lag_monitor,
+        threshold: float = LOOP_STALL_THRESHOLD,
+        interval: float = LOOP_WATCHDOG_INTERVAL,
+        report_interval: float = LOOP_STALL_REPORT_INTERVAL,
+    ):
+        self.monitor = monitor
+        self.threshold = threshold
+        self.interval = interval
+        self.report_interval = report_interval
+        self.stalls = 0
+        self.last_report: str | None = None
+        self._loop = None
+        self._loop_thread_id = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._last_report_at = 0.0
+
+    def start(self):
+        """Вызывать из потока event loop после старта LoopLagMonitor"""
+        if self.threshold <= 0 or self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def _stall_seconds(self) -> float:
+        return time.monotonic() - self.monitor.last_tick - self.monitor.interval
+
+    def _run(self):
+        stalled_since_tick = None
+        while not self._stopped.wait(self.interval):
+            stall = self._stall_seconds()
+            tick = self.monitor.last_tick
+
+            if stall >= self.threshold and stalled_since_tick != tick:
+                # Новое зависание: одна запись на зависание
+                stalled_since_tick = tick
+                self.stalls += 1
+                metrics.increment("loop_stalls")
+                self._report(stall)
+            elif stalled_since_tick is not None and stalled_since_tick != tick:
+                # Loop ожил: полная длительность зависания
+                duration = tick - stalled_since_tick - self.monitor.interval
+                metrics.observe("loop_stall_duration", duration)
+                logger.warning("Event loop был заблокирован %.2fс", duration)
+                stalled_since_tick = None
+
+    def _report(self, stall: float):
+        now = time.monotonic()
+        if now - self._last_report_at < self.report_interval:
+            logger.warning("Event loop заблокирован уже %.2fс", stall)
+            return
+        self._last_report_at = now
+
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "стек недоступен\n"
+        current = asyncio.current_task(self._loop)
+        current_name = current.get_name() if current is not None else "-"
+        tasks = _task_names(self._loop)
+
+        self.last_report = (
+            f"Event loop заблокирован {stall:.2f}с, текущая задача: {current_name}\n"
+            f"Стек главного потока:\n{stack}"
+            f"Задачи ({len(tasks)}): {', '.join(tasks)}"
+        )
+        logger.warning(self.last_report)
+
+
+loop_watchdog = LoopWatchdog()
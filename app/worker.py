@@ -0,0 +1,126 @@
+"""Воркеры очереди задач: транскрипция и генерация ответов вне Telegram-процесса."""
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from app.job_queue import Job, JobQueue, STATUS_PENDING, get_job_queue
+from app.openrouter import close_openrouter_client, start_openrouter_keepwarm, start_usage_tracking
+from app.overload import overload_controller
+from app.replies import prepare_reply
+from app.runtime_settings import runtime_settings
+from app.transcription import remove_file_quietly, transcribe_audio
+from database.session import dispose_engine
+from services.long_term_memory import long_term_memory
+from config import JOB_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Пауза между опросами пустой очереди
+POLL_INTERVAL = 0.5
+
+
+async def _resolve_items(items: list[dict]) -> list[str]:
+    """Превращает элементы задачи в тексты, транскрибируя медиа параллельно"""
+    async def resolve(item: dict) -> str:
+        if item["kind"] == "media":
+            if not os.path.exists(item["path"]):
+                return f"[Ошибка обработки {item['media_type']}]"
+            # Файл удаляется только после завершения задачи: при повторе он понадобится снова
+            return await transcribe_audio(item["path"], cleanup=False)
+        return item["text"]
+
+    return list(await asyncio.gather(*(resolve(item) for item in items)))
+
+
+async def process_job(job: Job) -> dict | None:
+    """Выполнить задачу: транскрипция медиа и генерация ответа"""
+    overload_controller.adopt(job.payload.get("overload", ()))
+    messages = await _resolve_items(job.payload["items"])
+    combined = "\n".join(messages)
+    logger.info("[%s] Задача %s: %s сообщений от %s", job.account_id, job.id, len(messages), job.tg_id)
+
+    reply = await prepare_reply(job.account_id, job.tg_id, combined, job.username)
+    if reply is None:
+        return None
+    return {"text": combined, "reply": reply}
+
+
+def _cleanup_media(job: Job):
+    for item in job.payload["items"]:
+        if item["kind"] == "media":
+            remove_file_quietly(item["path"])
+
+
+async def _worker_loop(queue: JobQueue, worker_id: str, stop_event):
+    logger.info("Воркер %s запущен", worker_id)
+    # Модель и max_tokens из файла настроек, который меняет .set в основном процессе
+    runtime_settings.start()
+    start_openrouter_keepwarm()
+    start_usage_tracking()
+    long_term_memory.start()
+    try:
+        while not stop_event.is_set():
+            job = await queue.claim_async(worker_id)
+            if job is None:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+
+            try:
+                result = await process_job(job)
+            except Exception as e:
+                status = await queue.fail_async(job.id, worker_id, str(e))
+                logger.error("Задача %s завершилась ошибкой (попытка %s, статус %s): %s",
+                             job.id, job.attempts, status, e)
+                if status != STATUS_PENDING:
+                    _cleanup_media(job)
+                continue
+
+            if not await queue.complete_async(job.id, worker_id, result):
+                logger.warning("Задача %s уже завершена другим воркером, результат отброшен", job.id)
+            _cleanup_media(job)
+    finally:
+        await runtime_settings.stop()
+        await long_term_memory.stop()
+        await close_openrouter_client()
+        await dispose_engine()
+        logger.info("Воркер %s остановлен", worker_id)
+
+
+def worker_main(worker_index: int, stop_event):
+    """Точка входа процесса-воркера"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - worker-%(process)d - %(levelname)s - %(message)s'
+    )
+    worker_id = f"{os.getpid()}-{worker_index}"
+    asyncio.run(_worker_loop(get_job_queue(), worker_id, stop_event))
+
+
+class WorkerPool:
+    """Процессы-воркеры; spawn, чтобы не наследовать состояние Telegram-процесса."""
+
+    def __init__(self, size: int = JOB_WORKERS):
+        self.size = size
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._processes = []
+
+    def start(self):
+        for index in range(self.size):
+            process = self._context.Process(
+                target=worker_main, args=(index, self._stop_event), name=f"job-worker-{index}", daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+        logger.info("Запущено %s воркеров очереди", self.size)
+
+    async def stop(self, timeout: float = 30):
+        """Просит воркеров завершиться после текущей задачи"""
+        self._stop_event.set()
+        for process in self._processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                # Незавершённая задача вернётся в очередь по истечении аренды
+                process.terminate()
+        self._processes.clear()
@@ -0,0 +1 @@
+# Пустой файл, чтобы директория benchmarks считалась пакетом
@@ -0,0 +1,85 @@
+"""Сравнение ASR-бэкендов: real-time factor и пиковая RSS на одних и тех же клипах.
+
+Каждый бэкенд запускается в отдельном процессе, чтобы память одного не влияла
+на замер другого. Клипы и эталоны - как в benchmarks.transcription.
+
+    python -m benchmarks.asr_backends benchmarks/fixtures --backends whisper faster-whisper
+"""
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.transcription import load_fixtures, word_error_rate
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _run_backend(backend_name: str, model_size: str, paths: list[str], results):
+    from app.asr import create_backend
+    from app.voice_preprocessing import SAMPLE_RATE
+
+    backend = create_backend(backend_name)
+    started = time.perf_counter()
+    backend.get_model(model_size)
+    load_time = time.perf_counter() - started
+    rss_after_load = _peak_rss_mb()
+
+    audio_seconds = 0.0
+    elapsed = 0.0
+    texts = []
+    for path in paths:
+        audio = backend.load_audio(path)
+        audio_seconds += len(audio) / SAMPLE_RATE
+        started = time.perf_counter()
+        texts.append(backend.transcribe(model_size, audio))
+        elapsed += time.perf_counter() - started
+
+    results.put({
+        "load_time": load_time,
+        "rss_after_load": rss_after_load,
+        "peak_rss": _peak_rss_mb(),
+        "audio_seconds": audio_seconds,
+        "elapsed": elapsed,
+        "texts": texts,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", type=Path, nargs="?", default=Path("benchmarks/fixtures"))
+    parser.add_argument("--backends", nargs="+", default=["whisper", "faster-whisper"])
+    parser.add_argument("--model", default="base")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"В {args.fixtures} нет аудиофайлов")
+    paths = [str(path) for path, _ in fixtures]
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'бэкенд':16} {'загрузка,с':>10} {'RSS модели,МБ':>14} {'пик RSS,МБ':>11} {'RTF':>7} {'WER':>6}")
+    for backend_name in args.backends:
+        results = context.Queue()
+        process = context.Process(target=_run_backend, args=(backend_name, args.model, paths, results))
+        process.start()
+        result = results.get()
+        process.join()
+
+        wer = sum(
+            word_error_rate(reference, text) for (_, reference), text in zip(fixtures, result["texts"])
+        ) / len(fixtures)
+        print(
+            f"{backend_name:16} {result['load_time']:10.2f} {result['rss_after_load']:14.0f} "
+            f"{result['peak_rss']:11.0f} {result['elapsed'] / result['audio_seconds']:7.3f} {wer:6.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
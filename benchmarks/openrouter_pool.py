@@ -0,0 +1,53 @@
+"""Проверка пула соединений OpenRouter: переиспользование и время подключения.
+
+Шлёт запросы чата волнами с паузами между ними и печатает статистику пула.
+Для проверки без реального API поднимите локальную HTTPS-заглушку,
+совместимую с /chat/completions, и укажите её в .env:
+
+    OPENROUTER_BASE_URL=https://localhost:8443/v1
+    OPENROUTER_CA_BUNDLE=./stub-cert.pem
+
+    python -m benchmarks.openrouter_pool --waves 5 --concurrency 4 --idle 30
+"""
+import argparse
+import asyncio
+import time
+
+from app.http_client import connection_stats
+from app.openrouter import client, close_openrouter_client
+from app.runtime_settings import runtime_settings
+
+
+async def one_request() -> float:
+    started = time.perf_counter()
+    await client.chat.completions.create(
+        model=runtime_settings.MODEL,
+        messages=[{"role": "user", "content": "ping"}],
+        max_tokens=1,
+    )
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--waves", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--idle", type=float, default=10.0, help="пауза между волнами, с")
+    args = parser.parse_args()
+
+    try:
+        for wave in range(args.waves):
+            if wave:
+                await asyncio.sleep(args.idle)
+            latencies = await asyncio.gather(*(one_request() for _ in range(args.concurrency)))
+            print(f"волна {wave + 1}: первый {latencies[0] * 1000:.0f} мс, "
+                  f"максимум {max(latencies) * 1000:.0f} мс, {connection_stats.as_dict()}")
+    finally:
+        await close_openrouter_client()
+
+    print(f"итого: переиспользование {connection_stats.reuse_rate:.0%}, "
+          f"подключение в среднем {connection_stats.avg_connect_time * 1000:.0f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
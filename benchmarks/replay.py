@@ -0,0 +1,212 @@
+"""Воспроизведение записанного трафика через буфер, LLM и БД.
+
+Запись делает app/traffic_recorder.py (TRAFFIC_RECORD_PATH). События подаются
+в handle_message_smart/handle_media_message с теми же интервалами, что в
+записи (или в --speed раз быстрее), со стаб-клиентом Telegram, стабом LLM и
+транскрипции и временной SQLite. Таймауты буфера сжимаются вместе со временем,
+поэтому решения о склейке те же, что при 1x. Задержки в отчёте - во времени
+записи.
+
+    python -m benchmarks.replay traffic/20250101.jsonl.gz --speed 20
+    python -m benchmarks.replay traffic/20250101.jsonl.gz --speed 20 --buffer-timeout 10 --quick-interval 3
+    python -m benchmarks.replay traffic/20250101.jsonl.gz --speed 20 --preempt off
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+REPLAY_ACCOUNT_ID = "replay"
+
+# До импорта приложения: своя БД и фиктивный ключ, в OpenRouter ничего не уходит
+_db_dir = tempfile.mkdtemp(prefix="replay-")
+os.environ["DB_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'replay.db')}"
+os.environ.setdefault("OPENROUTER_API_KEY", "replay")
+os.environ["JOB_QUEUE_ENABLED"] = "0"
+
+from app import message_buffer, metrics, replies  # noqa: E402
+from app.runtime_settings import runtime_settings  # noqa: E402
+from app.traffic_recorder import load_recording  # noqa: E402
+from database.crud import bulk_upsert_users  # noqa: E402
+from database.migrations import run_migrations  # noqa: E402
+from database.session import AsyncSessionLocal, dispose_engine, engine  # noqa: E402
+
+# Таймауты буфера, которые масштабируются вместе со временем
+SCALED_SETTINGS = (
+    "QUICK_INTERVAL",
+    "BUFFER_TIMEOUT",
+    "COMPLETE_MESSAGE_TIMEOUT",
+    "CONTINUATION_INTERVAL",
+    "MEDIA_BUFFER_TIMEOUT",
+)
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+class ReplayStats:
+    def __init__(self):
+        self.arrivals = Counter()
+        self.last_arrival: dict[int, float] = {}
+        self.llm_calls = 0
+        self.merged_sizes: list[int] = []
+        self.replies = 0
+        self.latencies: list[float] = []
+
+
+class ReplayClient:
+    """Стаб pyrogram.Client: отправка только считается."""
+
+    def __init__(self, stats: ReplayStats, speed: float):
+        self.name = REPLAY_ACCOUNT_ID
+        self.stats = stats
+        self.speed = speed
+
+    async def get_me(self):
+        return SimpleNamespace(id=0, username="replay")
+
+    async def send_chat_action(self, chat_id, action):
+        pass
+
+    async def send_message(self, chat_id, text):
+        self.stats.replies += 1
+        arrived = self.stats.last_arrival.get(chat_id)
+        if arrived is not None:
+            self.stats.latencies.append((time.monotonic() - arrived) * self.speed)
+
+    async def send_sticker(self, chat_id, sticker):
+        pass
+
+
+class ReplayMedia:
+    """Стаб медиа-сообщения: вместо аудио в файл пишется его длительность"""
+
+    def __init__(self, duration: float):
+        self.duration = duration
+
+    async def download(self, file_name: str):
+        with open(file_name, "w") as file:
+            file.write(str(self.duration))
+        return file_name
+
+
+def install_stubs(stats: ReplayStats, speed: float, llm_latency: float, asr_rtf: float):
+    async def generate_reply(text, username, mode, history, **kwargs):
+        stats.llm_calls += 1
+        stats.merged_sizes.append(len(text.split("\n")))
+        await asyncio.sleep(llm_latency / speed)
+        return "ok"
+
+    async def transcribe_audio(file_path, cleanup=True):
+        with open(file_path) as file:
+            duration = float(file.read() or 1.0)
+        await asyncio.sleep(duration * asr_rtf / speed)
+        if cleanup:
+            os.remove(file_path)
+        return "[голосовое]"
+
+    replies.generate_reply = generate_reply
+    message_buffer.transcribe_audio = transcribe_audio
+
+
+async def prepare_database(users: list[str]) -> dict[str, int]:
+    await run_migrations(engine)
+    tg_ids = {user: index for index, user in enumerate(users, 1)}
+    async with AsyncSessionLocal() as session:
+        await bulk_upsert_users(session, REPLAY_ACCOUNT_ID, [{"tg_id": tg_id} for tg_id in tg_ids.values()])
+    return tg_ids
+
+
+async def replay(events: list[dict], client: ReplayClient, tg_ids: dict[str, int], speed: float):
+    stats = client.stats
+    tasks = []
+    started = time.monotonic()
+    first = events[0]["ts"]
+
+    for event in events:
+        delay = (event["ts"] - first) / speed - (time.monotonic() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        tg_id = tg_ids[event["user"]]
+        stats.arrivals[event["type"]] += 1
+        stats.last_arrival[tg_id] = time.monotonic()
+        if event["type"] == "text":
+            coro = message_buffer.handle_message_smart(client, tg_id, "x" * max(1, event["length"]))
+        else:
+            media = ReplayMedia(event.get("duration") or 1.0)
+            coro = message_buffer.handle_media_message(client, tg_id, media, event["type"])
+        tasks.append(asyncio.create_task(coro))
+
+    await asyncio.gather(*tasks)
+    return time.monotonic() - started
+
+
+def print_report(stats: ReplayStats, events: list[dict], wall: float, speed: float):
+    recorded = events[-1]["ts"] - events[0]["ts"]
+    total = sum(stats.arrivals.values())
+    merged = total - stats.llm_calls
+
+    print(f"Событий: {total} ({', '.join(f'{kind} {count}' for kind, count in stats.arrivals.items())}), "
+          f"пользователей: {len(stats.last_arrival)}")
+    print(f"Длительность записи: {recorded:.0f}с, воспроизведение: {wall:.1f}с (x{speed:g})")
+    print(f"Вызовов LLM: {stats.llm_calls}, ответов: {stats.replies}, склеено сообщений: {merged}")
+    counters = metrics.snapshot()["counters"]
+    preempted = {mode: counters.get(f"preempted_{mode}", 0) for mode in ("cancel", "discard")}
+    if stats.replies:
+        print(f"Вызовов LLM на ответ: {stats.llm_calls / stats.replies:.2f}, вытеснено генераций: "
+              f"{sum(preempted.values())} (отменено {preempted['cancel']}, отброшено {preempted['discard']})")
+    if stats.merged_sizes:
+        print(f"Сообщений на вызов LLM: среднее {sum(stats.merged_sizes) / len(stats.merged_sizes):.2f}, "
+              f"максимум {max(stats.merged_sizes)}")
+    if stats.latencies:
+        print(f"Задержка ответа (время записи): p50 {percentile(stats.latencies, 0.5):.1f}с, "
+              f"p95 {percentile(stats.latencies, 0.95):.1f}с, максимум {max(stats.latencies):.1f}с")
+    if wall:
+        print(f"Пропускная способность: {total / wall:.1f} сообщ/с, {stats.replies / wall:.1f} ответов/с")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="gzip JSONL из TRAFFIC_RECORD_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение времени")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="задержка стаба LLM, с")
+    parser.add_argument("--asr-rtf", type=float, default=0.3, help="время транскрипции на секунду аудио")
+    parser.add_argument("--quick-interval", type=float, help="QUICK_INTERVAL для эксперимента")
+    parser.add_argument("--buffer-timeout", type=float, help="BUFFER_TIMEOUT для эксперимента")
+    parser.add_argument("--preempt", choices=("cancel", "discard", "off"), help="PREEMPT_MODE для эксперимента")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    events = load_recording(args.recording)
+    if not events:
+        raise SystemExit("Запись пуста")
+
+    # Файл настроек бота не читается: эксперимент начинается с умолчаний
+    runtime_settings.path = None
+    overrides = {"QUICK_INTERVAL": args.quick_interval, "BUFFER_TIMEOUT": args.buffer_timeout}
+    values = {name: value for name, value in overrides.items() if value is not None}
+    values.update({name: values.get(name, getattr(runtime_settings, name)) / args.speed for name in SCALED_SETTINGS})
+    if args.preempt:
+        values["PREEMPT_MODE"] = args.preempt
+    runtime_settings.apply(values, source="replay")
+
+    stats = ReplayStats()
+    install_stubs(stats, args.speed, args.llm_latency, args.asr_rtf)
+    tg_ids = await prepare_database(sorted({event["user"] for event in events}))
+
+    try:
+        wall = await replay(events, ReplayClient(stats, args.speed), tg_ids, args.speed)
+    finally:
+        await dispose_engine()
+    print_report(stats, events, wall, args.speed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
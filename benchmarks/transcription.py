@@ -0,0 +1,103 @@
+"""Бенчмарк транскрипции: точность против скорости на локальном наборе клипов.
+
+Набор - каталог с аудио (*.ogg, *.wav, *.mp3) и эталонными расшифровками
+в одноимённых *.txt. Сравниваются полная запись без предобработки и
+конвейер с VAD, нарезкой по паузам и выбором модели по длительности.
+
+    python -m benchmarks.transcription benchmarks/fixtures
+"""
+import argparse
+import asyncio
+import time
+from pathlib import Path
+
+from app import transcription
+from app.asr import get_asr_backend
+from app.voice_preprocessing import SAMPLE_RATE
+
+AUDIO_SUFFIXES = {".ogg", ".oga", ".wav", ".mp3", ".m4a"}
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """WER через расстояние Левенштейна по словам"""
+    ref = reference.lower().split()
+    hyp = hypothesis.lower().split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            )
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def transcribe_baseline(path: Path) -> str:
+    """Старое поведение: вся запись целиком одной моделью"""
+    backend = get_asr_backend()
+    return backend.transcribe(transcription.WHISPER_MODEL_NAME, backend.load_audio(str(path)))
+
+
+async def transcribe_pipeline(path: Path) -> str:
+    return await transcription.transcribe_audio(str(path), cleanup=False)
+
+
+def load_fixtures(directory: Path) -> list[tuple[Path, str]]:
+    fixtures = []
+    for path in sorted(directory.iterdir()):
+        if path.suffix.lower() in AUDIO_SUFFIXES:
+            reference = path.with_suffix(".txt")
+            fixtures.append((path, reference.read_text(encoding="utf-8").strip() if reference.exists() else ""))
+    return fixtures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", type=Path, nargs="?", default=Path("benchmarks/fixtures"))
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"В {args.fixtures} нет аудиофайлов")
+
+    # Загрузка моделей не входит в замер
+    await transcription.preload_whisper_model()
+
+    totals = {"baseline": [0.0, 0.0], "pipeline": [0.0, 0.0]}
+    audio_seconds = 0.0
+    print(f"{'клип':30} {'сек':>6} {'base,с':>8} {'WER':>6} {'pipe,с':>8} {'WER':>6}")
+    for path, reference in fixtures:
+        duration = len(transcription.load_audio(str(path))) / SAMPLE_RATE
+        audio_seconds += duration
+
+        started = time.perf_counter()
+        baseline_text = await asyncio.to_thread(transcribe_baseline, path)
+        baseline_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        pipeline_text = await transcribe_pipeline(path)
+        pipeline_time = time.perf_counter() - started
+
+        baseline_wer = word_error_rate(reference, baseline_text)
+        pipeline_wer = word_error_rate(reference, pipeline_text)
+        totals["baseline"][0] += baseline_time
+        totals["baseline"][1] += baseline_wer
+        totals["pipeline"][0] += pipeline_time
+        totals["pipeline"][1] += pipeline_wer
+        print(f"{path.name[:30]:30} {duration:6.1f} {baseline_time:8.2f} {baseline_wer:6.2f} "
+              f"{pipeline_time:8.2f} {pipeline_wer:6.2f}")
+
+    count = len(fixtures)
+    print()
+    for name, (elapsed, wer_sum) in totals.items():
+        print(f"{name:9} время {elapsed:7.2f}с  RTF {elapsed / audio_seconds:5.3f}  средний WER {wer_sum / count:5.3f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Пропускная способность транскрипции во время всплеска голосовых.
+
+Клипы из набора приходят со случайными интервалами в пределах --burst секунд.
+Сравниваются распознавание по одному куску и микробатчинг: clips/s и
+перцентили задержки от прихода клипа до готового текста.
+
+    python -m benchmarks.transcription_batching benchmarks/fixtures --clips 32 --burst 2
+"""
+import argparse
+import asyncio
+import random
+import time
+from pathlib import Path
+
+from app import transcription
+from app.transcription import TranscriptionBatcher
+from app.voice_preprocessing import prepare_voice
+from benchmarks.transcription import load_fixtures
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_burst(batcher: TranscriptionBatcher, clips: list, arrivals: list[float]) -> tuple[float, list[float]]:
+    latencies = []
+
+    async def one(prepared, delay: float):
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        model_name = transcription.model_for_duration(prepared.speech_seconds)
+        await asyncio.gather(*(batcher.transcribe(model_name, chunk) for chunk in prepared.chunks))
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(clip, delay) for clip, delay in zip(clips, arrivals)))
+    return time.perf_counter() - started, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", type=Path, nargs="?", default=Path("benchmarks/fixtures"))
+    parser.add_argument("--clips", type=int, default=32, help="клипов во всплеске")
+    parser.add_argument("--burst", type=float, default=2.0, help="длительность всплеска, с")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"В {args.fixtures} нет аудиофайлов")
+
+    await transcription.preload_whisper_model()
+    prepared = [prepare_voice(transcription.load_audio(str(path))) for path, _ in fixtures]
+    prepared = [clip for clip in prepared if clip.chunks]
+
+    rng = random.Random(args.seed)
+    clips = [rng.choice(prepared) for _ in range(args.clips)]
+    arrivals = sorted(rng.uniform(0, args.burst) for _ in clips)
+
+    print(f"{'режим':12} {'clips/s':>8} {'p50,с':>7} {'p95,с':>7} {'max,с':>7}")
+    for name, batcher in (
+        ("по одному", TranscriptionBatcher(max_batch=1)),
+        ("батчи", TranscriptionBatcher()),
+    ):
+        elapsed, latencies = await run_burst(batcher, clips, arrivals)
+        print(f"{name:12} {len(clips) / elapsed:8.2f} {percentile(latencies, 0.5):7.2f} "
+              f"{percentile(latencies, 0.95):7.2f} {max(latencies):7.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
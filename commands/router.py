@@ -1,12 +1,31 @@
+import asyncio
+import io
 import logging
+import time
 from dataclasses import dataclass
 
 from pyrogram.types import Message
 
+from app.profiler import ProfilerBusy, profiler
+from app.runtime_settings import runtime_settings
 from app.utils import ALLOWED_MODES
+from commands.stats import format_stats
+from commands.usage_report import parse_usage_args, usage_report
+from commands.user_import import MAX_IMPORT_BYTES, parse_user_import
+from services.maintenance import db_maintenance
+from services.usage import usage_tracker
 
 logger = logging.getLogger(__name__)
 
+# Долгие команды (.profile): ссылки держим, пока не завершатся
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _run_in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
 
 @dataclass(frozen=True)
 class CommandDocumentation:
@@ -21,28 +40,56 @@ class CommandContext:
 
 COMMANDS_DOCS: dict[str, CommandDocumentation] = {
     "add": CommandDocumentation(
-        usage=".add <tg_id> [username]",
-        description="Добавляет или обновляет пользователя в базе и включает его по умолчанию.",
+        usage=".add <tg_id> [username] | .add <tg_id> <tg_id> ...",
+        description="Добавляет или обновляет пользователей в базе и включает их по умолчанию.",
     ),
     "mode": CommandDocumentation(
-        usage=".mode <tg_id> <normal|friendly|funny|rude>",
-        description="Устанавливает режим общения для указанного пользователя.",
+        usage=".mode <цели> <normal|friendly|funny|rude>",
+        description="Устанавливает режим общения для указанных пользователей.",
     ),
     "on": CommandDocumentation(
-        usage=".on <tg_id>",
-        description="Включает ответы бота для пользователя.",
+        usage=".on <цели>",
+        description="Включает ответы бота для пользователей.",
     ),
     "off": CommandDocumentation(
-        usage=".off <tg_id>",
-        description="Выключает ответы бота для пользователя.",
+        usage=".off <цели>",
+        description="Выключает ответы бота для пользователей.",
     ),
     "clear": CommandDocumentation(
         usage=".clear <tg_id>",
         description="Очищает историю сообщений для пользователя.",
     ),
     "proactive": CommandDocumentation(
-        usage=".proactive <tg_id> <on|off>",
-        description="Включает или выключает проактивный режим для пользователя.",
+        usage=".proactive <цели> <on|off>",
+        description="Включает или выключает проактивный режим для пользователей.",
+    ),
+    "import": CommandDocumentation(
+        usage=".import (подпись к CSV/JSON-файлу)",
+        description="Массово добавляет пользователей из файла: tg_id,username,mode,active,proactive.",
+    ),
+    "stats": CommandDocumentation(
+        usage=".stats",
+        description="Показывает живую статистику: буферы, очереди, задержки p50/p95, БД, память.",
+    ),
+    "usage": CommandDocumentation(
+        usage=".usage [tg_id] [Nd]",
+        description="Расход токенов и оценка стоимости: всего, по режимам и топ собеседников (Nd - за N дней).",
+    ),
+    "profile": CommandDocumentation(
+        usage=".profile <секунды>",
+        description="Профилирует работающий бот заданное время и присылает отчёт файлом: горячие функции и память.",
+    ),
+    "set": CommandDocumentation(
+        usage=".set <НАСТРОЙКА> <значение> [<НАСТРОЙКА> <значение> ...]",
+        description="Меняет настройки без перезапуска; несколько значений применяются вместе.",
+    ),
+    "get": CommandDocumentation(
+        usage=".get [НАСТРОЙКА]",
+        description="Показывает текущие значения настроек, меняемых командой .set.",
+    ),
+    "vacuum": CommandDocumentation(
+        usage=".vacuum",
+        description="Разово переводит старую БД в auto_vacuum=INCREMENTAL полным VACUUM (запись ждёт до конца).",
     ),
     "help": CommandDocumentation(
         usage=".help",
@@ -50,6 +97,49 @@ COMMANDS_DOCS: dict[str, CommandDocumentation] = {
     ),
 }
 
+# Цели массовых команд: список tg_id (через пробел или запятую) или один фильтр
+TARGET_FILTERS = {
+    "all": {},
+    "active": {"active": True},
+    "inactive": {"active": False},
+    "proactive": {"proactive_enabled": True},
+}
+TARGETS_HELP = "Цели: tg_id через пробел/запятую или фильтр all, active, inactive, proactive, mode=<режим>."
+
+
+@dataclass
+class CommandTargets:
+    tg_ids: list[int] | None = None
+    filters: dict | None = None
+
+    @property
+    def is_single(self) -> bool:
+        return self.tg_ids is not None and len(self.tg_ids) == 1
+
+
+def split_ids(args: list[str]) -> list[str]:
+    """Разворачивает '1,2 3' в ['1', '2', '3']"""
+    return [part for arg in args for part in arg.split(",") if part]
+
+
+def parse_targets(args: list[str]) -> CommandTargets | None:
+    """Список tg_id или фильтр; None, если цели заданы некорректно"""
+    tokens = split_ids(args)
+    if not tokens:
+        return None
+
+    if len(tokens) == 1:
+        token = tokens[0].lower()
+        if token in TARGET_FILTERS:
+            return CommandTargets(filters=TARGET_FILTERS[token])
+        if token.startswith("mode="):
+            mode = token.split("=", 1)[1]
+            return CommandTargets(filters={"mode": mode}) if mode in ALLOWED_MODES else None
+
+    if not all(token.isdigit() for token in tokens):
+        return None
+    return CommandTargets(tg_ids=list(dict.fromkeys(int(token) for token in tokens)))
+
 
 def parse_control_command(text: str) -> tuple[str, list[str]]:
     """Парсит сообщение вида ".command arg1 arg2" в команду и аргументы."""
@@ -70,7 +160,7 @@ def validate_control_command(cmd: str, args: list[str]) -> tuple[bool, str | Non
     if cmd not in COMMANDS_DOCS:
         return False, "Ошибка: неизвестная команда. Используйте .help для списка команд."
 
-    if cmd == "help":
+    if cmd in ("help", "import", "stats", "get", "vacuum"):
         return True, None
 
     if cmd in ("add", "on", "off", "clear") and len(args) < 1:
@@ -79,25 +169,54 @@ def validate_control_command(cmd: str, args: list[str]) -> tuple[bool, str | Non
     if cmd in ("mode", "proactive") and len(args) < 2:
         return False, f"Ошибка: {COMMANDS_DOCS[cmd].usage}"
 
-    if not args[0].isdigit():
+    if cmd == "usage" and parse_usage_args(args) is None:
+        return False, f"Ошибка: {COMMANDS_DOCS[cmd].usage}"
+
+    if cmd == "profile" and (len(args) != 1 or not args[0].isdigit() or not 0 < int(args[0]) <= profiler.max_seconds):
+        return False, f"Ошибка: {COMMANDS_DOCS[cmd].usage}, от 1 до {profiler.max_seconds:g} секунд"
+
+    if cmd == "set" and (not args or len(args) % 2):
+        return False, f"Ошибка: {COMMANDS_DOCS[cmd].usage}"
+
+    if cmd == "clear" and not args[0].isdigit():
         return False, "Ошибка: tg_id должен быть числом."
 
-    if cmd == "mode" and args[1] not in ALLOWED_MODES:
+    # Username в Telegram не бывает из одних цифр: ".add 1 2" - это два tg_id
+    if cmd == "add" and not all(token.isdigit() for token in split_ids(args)):
+        if len(args) != 2 or not args[0].isdigit():
+            return False, "Ошибка: tg_id должен быть числом, username - только для одного tg_id."
+
+    target_args = args[:-1] if cmd in ("mode", "proactive") else args
+    if cmd in ("mode", "on", "off", "proactive") and parse_targets(target_args) is None:
+        return False, f"Ошибка: некорректные цели. {TARGETS_HELP}"
+
+    if cmd == "mode" and args[-1] not in ALLOWED_MODES:
         return False, "Ошибка: режим должен быть одним из: normal, friendly, funny, rude."
 
-    if cmd == "proactive" and args[1].lower() not in {"on", "off"}:
+    if cmd == "proactive" and args[-1].lower() not in {"on", "off"}:
         return False, "Ошибка: значение должно быть on или off."
 
     return True, None
 
 
+def format_bulk_summary(action: str, updated: int, missing: list[int]) -> str:
+    """Одна сводка на всю массовую операцию"""
+    summary = f"{action}: {updated}"
+    if missing:
+        shown = ", ".join(str(tg_id) for tg_id in missing[:20])
+        more = f" и ещё {len(missing) - 20}" if len(missing) > 20 else ""
+        summary += f"\nНе найдены ({len(missing)}): {shown}{more}"
+    return summary
+
+
 class CommandRouter:
-    """Роутер для обработки контрольных команд из Saved Messages."""
+    """Роутер для обработки контрольных команд из Saved Messages одного аккаунта."""
 
-    def __init__(self, session_factory, user_service_cls, message_service_cls) -> None:
+    def __init__(self, session_factory, user_service_cls, message_service_cls, account_id: str) -> None:
         self._session_factory = session_factory
         self._user_service_cls = user_service_cls
         self._message_service_cls = message_service_cls
+        self._account_id = account_id
 
     async def handle(self, command: str, context: CommandContext) -> None:
         cmd, args = parse_control_command(command)
@@ -113,8 +232,8 @@ class CommandRouter:
         logger.info("Выполняем команду: %s с аргументами: %s", cmd, args)
 
         async with self._session_factory() as session:
-            user_service = self._user_service_cls(session)
-            message_service = self._message_service_cls(session)
+            user_service = self._user_service_cls(session, self._account_id)
+            message_service = self._message_service_cls(session, self._account_id)
 
             if cmd == "add":
                 await self._handle_add(user_service, context.message, args)
@@ -128,10 +247,31 @@ class CommandRouter:
                 await self._handle_clear(message_service, context.message, args)
             elif cmd == "proactive":
                 await self._handle_proactive(user_service, context.message, args)
+            elif cmd == "import":
+                await self._handle_import(user_service, context.message)
+            elif cmd == "stats":
+                await self._handle_stats(context.message)
+            elif cmd == "usage":
+                await self._handle_usage(session, context.message, args)
+            elif cmd == "set":
+                await self._handle_set(context.message, args)
+            elif cmd == "get":
+                await self._handle_get(context.message, args)
+            elif cmd == "profile":
+                await self._handle_profile(context.message, args)
+            elif cmd == "vacuum":
+                await self._handle_vacuum(context.message)
             elif cmd == "help":
                 await self._handle_help(context.message)
 
     async def _handle_add(self, user_service, message: Message, args: list[str]) -> None:
+        ids = split_ids(args)
+        if len(ids) > 1 and all(token.isdigit() for token in ids):
+            rows = [{"tg_id": tg_id} for tg_id in dict.fromkeys(int(token) for token in ids)]
+            created, updated = await user_service.bulk_add_users(rows)
+            await message.reply(f"Добавлено: {created}, уже были: {updated}")
+            return
+
         tg_id = int(args[0])
         username = args[1] if len(args) > 1 else None
         user = await user_service.add_or_update_user(tg_id, username)
@@ -139,17 +279,29 @@ class CommandRouter:
             f"Добавлен пользователь tg_id={user.tg_id}, mode={user.mode}, active={user.active}"
         )
 
+    async def _bulk_update(self, user_service, message: Message, targets: CommandTargets, values: dict) -> None:
+        updated, missing = await user_service.bulk_update(values, targets.tg_ids, targets.filters)
+        await message.reply(format_bulk_summary("Обновлено пользователей", updated, missing))
+
     async def _handle_mode(self, user_service, message: Message, args: list[str]) -> None:
-        tg_id = int(args[0])
-        mode = args[1]
-        ok = await user_service.update_mode(tg_id, mode)
+        targets = parse_targets(args[:-1])
+        mode = args[-1]
+        if not targets.is_single:
+            await self._bulk_update(user_service, message, targets, {"mode": mode})
+            return
+
+        ok = await user_service.update_mode(targets.tg_ids[0], mode)
         await message.reply("OK" if ok else "Пользователь не найден")
 
     async def _handle_toggle(
         self, user_service, message: Message, args: list[str], is_active: bool
     ) -> None:
-        tg_id = int(args[0])
-        ok = await user_service.set_active(tg_id, is_active)
+        targets = parse_targets(args)
+        if not targets.is_single:
+            await self._bulk_update(user_service, message, targets, {"active": is_active})
+            return
+
+        ok = await user_service.set_active(targets.tg_ids[0], is_active)
         await message.reply("OK" if ok else "Пользователь не найден")
 
     async def _handle_clear(self, message_service, message: Message, args: list[str]) -> None:
@@ -158,17 +310,119 @@ class CommandRouter:
         await message.reply("История очищена" if ok else "Пользователь не найден")
 
     async def _handle_proactive(self, user_service, message: Message, args: list[str]) -> None:
-        tg_id = int(args[0])
-        enabled = args[1].lower() == "on"
+        targets = parse_targets(args[:-1])
+        enabled = args[-1].lower() == "on"
+        if not targets.is_single:
+            await self._bulk_update(user_service, message, targets, {"proactive_enabled": enabled})
+            return
+
+        tg_id = targets.tg_ids[0]
         ok = await user_service.set_proactive(tg_id, enabled)
         if ok:
             await message.reply(f"Проактивный режим {'включен' if enabled else 'выключен'} для {tg_id}")
         else:
             await message.reply("Пользователь не найден")
 
+    async def _handle_import(self, user_service, message: Message) -> None:
+        document = message.document
+        if not document:
+            await message.reply("Ошибка: отправьте CSV или JSON файлом с подписью .import")
+            return
+        if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+            await message.reply("Ошибка: файл слишком большой (максимум 1 МБ)")
+            return
+
+        data = await message.download(in_memory=True)
+        try:
+            rows = parse_user_import(document.file_name or "", bytes(data.getbuffer()))
+        except ValueError as e:
+            await message.reply(f"Ошибка импорта: {e}")
+            return
+
+        created, updated = await user_service.bulk_add_users(rows)
+        await message.reply(f"Импорт: добавлено {created}, обновлено {updated}")
+
+    async def _handle_stats(self, message: Message) -> None:
+        await message.reply(format_stats())
+
+    async def _handle_usage(self, session, message: Message, args: list[str]) -> None:
+        tg_id, days = parse_usage_args(args)
+        # Свежий расход ещё может быть в памяти
+        await usage_tracker.flush()
+        await message.reply(await usage_report(session, self._account_id, tg_id, days))
+
+    async def _handle_profile(self, message: Message, args: list[str]) -> None:
+        seconds = int(args[0])
+        if profiler.running:
+            await message.reply("Профилирование уже идёт, дождитесь отчёта")
+            return
+
+        await message.reply(f"Профилирую {seconds}с, отчёт пришлю файлом")
+        # Захват идёт в фоне: обработчик и сессия БД не держатся на всё окно
+        _run_in_background(self._send_profile(message, seconds))
+
+    async def _send_profile(self, message: Message, seconds: int) -> None:
+        try:
+            report = await profiler.capture(seconds)
+        except ProfilerBusy:
+            await message.reply("Профилирование уже идёт, дождитесь отчёта")
+            return
+        except Exception as e:
+            logger.error("Профилирование не удалось: %s", e)
+            await message.reply(f"Ошибка профилирования: {e}")
+            return
+
+        document = io.BytesIO(report.encode("utf-8"))
+        document.name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+        await message.reply_document(document, caption=report.split("\n", 1)[0])
+
+    async def _handle_vacuum(self, message: Message) -> None:
+        await message.reply("Выполняю полный VACUUM, запись в БД ждёт его завершения...")
+        try:
+            reclaimed = await db_maintenance.convert_to_incremental()
+        except RuntimeError as e:
+            await message.reply(f"Ошибка: {e}")
+            return
+        if reclaimed is None:
+            await message.reply("БД уже в режиме auto_vacuum=INCREMENTAL")
+            return
+        await message.reply(f"БД переведена в auto_vacuum=INCREMENTAL, освобождено {reclaimed / 1024 / 1024:.1f} МБ")
+
+    async def _handle_set(self, message: Message, args: list[str]) -> None:
+        changes = dict(zip(args[::2], args[1::2]))
+        try:
+            changed = runtime_settings.apply(changes, source=f"команда .set [{self._account_id}]", persist=True)
+        except ValueError as e:
+            await message.reply(f"Ошибка: {e}. Ничего не изменено.")
+            return
+        except OSError as e:
+            # Значения уже действуют, но после перезапуска вернутся прежние
+            logger.error("Не удалось сохранить настройки: %s", e)
+            await message.reply(f"Применено, но не сохранено в файл: {e}")
+            return
+
+        if not changed:
+            await message.reply("Без изменений")
+            return
+        await message.reply("\n".join(f"{name}: {old} -> {new}" for name, (old, new) in changed.items()))
+
+    async def _handle_get(self, message: Message, args: list[str]) -> None:
+        values = runtime_settings.snapshot()
+        names = [arg.upper() for arg in args] or list(runtime_settings.settings)
+        lines = []
+        for name in names:
+            setting = runtime_settings.settings.get(name)
+            if setting is None:
+                lines.append(f"{name}: неизвестная настройка")
+                continue
+            default = "" if values[name] == setting.default else f" (по умолчанию {setting.default})"
+            lines.append(f"{name} = {values[name]}{default} - {setting.description}")
+        await message.reply("\n".join(lines))
+
     async def _handle_help(self, message: Message) -> None:
         help_lines = ["Команды:"]
         for cmd, doc in COMMANDS_DOCS.items():
             help_lines.append(f".{cmd} - {doc.description} ({doc.usage})")
+        help_lines.append(TARGETS_HELP)
 
         await message.reply("\n".join(help_lines))
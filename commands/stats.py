@@ -0,0 +1,123 @@
+"""Текст живой панели .stats из снимка app.metrics."""
+from app import metrics
+from config import ICEBREAKER_STATS_DAYS
+
+# (метрика, подпись) для перцентилей
+LATENCY_ROWS = (
+    ("reply_latency", "Ответ"),
+    ("transcription_time", "Транскрипция"),
+    ("openrouter_time", "OpenRouter"),
+    ("openrouter_time_cached", "OpenRouter с кэшем промпта"),
+    ("llm_retry_time", "Запросы с повторами"),
+    ("memory_search_time", "Поиск по долгой памяти"),
+    ("loop_lag", "Задержка loop"),
+    ("loop_stall_duration", "Зависания loop"),
+)
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days}д {hours}ч {minutes}м"
+    if hours:
+        return f"{hours}ч {minutes}м"
+    return f"{minutes}м {seconds}с"
+
+
+def _format_window(summary: dict) -> str:
+    if not summary["count"]:
+        return "—"
+    return f"p50 {summary['p50']:.2f}с / p95 {summary['p95']:.2f}с (n={summary['count']})"
+
+
+def format_stats(snapshot: dict | None = None) -> str:
+    snapshot = snapshot or metrics.snapshot()
+    gauges = snapshot["gauges"]
+    windows = snapshot["windows"]
+    rates = snapshot["rates"]
+    short, long = metrics.SNAPSHOT_PERIODS
+
+    lines = [
+        f"Аптайм: {_format_duration(snapshot['uptime'])}, RSS: {snapshot['rss'] / 1024 / 1024:.0f} МБ",
+        f"Активных буферов: {gauges.get('active_buffers', 0)}",
+        f"Транскрипций в ожидании: {gauges.get('pending_transcriptions', 0)}"
+        f" (в батчере: {gauges.get('transcription_backlog', 0)})",
+        f"LLM: в работе {gauges.get('llm_in_flight', 0)}, в очереди {gauges.get('llm_queued', 0)}",
+    ]
+
+    overload_steps = gauges.get("overload_steps") or []
+    if overload_steps:
+        lines.append(f"Перегрузка {gauges.get('overload_load', 0.0):.2f}: " + ", ".join(overload_steps))
+
+    breakers = gauges.get("llm_breakers") or {}
+    not_closed = {model: state for model, state in breakers.items() if state != "closed"}
+    if not_closed:
+        lines.append("Автоматы LLM: " + ", ".join(f"{model} - {state}" for model, state in not_closed.items()))
+    counters = snapshot["counters"]
+    if counters.get("breaker_open"):
+        lines.append(f"Размыканий автомата: {counters['breaker_open']}, повторов: {counters.get('llm_retries', 0)}")
+
+    for name, title in LATENCY_ROWS:
+        periods = windows.get(name)
+        if not periods:
+            continue
+        lines.append(f"{title}:")
+        lines.append(f"  {short // 60} мин: {_format_window(periods[short])}")
+        lines.append(f"  {long // 60} мин: {_format_window(periods[long])}")
+
+    stalls = snapshot["counters"].get("loop_stalls", 0)
+    if stalls:
+        lines.append(f"Зависаний loop с запуска: {stalls} (стек - в логе)")
+
+    db_ops = rates.get("db_ops")
+    if db_ops:
+        lines.append(
+            f"БД: {db_ops[short]:.2f} оп/с за {short // 60} мин, {db_ops[long]:.2f} оп/с за {long // 60} мин"
+        )
+
+    prompt_tokens = counters.get("llm_prompt_tokens", 0)
+    if prompt_tokens:
+        cached_tokens = counters.get("llm_cached_tokens", 0)
+        lines.append(
+            f"Токены промпта: {prompt_tokens}, из кэша провайдера {cached_tokens}"
+            f" ({cached_tokens / prompt_tokens * 100:.0f}%), ответов {counters.get('llm_completion_tokens', 0)}"
+        )
+
+    bursts = counters.get("reply_bursts", 0)
+    if bursts:
+        preempted = counters.get("preempted_cancel", 0) + counters.get("preempted_discard", 0)
+        lines.append(
+            f"Генераций на ответ: {counters.get('burst_llm_calls', 0) / bursts:.2f}, вытеснено генераций: {preempted}"
+        )
+
+    indexed = gauges.get("memory_indexed_messages", 0)
+    if indexed:
+        lines.append(
+            f"Долгая память: {indexed} сообщений в индексах, {gauges.get('memory_index_bytes', 0) / 1024 / 1024:.1f} МБ"
+        )
+
+    icebreakers = gauges.get("icebreaker_stats") or {}
+    if icebreakers:
+        parts = []
+        for peak_hour, title in ((True, "в час пика"), (False, "в любой час")):
+            sent, answered = icebreakers.get(peak_hour, (0, 0))
+            if sent:
+                parts.append(f"{title} {answered}/{sent} ({answered / sent * 100:.0f}%)")
+        lines.append(f"Ответы на ледоколы за {ICEBREAKER_STATS_DAYS} дн.: " + ", ".join(parts))
+
+    maintenance = gauges.get("maintenance_last")
+    if maintenance:
+        lines.append(
+            f"Обслуживание БД: освобождено {maintenance['bytes_reclaimed'] / 1024 / 1024:.1f} МБ"
+            f" за {maintenance['duration']:.1f}с"
+            f"{', прервано' if maintenance['interrupted'] else ''}"
+            f" (архив -{maintenance['archive_deleted']}, архивировано {maintenance['users_archived']})"
+        )
+
+    lines.append(
+        f"Кэш ответов: {gauges.get('reply_cache_hit_rate', 0.0) * 100:.0f}%,"
+        f" переиспользование соединений: {gauges.get('openrouter_reuse_rate', 0.0) * 100:.0f}%"
+    )
+    return "\n".join(lines)
@@ -0,0 +1,59 @@
+"""Текст отчёта .usage из дневных агрегатов usage_daily."""
+from datetime import date, timedelta
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.crud import get_usage_totals
+
+TOP_USERS = 10
+
+
+def parse_usage_args(args: list[str]) -> tuple[int | None, int] | None:
+    """[tg_id] [Nd] -> (tg_id, дней); None, если аргументы некорректны"""
+    tg_id, days = None, 1
+    for arg in args:
+        if arg.isdigit() and tg_id is None:
+            tg_id = int(arg)
+        elif arg.lower().endswith("d") and arg[:-1].isdigit() and 0 < int(arg[:-1]) <= 366:
+            days = int(arg[:-1])
+        else:
+            return None
+    return tg_id, days
+
+
+def _format_row(title: str, row: dict) -> str:
+    cached = f", кэш {row['cached_tokens'] / row['prompt_tokens'] * 100:.0f}%" if row["prompt_tokens"] else ""
+    latency = f", {row['latency_total'] / row['requests']:.1f}с/запрос" if row["requests"] else ""
+    return (
+        f"{title}: {row['tokens']} ток. ({row['prompt_tokens']} + {row['completion_tokens']}{cached}), "
+        f"{row['requests']} запр.{latency}, ~${row['cost']:.4f}"
+    )
+
+
+async def usage_report(session: AsyncSession, account_id: str, tg_id: int | None, days: int) -> str:
+    since = (date.today() - timedelta(days=days - 1)).isoformat()
+    period = "сегодня" if days == 1 else f"за {days} дн."
+    scope = {"account_id": account_id, "tg_id": tg_id}
+
+    total = await get_usage_totals(session, since, (), **scope)
+    if not total or not total[0]["requests"]:
+        return f"Расход {period}: нет запросов"
+
+    title = f"Собеседник {tg_id}" if tg_id is not None else "Всего"
+    lines = [f"Расход {period}", _format_row(title, total[0])]
+
+    by_mode = await get_usage_totals(session, since, ("mode", "kind"), **scope)
+    lines.append("По режимам:")
+    lines.extend(_format_row(f"  {row['mode']}/{row['kind']}", row) for row in by_mode)
+
+    by_model = await get_usage_totals(session, since, ("model",), **scope)
+    if len(by_model) > 1:
+        lines.append("По моделям:")
+        lines.extend(_format_row(f"  {row['model']}", row) for row in by_model)
+
+    if tg_id is None:
+        top = await get_usage_totals(session, since, ("tg_id",), account_id=account_id, limit=TOP_USERS)
+        lines.append(f"Топ-{TOP_USERS} собеседников:")
+        lines.extend(_format_row(f"  {row['tg_id'] or 'без собеседника'}", row) for row in top)
+
+    return "\n".join(lines)
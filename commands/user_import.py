@@ -0,0 +1,103 @@
+"""Разбор CSV/JSON-файлов для массового импорта пользователей командой .import."""
+import csv
+import io
+import json
+
+from app.utils import ALLOWED_MODES
+
+MAX_IMPORT_BYTES = 1024 * 1024
+MAX_IMPORT_ROWS = 5000
+
+_TRUE = {"1", "true", "yes", "on", "да"}
+_FALSE = {"0", "false", "no", "off", "нет"}
+
+
+def _parse_bool(value, field: str, line: int) -> bool | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"Строка {line}: поле {field} должно быть on/off")
+
+
+def _normalize_row(raw: dict, line: int) -> dict:
+    tg_id = str(raw.get("tg_id", "")).strip()
+    if not tg_id.isdigit():
+        raise ValueError(f"Строка {line}: tg_id должен быть числом")
+
+    mode = (raw.get("mode") or "").strip() or None
+    if mode is not None and mode not in ALLOWED_MODES:
+        raise ValueError(f"Строка {line}: режим должен быть одним из: {', '.join(sorted(ALLOWED_MODES))}")
+
+    username = (raw.get("username") or "").strip().lstrip("@") or None
+    return {
+        "tg_id": int(tg_id),
+        "username": username,
+        "mode": mode,
+        "active": _parse_bool(raw.get("active"), "active", line),
+        "proactive_enabled": _parse_bool(raw.get("proactive"), "proactive", line),
+    }
+
+
+def _rows_from_csv(text: str) -> list[dict]:
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+
+    # С заголовком (tg_id,username,mode,active,proactive) или просто "tg_id[,username]"
+    if "tg_id" in lines[0].lower():
+        reader = csv.DictReader(io.StringIO("\n".join(lines)))
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+        return [_normalize_row(row, index) for index, row in enumerate(reader, 2)]
+
+    rows = []
+    for index, cells in enumerate(csv.reader(lines), 1):
+        raw = {"tg_id": cells[0] if cells else "", "username": cells[1] if len(cells) > 1 else None}
+        rows.append(_normalize_row(raw, index))
+    return rows
+
+
+def _rows_from_json(text: str) -> list[dict]:
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get("users", [])
+    if not isinstance(data, list):
+        raise ValueError("JSON должен быть списком tg_id или объектов с полем tg_id")
+
+    rows = []
+    for index, item in enumerate(data, 1):
+        raw = item if isinstance(item, dict) else {"tg_id": item}
+        rows.append(_normalize_row(raw, index))
+    return rows
+
+
+def parse_user_import(file_name: str, data: bytes) -> list[dict]:
+    """Строки для bulk_upsert_users; ValueError с понятным сообщением при ошибке"""
+    if len(data) > MAX_IMPORT_BYTES:
+        raise ValueError("Файл слишком большой (максимум 1 МБ)")
+
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ValueError("Файл должен быть в UTF-8")
+
+    try:
+        if file_name.lower().endswith(".json") or text.lstrip().startswith(("[", "{")):
+            rows = _rows_from_json(text)
+        else:
+            rows = _rows_from_csv(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Некорректный JSON: {e}")
+
+    if not rows:
+        raise ValueError("В файле нет пользователей")
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise ValueError(f"Слишком много строк (максимум {MAX_IMPORT_ROWS})")
+
+    # Последняя запись о пользователе побеждает
+    return list({row["tg_id"]: row for row in rows}.values())
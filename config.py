@@ -10,9 +10,160 @@ OPENROUTER_API_KEY = getenv("OPENROUTER_API_KEY") or ""
 DB_URL = getenv("DB_URL", "sqlite+aiosqlite:///./tg_ai_user_bot.db")
 OPENAI_API_KEY = getenv("OPENAI_API_KEY")
 
+# Аккаунты Telegram: имена сессий через запятую, имя сессии = account_id
+TG_ACCOUNTS = [name.strip() for name in getenv("TG_ACCOUNTS", "tg_ai_userbot").split(",") if name.strip()]
+
+# Очередь задач: Telegram-процесс только принимает сообщения, воркеры транскрибируют и генерируют ответы
+JOB_QUEUE_ENABLED = getenv("JOB_QUEUE_ENABLED", "0") == "1"
+JOB_QUEUE_PATH = getenv("JOB_QUEUE_PATH", "./job_queue.db")
+JOB_SPOOL_DIR = getenv("JOB_SPOOL_DIR", "./spool")  # скачанные медиа до обработки воркером
+JOB_WORKERS = int(getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = 3  # попыток обработки задачи до отправки заглушки
+JOB_LEASE_SECONDS = 300  # через сколько задача упавшего воркера снова доступна
+JOB_MAX_SEND_ATTEMPTS = 3  # попыток отправки готового ответа в Telegram
+
+# Распознавание речи: whisper (openai-whisper, fp32) или faster-whisper (CTranslate2, int8 на CPU).
+# faster-whisper - необязательная зависимость: pip install -r requirements-asr.txt
+ASR_BACKEND = getenv("ASR_BACKEND", "whisper")
+ASR_COMPUTE_TYPE = getenv("ASR_COMPUTE_TYPE", "int8")  # только для faster-whisper
+ASR_BEAM_SIZE = int(getenv("ASR_BEAM_SIZE", "1"))  # 1 - жадное декодирование, быстрее всего
+ASR_LANGUAGE = getenv("ASR_LANGUAGE") or None  # например, ru: пропускает автоопределение языка
+ASR_THREADS = int(getenv("ASR_THREADS", "0"))  # потоки инференса, 0 - по умолчанию бэкенда
+
+# Кэш ответов на повторяющиеся короткие реплики ("привет", "ок", "?")
+REPLY_CACHE_ENABLED = getenv("REPLY_CACHE_ENABLED", "0") == "1"
+REPLY_CACHE_TTL = 6 * 60 * 60  # сколько живёт пул ответов на ключ
+REPLY_CACHE_MAX_ENTRIES = 1000  # ключей в кэше, лишние вытесняются по LRU
+REPLY_CACHE_POOL_SIZE = 3  # разных ответов на ключ, из них выбирается случайный
+REPLY_CACHE_MAX_TEXT_LENGTH = 20  # более длинные сообщения не кэшируются
+REPLY_CACHE_HISTORY_TAIL = 2  # сколько последних сообщений истории входит в ключ
+REPLY_CACHE_EXCLUDED_MODES = {mode.strip() for mode in getenv("REPLY_CACHE_EXCLUDED_MODES", "").split(",") if mode.strip()}
+REPLY_CACHE_EXCLUDED_USERS = {int(tg_id) for tg_id in getenv("REPLY_CACHE_EXCLUDED_USERS", "").split(",") if tg_id.strip()}
+
+# Спекулятивная генерация ответа во время ожидания буфера
+SPECULATIVE_ENABLED = getenv("SPECULATIVE_ENABLED", "0") == "1"
+SPECULATIVE_MAX_IN_FLIGHT = 4  # одновременных спекулятивных запросов
+SPECULATIVE_TOKEN_BUDGET_PER_HOUR = 50_000  # оценка токенов спекуляций за последний час
+
+# HTTP-клиент OpenRouter: пул соединений, таймауты по фазам, прогрев
+OPENROUTER_BASE_URL = getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+OPENROUTER_CA_BUNDLE = getenv("OPENROUTER_CA_BUNDLE") or None  # например, сертификат локальной заглушки
+OPENROUTER_HTTP2 = getenv("OPENROUTER_HTTP2", "1") == "1"
+OPENROUTER_MAX_CONNECTIONS = 20
+OPENROUTER_MAX_KEEPALIVE = 10
+OPENROUTER_KEEPALIVE_EXPIRY = 120.0  # секунды простоя до закрытия соединения
+OPENROUTER_CONNECT_TIMEOUT = 5.0
+OPENROUTER_READ_TIMEOUT = 60.0
+OPENROUTER_WRITE_TIMEOUT = 10.0
+OPENROUTER_POOL_TIMEOUT = 10.0  # ожидание свободного соединения из пула
+OPENROUTER_KEEPWARM_INTERVAL = 60.0  # пинг в активные часы, меньше KEEPALIVE_EXPIRY; 0 - выключено
+LLM_MAX_CONCURRENCY = 8  # одновременных запросов к LLM, остальные ждут в очереди
+LLM_REQUEST_DEADLINE = 45.0  # общий срок запроса с очередью и повторами, дальше - заглушка
+LLM_BREAKER_FAILURES = 5  # сбоев подряд до размыкания автомата модели
+LLM_BREAKER_RECOVERY = 30.0  # через сколько секунд пробовать модель снова
+# Модели, которым кэш промпта нужно размечать cache_control (остальные кэшируют префикс автоматически)
+PROMPT_CACHE_CONTROL_MODELS = ("anthropic/", "google/gemini")
+
+# Кэш истории диалогов в памяти (только без очереди: воркеры читают историю в других процессах)
+HISTORY_CACHE_ENABLED = getenv("HISTORY_CACHE_ENABLED", "1") == "1"
+HISTORY_CACHE_MAX_BYTES = 32 * 1024 * 1024  # общий лимит памяти, дальше вытеснение LRU
+HISTORY_CACHE_IDLE_SECONDS = 3600  # пользователи без сообщений дольше - вытесняются
+HISTORY_CACHE_SWEEP_INTERVAL = 300
+
+# Сторожевой поток event loop: стек главного потока при зависании дольше порога
+LOOP_STALL_THRESHOLD = float(getenv("LOOP_STALL_THRESHOLD", "1.0"))  # секунды; 0 - выключено
+LOOP_WATCHDOG_INTERVAL = 0.1  # как часто поток проверяет loop
+LOOP_STALL_REPORT_INTERVAL = 60.0  # не чаще одного отчёта со стеком за это время
+
+# Запись формы трафика для benchmarks/replay.py, например traffic/%Y%m%d-%H%M%S.jsonl.gz
+TRAFFIC_RECORD_PATH = getenv("TRAFFIC_RECORD_PATH") or None
+TRAFFIC_RECORD_FLUSH_INTERVAL = 5.0
+
+# Учёт токенов и бюджеты на день (токены промпта и ответа; 0 - без ограничения)
+USAGE_FLUSH_INTERVAL = 30.0  # как часто агрегаты расхода пишутся в БД
+USAGE_USER_DAILY_TOKENS = int(getenv("USAGE_USER_DAILY_TOKENS", "0"))  # на одного собеседника
+USAGE_PROACTIVE_DAILY_TOKENS = int(getenv("USAGE_PROACTIVE_DAILY_TOKENS", "0"))  # на все проактивные
+USAGE_TOTAL_DAILY_TOKENS = int(getenv("USAGE_TOTAL_DAILY_TOKENS", "0"))
+USAGE_CHEAP_MODEL = getenv("USAGE_CHEAP_MODEL", "meta-llama/llama-3.1-8b-instruct")  # после превышения бюджета
+# Цены для оценки стоимости, USD за миллион токенов (промпт, ответ) - сверяйте с openrouter.ai/models
+MODEL_PRICES = {
+    "deepseek/deepseek-chat-v3.1": (0.27, 1.10),
+    "meta-llama/llama-3.1-8b-instruct": (0.02, 0.03),
+}
+
+# Профилирование по команде .profile
+PROFILE_MAX_SECONDS = 120  # максимальная длительность одного захвата
+PROFILE_SAMPLE_INTERVAL = 0.005  # период выборок стека, секунды
+PROFILE_TOP_N = 30  # строк в каждом разделе отчёта
+PROFILE_TRACEMALLOC_FRAMES = 1  # глубина стека tracemalloc; 0 - без отчёта по памяти
+
+# Долгая память: архив всех сообщений и поиск похожих реплик для промпта
+MEMORY_ENABLED = getenv("MEMORY_ENABLED", "1") == "1"
+MEMORY_DIM = 128  # размер хэш-векторов: 100 тысяч сообщений - 50 МБ и ~3 мс на поиск
+MEMORY_TOP_K = 3  # сколько реплик из архива добавлять в промпт
+MEMORY_MIN_SCORE = 0.3  # минимальное косинусное сходство
+MEMORY_MIN_CHARS = 12  # более короткие сообщения не индексируются
+MEMORY_SNIPPET_CHARS = 300
+MEMORY_MAX_BYTES = 128 * 1024 * 1024  # индексы в памяти, дальше вытеснение LRU
+MEMORY_FLUSH_INTERVAL = 2.0  # как часто архив пишется в БД
+
+# Защита от перегрузки: ступени деградации по росту нагрузки
+OVERLOAD_ENABLED = getenv("OVERLOAD_ENABLED", "1") == "1"
+OVERLOAD_CHECK_INTERVAL = 1.0
+# Значения сигналов, которые считаются нагрузкой 1.0; берётся максимум по сигналам
+OVERLOAD_LIMITS = {
+    "llm_queue": 16,  # запросов LLM в очереди (в режиме очереди - ещё и задачи воркеров)
+    "transcriptions": 8,  # транскрипций в ожидании
+    "loop_lag": 0.5,  # p95 задержки event loop за OVERLOAD_LAG_WINDOW, секунды
+}
+OVERLOAD_LAG_WINDOW = 10.0
+# (ступень, нагрузка включения) по порядку; ступень можно убрать из списка
+OVERLOAD_STEPS = (
+    ("pause_proactive", 0.5),  # не слать проактивные сообщения
+    ("longer_debounce", 0.75),  # ждать дольше и склеивать больше сообщений, без спекуляции
+    ("cap_max_tokens", 1.0),  # короче ответы
+    ("cheap_model", 1.5),  # USAGE_CHEAP_MODEL вместо основной
+    ("sticker_only", 3.0),  # отвечать только стикером, без LLM
+)
+OVERLOAD_RECOVERY_RATIO = 0.7  # ступень выключается ниже этой доли порога...
+OVERLOAD_HOLD_SECONDS = 30.0  # ...продержавшись столько секунд
+OVERLOAD_DEBOUNCE_FACTOR = 2.0
+OVERLOAD_MAX_TOKENS = 200
+OVERLOAD_STICKER = 1  # номер из STICKERS для ответа только стикером
+
+# Настройки, меняющиеся без перезапуска (.set/.get): JSON с отличиями от умолчаний
+RUNTIME_SETTINGS_PATH = getenv("RUNTIME_SETTINGS_PATH", "runtime_settings.json")
+RUNTIME_SETTINGS_RELOAD_INTERVAL = 5.0  # как часто проверять, не изменился ли файл
+
+# Обслуживание SQLite вне WORKING_HOURS: хранение, архивация неактивных, VACUUM и ANALYZE
+MAINTENANCE_ENABLED = getenv("MAINTENANCE_ENABLED", "1") == "1"
+MAINTENANCE_CHECK_INTERVAL = 15 * 60  # как часто проверять, не пора ли запуститься (не чаще раза в сутки)
+MAINTENANCE_ARCHIVE_RETENTION_DAYS = 365  # сообщения message_archive старше удаляются; 0 - хранить всегда
+MAINTENANCE_USAGE_RETENTION_DAYS = 400  # дневной расход usage_daily; 0 - хранить всегда
+MAINTENANCE_INACTIVE_DAYS = 90  # молчащие дольше архивируются: без ледоколов, окно истории очищается
+MAINTENANCE_BATCH_SIZE = 500  # строк в одной короткой транзакции
+MAINTENANCE_VACUUM_PAGES = 256  # страниц за один шаг incremental_vacuum
+MAINTENANCE_STEP_PAUSE = 0.2  # пауза между шагами, секунды: запись чатов не ждёт блокировку
+MAINTENANCE_ANALYSIS_LIMIT = 1000  # PRAGMA analysis_limit: ANALYZE по выборке строк
+
+# Остановка: буферы дообрабатываются до DRAIN_DEADLINE, остальное - в снимок до следующего запуска
+DRAIN_DEADLINE = 20.0  # секунды на ответы при остановке
+BUFFER_SNAPSHOT_PATH = getenv("BUFFER_SNAPSHOT_PATH", "buffer_snapshot.json")
+BUFFER_SNAPSHOT_MAX_AGE = 6 * 3600  # более старые буферы после запуска не обрабатываются
+
+# Гистограммы активности 7x24 по сообщениям архива: ледоколы в час пика собеседника
+ACTIVITY_ENABLED = getenv("ACTIVITY_ENABLED", "1") == "1"
+ACTIVITY_INTERVAL = 10 * 60  # как часто дочитывать новые сообщения архива, секунды
+ACTIVITY_BATCH_SIZE = 5000  # сообщений за один запрос
+ACTIVITY_STATE_PATH = getenv("ACTIVITY_STATE_PATH", "activity_histograms.npz")
+ACTIVITY_MIN_MESSAGES = 20  # с меньшей историей ледокол уходит в любой час WORKING_HOURS
+ICEBREAKER_REPLY_HOURS = 6  # ответ позже не считается ответом на ледокол
+ICEBREAKER_STATS_DAYS = 7  # окно доли ответов в .stats
+
 # Ограничения/настройки
 CONTEXT_MAX_TURNS = 6  # сколько ходов диалога хранить на пользователя
 REPLY_ON_UNKNOWN = False  # отвечать ли незанесённым в БД пользователям
+WORKING_HOURS = (9, 22)  # активные часы: проактивные сообщения только с 9 до 22
 
 # Стикеры
 STICKERS = {
@@ -1,11 +1,13 @@
 import json
+from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import select
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 
-from .models import User, Dialog
+from .models import ArchivedMessage, IcebreakerLog, User, Dialog, UsageDaily
 from config import CONTEXT_MAX_TURNS
 from app.time_utils import utc_now
 
@@ -23,15 +25,17 @@ async def _cleanup_transaction(session: AsyncSession, success: bool):
 
 
 
-async def upsert_user(session: AsyncSession, tg_id: int, username: Optional[str]) -> User:
+async def upsert_user(session: AsyncSession, account_id: str, tg_id: int, username: Optional[str]) -> User:
     """Создать или обновить пользователя"""
     success = False
     try:
-        res = await session.execute(select(User).where(User.tg_id == tg_id))
+        res = await session.execute(
+            select(User).where(User.account_id == account_id, User.tg_id == tg_id)
+        )
         user = res.scalar_one_or_none()
 
         if user is None:
-            user = User(tg_id=tg_id, username=username, mode="normal", active=True)
+            user = User(account_id=account_id, tg_id=tg_id, username=username, mode="normal", active=True)
             session.add(user)
             await session.flush()
 
@@ -54,11 +58,13 @@ async def upsert_user(session: AsyncSession, tg_id: int, username: Optional[str]
         await _cleanup_transaction(session, success)
 
 
-async def get_user(session: AsyncSession, tg_id: int) -> Optional[User]:
-    """Получить пользователя по tg_id"""
+async def get_user(session: AsyncSession, account_id: str, tg_id: int) -> Optional[User]:
+    """Получить пользователя аккаунта по tg_id"""
     success = False
     try:
-        res = await session.execute(select(User).where(User.tg_id == tg_id))
+        res = await session.execute(
+            select(User).where(User.account_id == account_id, User.tg_id == tg_id)
+        )
         user = res.scalar_one_or_none()
         success = True
         return user
@@ -69,11 +75,11 @@ async def get_user(session: AsyncSession, tg_id: int) -> Optional[User]:
         await _cleanup_transaction(session, success)
 
 
-async def set_mode(session: AsyncSession, tg_id: int, mode: str) -> bool:
+async def set_mode(session: AsyncSession, account_id: str, tg_id: int, mode: str) -> bool:
     """Установить режим общения"""
     success = False
     try:
-        user = await get_user(session, tg_id)
+        user = await get_user(session, account_id, tg_id)
         if not user:
             return False
         user.mode = mode
@@ -87,11 +93,11 @@ async def set_mode(session: AsyncSession, tg_id: int, mode: str) -> bool:
         await _cleanup_transaction(session, success)
 
 
-async def set_active(session: AsyncSession, tg_id: int, active: bool) -> bool:
+async def set_active(session: AsyncSession, account_id: str, tg_id: int, active: bool) -> bool:
     """Включить/выключить ответы пользователю"""
     success = False
     try:
-        user = await get_user(session, tg_id)
+        user = await get_user(session, account_id, tg_id)
         if not user:
             return False
         user.active = active
@@ -105,10 +111,10 @@ async def set_active(session: AsyncSession, tg_id: int, active: bool) -> bool:
         await _cleanup_transaction(session, success)
 
 
-async def set_proactive(session: AsyncSession, tg_id: int, enabled: bool) -> bool:
+async def set_proactive(session: AsyncSession, account_id: str, tg_id: int, enabled: bool) -> bool:
     success = False
     try:
-        user = await get_user(session, tg_id)
+        user = await get_user(session, account_id, tg_id)
         if not user:
             return False
         user.proactive_enabled = enabled
@@ -122,6 +128,89 @@ async def set_proactive(session: AsyncSession, tg_id: int, enabled: bool) -> boo
         await _cleanup_transaction(session, success)
 
 
+async def bulk_upsert_users(session: AsyncSession, account_id: str, rows: list[dict]) -> tuple[int, int]:
+    """Создать или обновить пачку пользователей одной транзакцией.
+
+    rows: [{'tg_id': ..., 'username'?: ..., 'mode'?: ..., 'active'?: ..., 'proactive_enabled'?: ...}]
+    Обновляются только переданные поля; username=None не затирает известный.
+    Возвращает (создано, обновлено). Диалоги создаются лениво в get_or_create_dialog.
+    """
+    success = False
+    try:
+        tg_ids = [row["tg_id"] for row in rows]
+        res = await session.execute(
+            select(User.tg_id).where(User.account_id == account_id, User.tg_id.in_(tg_ids))
+        )
+        existing = set(res.scalars().all())
+
+        # Один INSERT ... ON CONFLICT на каждый набор полей
+        groups: dict[tuple, list[dict]] = {}
+        for row in rows:
+            values = {key: value for key, value in row.items() if value is not None}
+            groups.setdefault(tuple(sorted(values)), []).append(values)
+
+        for columns, values in groups.items():
+            stmt = sqlite_insert(User).values(
+                [{"account_id": account_id, "mode": "normal", "active": True, **row} for row in values]
+            )
+            updated_columns = [column for column in columns if column != "tg_id"]
+            if updated_columns:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[User.account_id, User.tg_id],
+                    set_={column: stmt.excluded[column] for column in updated_columns},
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=[User.account_id, User.tg_id])
+            await session.execute(stmt)
+
+        await session.commit()
+        success = True
+        created = len(set(tg_ids) - existing)
+        return created, len(set(tg_ids)) - created
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
+async def bulk_update_users(
+    session: AsyncSession,
+    account_id: str,
+    values: dict,
+    tg_ids: list[int] | None = None,
+    filters: dict | None = None,
+) -> tuple[int, list[int]]:
+    """Обновить поля пользователей по списку tg_id и/или фильтру одним UPDATE.
+
+    filters: равенства полей User, например {'active': True}; пустой - все пользователи аккаунта.
+    Возвращает (обновлено, не найденные tg_id).
+    """
+    success = False
+    try:
+        conditions = [User.account_id == account_id]
+        conditions += [getattr(User, field) == value for field, value in (filters or {}).items()]
+
+        missing: list[int] = []
+        if tg_ids is not None:
+            conditions.append(User.tg_id.in_(tg_ids))
+            res = await session.execute(select(User.tg_id).where(*conditions))
+            found = set(res.scalars().all())
+            missing = [tg_id for tg_id in tg_ids if tg_id not in found]
+
+        result = await session.execute(
+            update(User).where(*conditions).values(**values).execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        success = True
+        return result.rowcount, missing
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
 async def get_or_create_dialog(session: AsyncSession, user: User) -> Dialog:
     """Получить или создать диалог для пользователя"""
     success = False
@@ -160,6 +249,7 @@ async def append_history(session: AsyncSession, user: User, role: str, content:
 
         if role == "user":
             user.last_activity = utc_now()
+            user.archived_at = None
 
         # Обрезаем до последних CONTEXT_MAX_TURNS*2 сообщений
         if len(hist) > CONTEXT_MAX_TURNS * 2:
@@ -178,6 +268,43 @@ async def append_history(session: AsyncSession, user: User, role: str, content:
         await _cleanup_transaction(session, success)
 
 
+async def extend_history(
+    session: AsyncSession, user_id: int, messages: list[dict], last_activity: Optional[datetime] = None
+) -> list[dict]:
+    """Дописать в историю несколько сообщений одной транзакцией (отложенная запись из кэша)"""
+    success = False
+    try:
+        res = await session.execute(select(Dialog).where(Dialog.user_id == user_id))
+        dialog = res.scalar_one_or_none()
+        if dialog is None:
+            dialog = Dialog(user_id=user_id, history_json="[]")
+            session.add(dialog)
+
+        try:
+            hist = json.loads(dialog.history_json)
+        except json.JSONDecodeError:
+            hist = []
+
+        hist.extend(messages)
+        if len(hist) > CONTEXT_MAX_TURNS * 2:
+            hist = hist[-CONTEXT_MAX_TURNS * 2:]
+        dialog.history_json = json.dumps(hist, ensure_ascii=False)
+
+        if last_activity is not None:
+            await session.execute(
+                update(User).where(User.id == user_id).values(last_activity=last_activity, archived_at=None)
+            )
+        await session.commit()
+
+        success = True
+        return hist
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
 async def get_history(session: AsyncSession, user: User) -> list[dict]:
     """Получить историю диалога"""
     success = False
@@ -197,16 +324,20 @@ async def get_history(session: AsyncSession, user: User) -> list[dict]:
         await _cleanup_transaction(session, success)
 
 
-async def clear_history(session: AsyncSession, tg_id: int) -> bool:
+async def clear_history(session: AsyncSession, account_id: str, tg_id: int) -> bool:
     """Очистить историю диалога пользователя"""
     success = False
     try:
-        user = await get_user(session, tg_id)
+        user = await get_user(session, account_id, tg_id)
         if not user:
             return False
 
         dialog = await get_or_create_dialog(session, user)
         dialog.history_json = "[]"
+        # Долгая память забывается вместе с историей
+        await session.execute(
+            delete(ArchivedMessage).where(ArchivedMessage.account_id == account_id, ArchivedMessage.tg_id == tg_id)
+        )
         await session.commit()
         success = True
         return True
@@ -215,3 +346,270 @@ async def clear_history(session: AsyncSession, tg_id: int) -> bool:
         return False
     finally:
         await _cleanup_transaction(session, success)
+
+
+USAGE_COUNTERS = ("requests", "prompt_tokens", "completion_tokens", "cached_tokens", "latency_total", "cost")
+
+
+async def add_usage(session: AsyncSession, rows: list[dict]) -> None:
+    """Прибавить пачку агрегатов расхода одной транзакцией.
+
+    rows: [{'account_id', 'tg_id', 'mode', 'kind', 'model', 'day', **USAGE_COUNTERS}]
+    """
+    if not rows:
+        return
+    success = False
+    try:
+        stmt = sqlite_insert(UsageDaily).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                UsageDaily.account_id, UsageDaily.tg_id, UsageDaily.mode,
+                UsageDaily.kind, UsageDaily.model, UsageDaily.day,
+            ],
+            set_={column: getattr(UsageDaily, column) + stmt.excluded[column] for column in USAGE_COUNTERS},
+        )
+        await session.execute(stmt)
+        await session.commit()
+        success = True
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
+async def get_usage_totals(
+    session: AsyncSession,
+    since_day: str,
+    group_by: tuple[str, ...],
+    account_id: Optional[str] = None,
+    tg_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> list[dict]:
+    """Суммы расхода с since_day включительно, сгруппированные по колонкам group_by"""
+    columns = [getattr(UsageDaily, column) for column in group_by]
+    tokens = func.sum(UsageDaily.prompt_tokens + UsageDaily.completion_tokens)
+    stmt = select(
+        *columns,
+        func.sum(UsageDaily.requests),
+        func.sum(UsageDaily.prompt_tokens),
+        func.sum(UsageDaily.completion_tokens),
+        func.sum(UsageDaily.cached_tokens),
+        func.sum(UsageDaily.latency_total),
+        func.sum(UsageDaily.cost),
+        tokens,
+    ).where(UsageDaily.day >= since_day)
+    if account_id is not None:
+        stmt = stmt.where(UsageDaily.account_id == account_id)
+    if tg_id is not None:
+        stmt = stmt.where(UsageDaily.tg_id == tg_id)
+    if columns:
+        stmt = stmt.group_by(*columns).order_by(tokens.desc())
+    if limit:
+        stmt = stmt.limit(limit)
+
+    res = await session.execute(stmt)
+    totals = []
+    for row in res.all():
+        values = dict(zip(group_by, row[:len(group_by)]))
+        values.update(zip(USAGE_COUNTERS + ("tokens",), (value or 0 for value in row[len(group_by):])))
+        totals.append(values)
+    return totals
+
+
+async def archive_messages(session: AsyncSession, rows: list[dict]) -> None:
+    """Дописать сообщения в архив одной пачкой: account_id, tg_id, role, content, created_at"""
+    if not rows:
+        return
+    success = False
+    try:
+        await session.execute(ArchivedMessage.__table__.insert(), rows)
+        await session.commit()
+        success = True
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
+async def get_archived_messages(
+    session: AsyncSession, account_id: str, tg_id: int, after_id: int = 0
+) -> list[tuple[int, str, str, datetime]]:
+    """Сообщения из архива новее after_id по порядку: (id, role, content, created_at)"""
+    res = await session.execute(
+        select(ArchivedMessage.id, ArchivedMessage.role, ArchivedMessage.content, ArchivedMessage.created_at)
+        .where(
+            ArchivedMessage.account_id == account_id,
+            ArchivedMessage.tg_id == tg_id,
+            ArchivedMessage.id > after_id,
+        )
+        .order_by(ArchivedMessage.id)
+    )
+    return [tuple(row) for row in res.all()]
+
+
+async def delete_archived_before(session: AsyncSession, before: datetime, limit: int) -> int:
+    """Удалить до limit сообщений архива старше before одной короткой транзакцией"""
+    success = False
+    try:
+        ids = select(ArchivedMessage.id).where(ArchivedMessage.created_at < before).limit(limit)
+        result = await session.execute(
+            delete(ArchivedMessage).where(ArchivedMessage.id.in_(ids.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        success = True
+        return result.rowcount
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
+async def delete_usage_before(session: AsyncSession, before_day: str, limit: int) -> int:
+    """Удалить до limit дневных агрегатов расхода раньше before_day (YYYY-MM-DD)"""
+    success = False
+    try:
+        ids = select(UsageDaily.id).where(UsageDaily.day < before_day).limit(limit)
+        result = await session.execute(
+            delete(UsageDaily).where(UsageDaily.id.in_(ids.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        success = True
+        return result.rowcount
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
+async def archive_inactive_users(session: AsyncSession, before: datetime, limit: int) -> list[tuple[str, int]]:
+    """Архивировать до limit пользователей, молчащих с before: отметка archived_at и пустое окно истории.
+
+    Окно истории диалогов, начатых до появления архива сообщений, сначала
+    переносится в message_archive (со временем последней активности), чтобы
+    долгая память его не потеряла. Возвращает [(account_id, tg_id)].
+    """
+    success = False
+    try:
+        res = await session.execute(
+            select(User.id, User.account_id, User.tg_id, User.last_activity, Dialog.history_json)
+            .outerjoin(Dialog, Dialog.user_id == User.id)
+            .where(User.archived_at.is_(None), User.last_activity < before)
+            .limit(limit)
+        )
+        rows = res.all()
+        if not rows:
+            success = True
+            return []
+
+        tg_ids_by_account: dict[str, list[int]] = {}
+        for _, account_id, tg_id, _, _ in rows:
+            tg_ids_by_account.setdefault(account_id, []).append(tg_id)
+        archived = set()
+        for account_id, tg_ids in tg_ids_by_account.items():
+            res = await session.execute(
+                select(ArchivedMessage.tg_id)
+                .where(ArchivedMessage.account_id == account_id, ArchivedMessage.tg_id.in_(tg_ids))
+                .group_by(ArchivedMessage.tg_id)
+            )
+            archived.update((account_id, tg_id) for tg_id in res.scalars().all())
+
+        legacy = []
+        for _, account_id, tg_id, last_activity, history_json in rows:
+            if (account_id, tg_id) in archived or not history_json:
+                continue
+            try:
+                history = json.loads(history_json)
+            except json.JSONDecodeError:
+                continue
+            legacy.extend(
+                {"account_id": account_id, "tg_id": tg_id, "role": message.get("role", "user"),
+                 "content": message.get("content", ""), "created_at": last_activity}
+                for message in history if message.get("content")
+            )
+        if legacy:
+            await session.execute(ArchivedMessage.__table__.insert(), legacy)
+
+        user_ids = [row[0] for row in rows]
+        await session.execute(update(Dialog).where(Dialog.user_id.in_(user_ids)).values(history_json="[]"))
+        await session.execute(update(User).where(User.id.in_(user_ids)).values(archived_at=utc_now()))
+        await session.commit()
+        success = True
+        return [(account_id, tg_id) for _, account_id, tg_id, _, _ in rows]
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
+async def get_user_message_times(
+    session: AsyncSession, after_id: int, limit: int
+) -> list[tuple[int, str, int, datetime]]:
+    """Сообщения собеседников из архива новее after_id по порядку: (id, account_id, tg_id, created_at)"""
+    res = await session.execute(
+        select(ArchivedMessage.id, ArchivedMessage.account_id, ArchivedMessage.tg_id, ArchivedMessage.created_at)
+        .where(ArchivedMessage.id > after_id, ArchivedMessage.role == "user")
+        .order_by(ArchivedMessage.id)
+        .limit(limit)
+    )
+    return [tuple(row) for row in res.all()]
+
+
+async def add_icebreaker(session: AsyncSession, account_id: str, tg_id: int, peak_hour: bool) -> None:
+    """Записать отправленный ледокол"""
+    success = False
+    try:
+        session.add(IcebreakerLog(account_id=account_id, tg_id=tg_id, peak_hour=peak_hour))
+        await session.commit()
+        success = True
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
+async def get_unanswered_icebreakers(
+    session: AsyncSession, since: datetime
+) -> list[tuple[int, str, int, datetime]]:
+    """Ледоколы без ответа, отправленные после since: (id, account_id, tg_id, sent_at)"""
+    res = await session.execute(
+        select(IcebreakerLog.id, IcebreakerLog.account_id, IcebreakerLog.tg_id, IcebreakerLog.sent_at)
+        .where(IcebreakerLog.sent_at >= since, IcebreakerLog.answered_at.is_(None))
+    )
+    return [tuple(row) for row in res.all()]
+
+
+async def mark_icebreakers_answered(session: AsyncSession, answers: dict[int, datetime]) -> None:
+    """Отметить ответы на ледоколы: {id: время ответа}"""
+    if not answers:
+        return
+    success = False
+    try:
+        for icebreaker_id, answered_at in answers.items():
+            await session.execute(
+                update(IcebreakerLog).where(IcebreakerLog.id == icebreaker_id).values(answered_at=answered_at)
+            )
+        await session.commit()
+        success = True
+    except SQLAlchemyError as e:
+        await session.rollback()
+        raise e
+    finally:
+        await _cleanup_transaction(session, success)
+
+
+async def get_icebreaker_stats(session: AsyncSession, since: datetime) -> dict[bool, tuple[int, int]]:
+    """{peak_hour: (отправлено, с ответом)} для ледоколов с since"""
+    res = await session.execute(
+        select(IcebreakerLog.peak_hour, func.count(), func.count(IcebreakerLog.answered_at))
+        .where(IcebreakerLog.sent_at >= since)
+        .group_by(IcebreakerLog.peak_hour)
+    )
+    return {bool(peak_hour): (sent, answered) for peak_hour, sent, answered in res.all()}
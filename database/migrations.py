@@ -0,0 +1,144 @@
+"""Версионированные миграции схемы SQLite.
+
+Версия схемы хранится в таблице schema_version. При старте читается одна
+строка: если версия актуальна, больше ничего не делается. Иначе создаются
+недостающие таблицы и по порядку применяются миграции новее текущей версии,
+каждая в своей транзакции вместе с записью о ней.
+
+Миграции должны быть идемпотентными (IF NOT EXISTS, проверка колонок), потому
+что на новой БД create_all уже создаёт актуальную схему.
+
+Новая БД сразу создаётся в режиме auto_vacuum=INCREMENTAL: его можно включить
+только до первой таблицы, старую БД переводит команда .vacuum.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database.models import ArchivedMessage, Base, IcebreakerLog, LEGACY_ACCOUNT_ID, UsageDaily
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable  # upgrade(sync_conn)
+
+
+def _add_account_id(sync_conn):
+    """Добавляет account_id в таблицу users, созданную до поддержки нескольких аккаунтов"""
+    columns = {column["name"] for column in inspect(sync_conn).get_columns("users")}
+    if "account_id" in columns:
+        return
+
+    sync_conn.exec_driver_sql(
+        f"ALTER TABLE users ADD COLUMN account_id VARCHAR(64) NOT NULL DEFAULT '{LEGACY_ACCOUNT_ID}'"
+    )
+    # Уникальность tg_id теперь в пределах аккаунта
+    sync_conn.exec_driver_sql("DROP INDEX IF EXISTS ix_users_tg_id")
+    sync_conn.exec_driver_sql("CREATE INDEX ix_users_tg_id ON users (tg_id)")
+    sync_conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS uq_users_account_tg ON users (account_id, tg_id)")
+
+
+def _add_proactive_index(sync_conn):
+    """Выборка проактивных пользователей аккаунта без полного сканирования users"""
+    sync_conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_users_proactive "
+        "ON users (account_id, active, proactive_enabled, last_activity)"
+    )
+
+
+def _add_history_indexes(sync_conn):
+    """Поиск диалога пользователя (get_history, append_history) по user_id"""
+    sync_conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_dialogs_user_id ON dialogs (user_id)")
+
+
+def _add_usage_daily(sync_conn):
+    """Дневной расход токенов по собеседникам и режимам"""
+    UsageDaily.__table__.create(sync_conn, checkfirst=True)
+
+
+def _add_message_archive(sync_conn):
+    """Архив всех сообщений для долгой памяти"""
+    ArchivedMessage.__table__.create(sync_conn, checkfirst=True)
+
+
+def _add_user_archived_at(sync_conn):
+    """Отметка об архивации неактивного пользователя обслуживанием БД"""
+    columns = {column["name"] for column in inspect(sync_conn).get_columns("users")}
+    if "archived_at" not in columns:
+        sync_conn.exec_driver_sql("ALTER TABLE users ADD COLUMN archived_at DATETIME")
+
+
+def _add_icebreaker_log(sync_conn):
+    """Журнал ледоколов для доли ответов"""
+    IcebreakerLog.__table__.create(sync_conn, checkfirst=True)
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "users.account_id for multiple accounts", _add_account_id),
+    Migration(2, "composite index for proactive selection", _add_proactive_index),
+    Migration(3, "dialogs.user_id index for history lookups", _add_history_indexes),
+    Migration(4, "usage_daily table for token accounting", _add_usage_daily),
+    Migration(5, "message_archive table for long-term memory", _add_message_archive),
+    Migration(6, "users.archived_at for inactive user archiving", _add_user_archived_at),
+    Migration(7, "icebreaker_log table for proactive reply tracking", _add_icebreaker_log),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def _current_version(sync_conn) -> int:
+    exists = sync_conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).first()
+    if not exists:
+        return 0
+    return sync_conn.exec_driver_sql("SELECT COALESCE(MAX(version), 0) FROM schema_version").scalar()
+
+
+def _ensure_version_table(sync_conn):
+    sync_conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, "
+        "description TEXT NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+
+
+async def run_migrations(engine: AsyncEngine) -> list[int]:
+    """Привести схему к LATEST_VERSION; возвращает применённые версии"""
+    async with engine.connect() as conn:
+        current = await conn.run_sync(_current_version)
+
+    if current >= LATEST_VERSION:
+        logger.info("Схема БД актуальна (версия %s)", current)
+        return []
+
+    async with engine.begin() as conn:
+        if current == 0:
+            # На пустой БД действует до создания первой таблицы, на существующей игнорируется
+            await conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_ensure_version_table)
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        async with engine.begin() as conn:
+            await conn.run_sync(migration.upgrade)
+            await conn.execute(
+                text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                {"version": migration.version, "description": migration.description},
+            )
+        logger.info("Миграция %s применена: %s", migration.version, migration.description)
+        applied.append(migration.version)
+    return applied
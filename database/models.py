@@ -1,24 +1,36 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import Integer, String, Boolean, Text, ForeignKey, DateTime
+from sqlalchemy import Integer, String, Boolean, Text, ForeignKey, DateTime, Index, Float, BigInteger
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 from app.time_utils import utc_now
 
+# account_id единственного аккаунта до поддержки нескольких аккаунтов
+LEGACY_ACCOUNT_ID = "tg_ai_userbot"
+
 class Base(DeclarativeBase):
     pass
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("uq_users_account_tg", "account_id", "tg_id", unique=True),
+        # Выборка проактивных пользователей аккаунта
+        Index("ix_users_proactive", "account_id", "active", "proactive_enabled", "last_activity"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    tg_id: Mapped[int] = mapped_column(Integer, unique=True, index=True)
+    # Аккаунт-владелец контакта: один tg_id может быть у нескольких аккаунтов
+    account_id: Mapped[str] = mapped_column(String(64), default=LEGACY_ACCOUNT_ID, server_default=LEGACY_ACCOUNT_ID)
+    tg_id: Mapped[int] = mapped_column(Integer, index=True)
     username: Mapped[str | None] = mapped_column(String(255), nullable=True)
     mode: Mapped[str] = mapped_column(String(50), default="normal")   # normal|friendly|rude|funny...
     active: Mapped[bool] = mapped_column(Boolean, default=True)
 
     proactive_enabled: Mapped[bool] = mapped_column(Boolean, default=False)
     last_activity: Mapped[datetime] = mapped_column(DateTime, default=utc_now)
+    # Когда обслуживание БД архивировало молчащего пользователя; сбрасывается его новым сообщением
+    archived_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, default=None)
 
     dialogs: Mapped[list["Dialog"]] = relationship("Dialog", back_populates="user", cascade="all, delete-orphan")
 
@@ -31,3 +43,57 @@ class Dialog(Base):
     history_json: Mapped[str] = mapped_column(Text, default="[]")
 
     user: Mapped[User] = relationship("User", back_populates="dialogs")
+
+
+class UsageDaily(Base):
+    """Расход токенов за день в разрезе собеседника, режима и модели"""
+    __tablename__ = "usage_daily"
+    __table_args__ = (
+        Index("uq_usage_daily_key", "account_id", "tg_id", "mode", "kind", "model", "day", unique=True),
+        Index("ix_usage_daily_day", "day"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    account_id: Mapped[str] = mapped_column(String(64))
+    tg_id: Mapped[int] = mapped_column(BigInteger)  # 0 - без собеседника
+    mode: Mapped[str] = mapped_column(String(50))
+    kind: Mapped[str] = mapped_column(String(16))  # reply|proactive
+    model: Mapped[str] = mapped_column(String(128))
+    day: Mapped[str] = mapped_column(String(10))  # YYYY-MM-DD, локальная дата
+    requests: Mapped[int] = mapped_column(Integer, default=0)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    cached_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    latency_total: Mapped[float] = mapped_column(Float, default=0.0)  # секунды суммарно
+    cost: Mapped[float] = mapped_column(Float, default=0.0)  # оценка, USD
+
+
+class ArchivedMessage(Base):
+    """Все сообщения диалогов без обрезки окна истории: долгая память и статистика активности"""
+    __tablename__ = "message_archive"
+    __table_args__ = (
+        Index("ix_message_archive_user", "account_id", "tg_id", "id"),
+        Index("ix_message_archive_created", "created_at"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    account_id: Mapped[str] = mapped_column(String(64))
+    tg_id: Mapped[int] = mapped_column(BigInteger)
+    role: Mapped[str] = mapped_column(String(16))  # user|assistant
+    content: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utc_now)
+
+
+class IcebreakerLog(Base):
+    """Отправленные ледоколы и ответ на них: доля ответов по способу выбора времени"""
+    __tablename__ = "icebreaker_log"
+    __table_args__ = (
+        Index("ix_icebreaker_log_sent", "sent_at"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    account_id: Mapped[str] = mapped_column(String(64))
+    tg_id: Mapped[int] = mapped_column(BigInteger)
+    sent_at: Mapped[datetime] = mapped_column(DateTime, default=utc_now)
+    peak_hour: Mapped[bool] = mapped_column(Boolean, default=False)  # время выбрано по гистограмме активности
+    answered_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True, default=None)
@@ -1,8 +1,15 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
+from app import metrics
 from config import DB_URL
 
 engine = create_async_engine(DB_URL, echo=False, future=True)
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _count_db_operation(conn, cursor, statement, parameters, context, executemany):
+    metrics.mark("db_ops")
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 async def get_session() -> AsyncSession:
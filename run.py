@@ -1,15 +1,29 @@
+import asyncio
 import logging
 import os
 
 from pyrogram import idle
 
-from app.client import client
-import app.handlers  # регистрирует хендлеры
-from app.message_buffer import cancel_all_user_tasks
-from app.openrouter import close_openrouter_client
+from app.client import clients
+from app.handlers import register_handlers
+from app.message_buffer import cancel_all_user_tasks, drain_user_buffers, idle_user_sweeper, restore_user_buffers
+from app.metrics import loop_lag_monitor
+from app.openrouter import close_openrouter_client, start_openrouter_keepwarm, start_usage_tracking
+from app.overload import overload_controller
 from app.proactive_messages import start_proactive_messaging, stop_proactive_messaging
+from app.reply_dispatcher import start_reply_dispatcher, stop_reply_dispatcher
+from app.runtime_settings import runtime_settings
+from app.traffic_recorder import traffic_recorder
+from app.transcription import preload_whisper_model
+from app.watchdog import loop_watchdog
+from app.worker import WorkerPool
+from services.activity import activity_analytics
+from services.history_cache import history_cache
+from services.long_term_memory import long_term_memory
+from services.maintenance import db_maintenance
+from config import JOB_QUEUE_ENABLED
 from database.session import engine, dispose_engine
-from database.models import Base
+from database.migrations import run_migrations
 
 os.environ["PATH"] += os.pathsep + "C:\\Users\\zhart\\scoop\\apps\\ffmpeg\\current\\bin"
 
@@ -22,30 +36,67 @@ logging.basicConfig(
 
 async def init_database():
     """Инициализация базы данных"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("✅ Database tables created")
+    applied = await run_migrations(engine)
+    if applied:
+        print(f"✅ Database migrated: {', '.join(map(str, applied))}")
+    else:
+        print("✅ Database schema is up to date")
 
 
 async def main():
+    started_clients = []
     proactive_started = False
-    client_started = False
+    worker_pool = None
+    dispatcher_started = False
     try:
+        loop_lag_monitor.start()
+        runtime_settings.start()
+        loop_watchdog.start()
+
         # Инициализируем БД
         await init_database()
-
-        # Запускаем клиент
-        await client.start()
-        client_started = True
+        start_usage_tracking()
+        long_term_memory.start()
+
+        if JOB_QUEUE_ENABLED:
+            # Тяжёлая работа - в процессах-воркерах, здесь только приём и отправка
+            worker_pool = WorkerPool()
+            worker_pool.start()
+        else:
+            await preload_whisper_model()
+
+        # Запускаем клиенты всех аккаунтов
+        for account_id, client in clients.items():
+            register_handlers(client)
+            await client.start()
+            started_clients.append(client)
+
+            # Получаем информацию о текущем аккаунте и выводим
+            me = await client.get_me()
+            print(f"✅ Userbot [{account_id}] запущен как @{me.username} (ID: {me.id})")
+
+        if JOB_QUEUE_ENABLED:
+            start_reply_dispatcher(started_clients)
+            dispatcher_started = True
+
+        if not JOB_QUEUE_ENABLED:
+            start_openrouter_keepwarm()
+            # Историю читают и пишут только в этом процессе - её можно кэшировать
+            history_cache.start()
+        idle_user_sweeper.start()
+        overload_controller.start()
+        traffic_recorder.start()
+        db_maintenance.start()
+        activity_analytics.start()
+
+        # Сообщения, на которые не успели ответить до прошлой остановки
+        await restore_user_buffers()
 
         # Запускаем проактивные сообщения
-        start_proactive_messaging(client)
+        for client in started_clients:
+            start_proactive_messaging(client)
         proactive_started = True
 
-        # Получаем информацию о текущем аккаунте и выводим
-        me = await client.get_me()
-        print(f"✅ Userbot запущен как @{me.username} (ID: {me.id})")
-
         # Ждём завершения
         await idle()
 
@@ -58,15 +109,34 @@ async def main():
         if proactive_started:
             await stop_proactive_messaging()
 
+        if started_clients:
+            # Ответить на накопленное, пока клиенты и LLM ещё работают
+            await drain_user_buffers()
         await cancel_all_user_tasks()
+        await idle_user_sweeper.stop()
+        await overload_controller.stop()
+        await traffic_recorder.stop()
+        await db_maintenance.stop()
+        await activity_analytics.stop()
+        await history_cache.stop()
+        await long_term_memory.stop()
+
+        if dispatcher_started:
+            await stop_reply_dispatcher()
+
+        if worker_pool:
+            await worker_pool.stop()
 
-        if client_started:
+        for client in started_clients:
             await client.stop()
 
         await close_openrouter_client()
         await dispose_engine()
+        await runtime_settings.stop()
+        loop_watchdog.stop()
+        await loop_lag_monitor.stop()
 
 
 if __name__ == "__main__":
-    # Используем client.run() для Pyrogram вместо asyncio.run(main())
-    client.run(main())
+    # Клиенты Pyrogram привязаны к текущему event loop, поэтому не используем asyncio.run()
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,227 @@
+"""Гистограммы активности собеседников и выбор часа для ледокола.
+
+По сообщениям собеседника из message_archive строится гистограмма 7x24
+(день недели x час по местному времени сервера - тому же, что WORKING_HOURS).
+Все гистограммы лежат одним массивом int32 (собеседники x 7 x 24), пачка
+новых сообщений раскладывается по корзинам одним np.add.at. Задача дочитывает
+архив от последнего обработанного id, состояние сохраняется в
+ACTIVITY_STATE_PATH, поэтому после перезапуска обрабатываются только новые
+сообщения.
+
+Час пика на сегодня - максимум по часам WORKING_HOURS суммы сегодняшнего дня
+недели и среднего по неделе, сглаженной по соседним часам. Ледоколы
+записываются в icebreaker_log, а ответ в течение ICEBREAKER_REPLY_HOURS
+отмечается по тем же новым сообщениям, так что доли ответов при выборе часа по
+пику и без него можно сравнить.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app import metrics
+from app.time_utils import from_timestamp, to_timestamp, utc_now
+from config import (
+    ACTIVITY_BATCH_SIZE,
+    ACTIVITY_ENABLED,
+    ACTIVITY_INTERVAL,
+    ACTIVITY_MIN_MESSAGES,
+    ACTIVITY_STATE_PATH,
+    ICEBREAKER_REPLY_HOURS,
+    ICEBREAKER_STATS_DAYS,
+    WORKING_HOURS,
+)
+from database.crud import (
+    add_icebreaker,
+    get_icebreaker_stats,
+    get_unanswered_icebreakers,
+    get_user_message_times,
+    mark_icebreakers_answered,
+)
+from database.session import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+DAYS, HOURS = 7, 24
+# 1970-01-01 - четверг, а день недели считается с понедельника = 0
+EPOCH_WEEKDAY = 3
+
+
+def local_slots(timestamps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(день недели, час) по местному времени сервера для массива UNIX-времён"""
+    # Смещение текущее: переход на летнее время сдвигает старые сообщения на час, для пика это не важно
+    offset = datetime.now().astimezone().utcoffset().total_seconds()
+    local = (timestamps + offset).astype(np.int64)
+    days, seconds = np.divmod(local, 86400)
+    return (days + EPOCH_WEEKDAY) % DAYS, seconds // 3600
+
+
+class ActivityHistograms:
+    def __init__(self):
+        self.rows: dict[tuple[str, int], int] = {}
+        self.counts = np.zeros((0, DAYS, HOURS), dtype=np.int32)
+        self.last_id = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _row(self, key: tuple[str, int]) -> int:
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.rows)
+            if row >= len(self.counts):
+                grown = np.zeros((max(64, len(self.counts) * 2), DAYS, HOURS), dtype=np.int32)
+                grown[:len(self.counts)] = self.counts
+                self.counts = grown
+        return row
+
+    def add(self, keys: list[tuple[str, int]], timestamps: np.ndarray):
+        rows = np.fromiter((self._row(key) for key in keys), dtype=np.int64, count=len(keys))
+        weekdays, hours = local_slots(timestamps)
+        np.add.at(self.counts, (rows, weekdays, hours), 1)
+
+    def peak_hour(self, key: tuple[str, int], weekday: int, hours: range) -> int | None:
+        """Час из hours, в который собеседник чаще всего пишет в этот день недели; None - мало данных"""
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        histogram = self.counts[row]
+        if histogram.sum() < ACTIVITY_MIN_MESSAGES:
+            return None
+        score = histogram[weekday] + histogram.sum(axis=0) / DAYS
+        # Сообщения в 19:55 и 20:05 - один и тот же вечер
+        score = score + 0.5 * (np.roll(score, 1) + np.roll(score, -1))
+        allowed = np.asarray(hours)
+        return int(allowed[np.argmax(score[allowed])])
+
+    def save(self, path: str):
+        keys = list(self.rows)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(
+                file,
+                counts=self.counts[:len(keys)],
+                accounts=np.array([account_id for account_id, _ in keys], dtype=str),
+                tg_ids=np.array([tg_id for _, tg_id in keys], dtype=np.int64),
+                last_id=np.int64(self.last_id),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "ActivityHistograms":
+        histograms = cls()
+        with np.load(path) as data:
+            keys = list(zip(data["accounts"].tolist(), data["tg_ids"].tolist()))
+            histograms.rows = {key: row for row, key in enumerate(keys)}
+            histograms.counts = data["counts"].astype(np.int32)
+            histograms.last_id = int(data["last_id"])
+        return histograms
+
+
+class ActivityAnalytics:
+    def __init__(self, interval: float = ACTIVITY_INTERVAL, path: str | None = ACTIVITY_STATE_PATH):
+        self.interval = interval
+        self.path = path
+        self.histograms = ActivityHistograms()
+        self.icebreaker_stats: dict[bool, tuple[int, int]] = {}
+        self.task = None
+
+    def peak_hour(self, account_id: str, tg_id: int, now: datetime | None = None) -> int | None:
+        now = now or datetime.now()
+        hours = range(WORKING_HOURS[0], WORKING_HOURS[1] + 1)
+        return self.histograms.peak_hour((account_id, tg_id), now.weekday(), hours)
+
+    async def record_icebreaker(self, account_id: str, tg_id: int, peak_hour: bool):
+        async with AsyncSessionLocal() as session:
+            await add_icebreaker(session, account_id, tg_id, peak_hour)
+        metrics.increment("icebreakers_peak" if peak_hour else "icebreakers_any_hour")
+
+    async def run(self) -> int:
+        """Дочитать новые сообщения архива; возвращает их число"""
+        started = time.monotonic()
+        processed = 0
+        while True:
+            async with AsyncSessionLocal() as session:
+                rows = await get_user_message_times(session, self.histograms.last_id, ACTIVITY_BATCH_SIZE)
+            if not rows:
+                break
+            keys = [(account_id, tg_id) for _, account_id, tg_id, _ in rows]
+            timestamps = np.array([to_timestamp(created_at) for _, _, _, created_at in rows], dtype=np.float64)
+            self.histograms.add(keys, timestamps)
+            self.histograms.last_id = rows[-1][0]
+            await self._match_icebreakers(keys, timestamps)
+            processed += len(rows)
+            if len(rows) < ACTIVITY_BATCH_SIZE:
+                break
+
+        if processed and self.path:
+            await asyncio.to_thread(self.histograms.save, self.path)
+        async with AsyncSessionLocal() as session:
+            self.icebreaker_stats = await get_icebreaker_stats(
+                session, utc_now() - timedelta(days=ICEBREAKER_STATS_DAYS)
+            )
+        if processed:
+            logger.info(
+                "Гистограммы активности: +%s сообщений за %.2fс, собеседников %s",
+                processed, time.monotonic() - started, len(self.histograms)
+            )
+        return processed
+
+    async def _match_icebreakers(self, keys: list[tuple[str, int]], timestamps: np.ndarray):
+        window = ICEBREAKER_REPLY_HOURS * 3600
+        async with AsyncSessionLocal() as session:
+            pending = await get_unanswered_icebreakers(session, from_timestamp(float(timestamps.min()) - window))
+        if not pending:
+            return
+
+        by_user: dict[tuple[str, int], list[float]] = {}
+        for key, timestamp in zip(keys, timestamps.tolist()):
+            by_user.setdefault(key, []).append(timestamp)
+
+        answers = {}
+        for icebreaker_id, account_id, tg_id, sent_at in pending:
+            sent = to_timestamp(sent_at)
+            replies = [t for t in by_user.get((account_id, tg_id), ()) if sent < t <= sent + window]
+            if replies:
+                answers[icebreaker_id] = from_timestamp(min(replies))
+        if answers:
+            async with AsyncSessionLocal() as session:
+                await mark_icebreakers_answered(session, answers)
+            metrics.increment("icebreakers_answered", len(answers))
+
+    def start(self):
+        if not ACTIVITY_ENABLED or self.task is not None:
+            return
+        if self.path and os.path.exists(self.path):
+            try:
+                self.histograms = ActivityHistograms.load(self.path)
+            except (OSError, ValueError, KeyError) as e:
+                # Пересоберём из архива
+                logger.error("Гистограммы активности %s не загружены: %s", self.path, e)
+        self.task = asyncio.create_task(self._main_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def _main_loop(self):
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error("Ошибка построения гистограмм активности: %s", e)
+            await asyncio.sleep(self.interval)
+
+
+activity_analytics = ActivityAnalytics()
+metrics.register_gauge("icebreaker_stats", lambda: activity_analytics.icebreaker_stats)
@@ -0,0 +1,84 @@
+"""Автомат защиты для модели LLM: closed -> open -> half-open -> closed.
+
+closed - запросы идут как обычно, подряд идущие сбои считаются. После
+failure_threshold сбоев автомат размыкается (open): все запросы к модели сразу
+получают отказ, провайдер не добивается повторами. Через recovery_timeout
+автомат пропускает один пробный запрос (half-open): успех замыкает его,
+сбой снова размыкает.
+
+Отдельно хранится общая пауза из Retry-After: пока она не истекла, новые
+запросы ждут, а не получают те же 429.
+"""
+from __future__ import annotations
+
+import logging
+import time
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Модель временно недоступна: автомат разомкнут"""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.cooldown_until = 0.0  # общая пауза по Retry-After
+        self._probe_in_flight = False
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning("Автомат %s: %s -> %s (сбоев подряд: %s)", self.name, self.state, state, self.failures)
+        metrics.increment(f"breaker_{state}")
+        self.state = state
+
+    def before_request(self, now: float | None = None):
+        """Пропустить запрос или бросить CircuitOpenError"""
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN:
+            if now - self.opened_at < self.recovery_timeout:
+                raise CircuitOpenError(f"Модель {self.name} недоступна, автомат разомкнут")
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                raise CircuitOpenError(f"Модель {self.name} проверяется пробным запросом")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self._probe_in_flight = False
+        self.failures = 0
+        self._transition(CLOSED)
+
+    def record_failure(self, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = now
+            self._transition(OPEN)
+
+    def release_probe(self):
+        """Пробный запрос завершился без ответа провайдера (отмена, ошибка клиента)"""
+        self._probe_in_flight = False
+
+    def set_cooldown(self, seconds: float, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        self.cooldown_until = max(self.cooldown_until, now + seconds)
+
+    def cooldown_remaining(self, now: float | None = None) -> float:
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.cooldown_until - now)
@@ -0,0 +1,222 @@
+"""Кэш истории диалогов в памяти с отложенной записью в БД.
+
+История пользователя загружается из БД при первом обращении и дальше отдаётся
+из ограниченного deque без SELECT и json.loads. Новые сообщения сразу попадают
+в deque, а в БД пишутся фоновой задачей по порядку. Пока у пользователя есть
+незаписанные сообщения, его запись не вытесняется, иначе повторная загрузка
+из БД потеряла бы их.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime
+
+from app import metrics
+from config import CONTEXT_MAX_TURNS, HISTORY_CACHE_ENABLED, HISTORY_CACHE_MAX_BYTES
+from database.crud import extend_history
+from database.session import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Накладные расходы на dict сообщения и deque сверх самой строки
+MESSAGE_OVERHEAD_BYTES = 250
+
+
+def message_size(message: dict) -> int:
+    return sys.getsizeof(message["content"]) + MESSAGE_OVERHEAD_BYTES
+
+
+@dataclass
+class CachedHistory:
+    messages: deque
+    size: int = 0
+    last_used: float = 0.0
+    pending: int = 0  # сообщений в очереди на запись
+
+
+@dataclass
+class PendingWrite:
+    key: tuple[str, int]
+    user_id: int
+    message: dict
+    last_activity: datetime | None
+
+
+@dataclass
+class HistoryCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evicted: int = 0
+    write_errors: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class HistoryCache:
+    def __init__(self, max_bytes: int = HISTORY_CACHE_MAX_BYTES, max_messages: int = CONTEXT_MAX_TURNS * 2):
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self._entries: OrderedDict[tuple[str, int], CachedHistory] = OrderedDict()
+        self.total_bytes = 0
+        self.stats = HistoryCacheStats()
+        self._queue: asyncio.Queue | None = None
+        self.task = None
+
+    @property
+    def enabled(self) -> bool:
+        """Кэш работает только при запущенной фоновой записи"""
+        return self.task is not None
+
+    def get(self, key: tuple[str, int]) -> list[dict] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(key)
+        return list(entry.messages)
+
+    def load(self, key: tuple[str, int], history: list[dict]):
+        """Положить в кэш историю, прочитанную из БД"""
+        if key in self._entries:
+            return
+        messages = deque(history[-self.max_messages:], maxlen=self.max_messages)
+        entry = CachedHistory(
+            messages=messages,
+            size=sum(message_size(message) for message in messages),
+            last_used=time.monotonic(),
+        )
+        self._entries[key] = entry
+        self.total_bytes += entry.size
+        self._enforce_limit()
+
+    def append(self, key: tuple[str, int], user_id: int, role: str, content: str, last_activity: datetime | None):
+        """Дописать сообщение в кэш и поставить его в очередь на запись; None - пользователя нет в кэше"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        message = {"role": role, "content": content}
+        delta = message_size(message)
+        if len(entry.messages) == entry.messages.maxlen:
+            delta -= message_size(entry.messages[0])
+        entry.messages.append(message)
+        entry.size += delta
+        self.total_bytes += delta
+        entry.last_used = time.monotonic()
+        entry.pending += 1
+        self._entries.move_to_end(key)
+
+        self._queue.put_nowait(PendingWrite(key, user_id, message, last_activity))
+        self._enforce_limit()
+        return list(entry.messages)
+
+    def has_pending(self, key: tuple[str, int]) -> bool:
+        """Есть ли у пользователя сообщения, ещё не записанные в БД"""
+        entry = self._entries.get(key)
+        return entry is not None and entry.pending > 0
+
+    def invalidate(self, key: tuple[str, int]):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def evict_idle(self, max_idle: float) -> int:
+        """Вытеснить пользователей, к которым не обращались дольше max_idle секунд"""
+        now = time.monotonic()
+        idle = [
+            key for key, entry in self._entries.items()
+            if now - entry.last_used > max_idle and not entry.pending
+        ]
+        for key in idle:
+            self.invalidate(key)
+        self.stats.evicted += len(idle)
+        return len(idle)
+
+    def _enforce_limit(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self._entries[key].pending:
+                continue
+            self.invalidate(key)
+            self.stats.evicted += 1
+
+    async def drain(self):
+        """Дождаться записи всех отложенных сообщений"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def start(self):
+        if HISTORY_CACHE_ENABLED and self.task is None:
+            self._queue = asyncio.Queue()
+            self.task = asyncio.create_task(self._writer_loop())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        await self.drain()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        self._queue = None
+        self._entries.clear()
+        self.total_bytes = 0
+
+    async def _writer_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_batch(self, batch: list[PendingWrite]):
+        # Порядок сообщений внутри пользователя сохраняется, пользователи пишутся независимо
+        by_user: dict[tuple[str, int], list[PendingWrite]] = {}
+        for write in batch:
+            by_user.setdefault(write.key, []).append(write)
+
+        for key, writes in by_user.items():
+            activity = [write.last_activity for write in writes if write.last_activity is not None]
+            try:
+                async with AsyncSessionLocal() as session:
+                    await extend_history(
+                        session, writes[0].user_id, [write.message for write in writes],
+                        max(activity) if activity else None,
+                    )
+            except Exception as e:
+                # В БД истории нет - кэш не должен её показывать
+                logger.error("Не удалось записать историю %s: %s", key, e)
+                self.stats.write_errors += 1
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.pending = 0
+                    self.invalidate(key)
+                continue
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.pending = max(0, entry.pending - len(writes))
+
+
+history_cache = HistoryCache()
+metrics.register_gauge("history_cache_bytes", lambda: history_cache.total_bytes)
+metrics.register_gauge("history_cache_hit_rate", lambda: history_cache.stats.hit_rate)
@@ -1,15 +1,77 @@
 import asyncio
 import logging
 import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
 from typing import Any
 
-from openai import APIStatusError, APITimeoutError, AsyncOpenAI, RateLimitError
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, RateLimitError
+
+from app import metrics
+from services.circuit_breaker import CircuitBreaker
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class Completion:
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0  # токены промпта, прочитанные из кэша провайдера
+    elapsed: float = 0.0  # время удачной попытки, секунды
+
+
+def _completion_from_response(response, elapsed: float) -> Completion:
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    # В зависимости от версии SDK детали - модель или просто dict
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", 0)
+    return Completion(
+        text=response.choices[0].message.content or "",
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        cached_tokens=cached or 0,
+        elapsed=elapsed,
+    )
+
+
+class LLMDeadlineExceeded(RuntimeError):
+    """Ответ не укладывается в общий срок запроса"""
+
+
+def retry_after_seconds(exc: Exception) -> float | None:
+    """Пауза, которую просит сервер: Retry-After(-ms) или сброс лимита X-RateLimit-Reset"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+
+    try:
+        if headers.get("retry-after-ms"):
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                # HTTP-дата
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+
+        reset = headers.get("x-ratelimit-reset")
+        if reset:
+            # OpenRouter отдаёт время сброса в миллисекундах от эпохи
+            reset = float(reset)
+            reset_at = reset / 1000 if reset > 1e11 else reset
+            return max(0.0, reset_at - time.time())
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
 class LLMService:
-    """Слой для запросов к LLM с повторными попытками."""
+    """Слой для запросов к LLM: ограничение параллельности, повторы по подсказкам
+    сервера, автомат защиты на модель и общий срок запроса."""
 
     def __init__(
         self,
@@ -17,49 +79,150 @@ class LLMService:
         max_retries: int = 3,
         base_backoff: float = 1.0,
         max_backoff: float = 10.0,
+        max_concurrency: int = 8,
+        deadline: float = 45.0,
+        breaker_failures: int = 5,
+        breaker_recovery: float = 30.0,
     ) -> None:
         self.client = client
         self.max_retries = max_retries
         self.base_backoff = base_backoff
         self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.breaker_failures = breaker_failures
+        self.breaker_recovery = breaker_recovery
+        # Допуск запросов: не больше max_concurrency одновременно, остальные ждут
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        # Автоматы общие для всех запросов к модели
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+    def breaker_for(self, model: str) -> CircuitBreaker:
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            breaker = self.breakers[model] = CircuitBreaker(model, self.breaker_failures, self.breaker_recovery)
+        return breaker
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded("Истёк срок запроса к OpenRouter")
+        return remaining
 
     async def generate_chat_completion(self, **kwargs: Any) -> str:
+        return (await self.complete(**kwargs)).text
+
+    async def complete(self, **kwargs: Any) -> Completion:
+        """Ответ вместе с расходом токенов из поля usage"""
+        deadline = time.monotonic() + self.deadline
+        breaker = self.breaker_for(kwargs.get("model", ""))
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self._remaining(deadline))
+        except asyncio.TimeoutError:
+            raise LLMDeadlineExceeded("Истёк срок запроса к OpenRouter в очереди")
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        try:
+            return await self._generate_with_retries(breaker, deadline, **kwargs)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def _generate_with_retries(self, breaker: CircuitBreaker, deadline: float, **kwargs: Any) -> Completion:
         attempt = 0
+        first_started = time.monotonic()
 
-        while True:
-            attempt += 1
-            try:
-                logger.info("Отправка запроса к OpenRouter (попытка %s)", attempt)
-                response = await self.client.chat.completions.create(**kwargs)
-                logger.info("Ответ от OpenRouter получен (попытка %s)", attempt)
-                return response.choices[0].message.content or ""
-
-            except (RateLimitError, APITimeoutError) as exc:
-                logger.warning(
-                    "Ошибка OpenRouter (%s) на попытке %s: %s", exc.__class__.__name__, attempt, exc
-                )
-
-            except APIStatusError as exc:
-                if 500 <= exc.status_code < 600:
+        try:
+            while True:
+                attempt += 1
+
+                # Общая пауза по Retry-After от предыдущих ответов
+                cooldown = breaker.cooldown_remaining()
+                if cooldown:
+                    if cooldown >= self._remaining(deadline):
+                        raise LLMDeadlineExceeded(f"OpenRouter просит подождать {cooldown:.1f}с, срок истечёт раньше")
+                    await asyncio.sleep(cooldown)
+
+                breaker.before_request()
+                started = time.monotonic()
+                hint = None
+                try:
+                    logger.info("Отправка запроса к OpenRouter (попытка %s)", attempt)
+                    response = await asyncio.wait_for(
+                        self.client.chat.completions.create(**kwargs), self._remaining(deadline)
+                    )
+                    elapsed = time.monotonic() - started
+                    breaker.record_success()
+                    metrics.observe("openrouter_time", elapsed)
+                    logger.info("Ответ от OpenRouter получен (попытка %s)", attempt)
+                    return _completion_from_response(response, elapsed)
+
+                except asyncio.TimeoutError:
+                    breaker.record_failure()
+                    raise LLMDeadlineExceeded("Истёк срок запроса к OpenRouter")
+
+                except RateLimitError as exc:
+                    # Провайдер жив, просто просит сбавить темп - это не сбой для автомата
+                    breaker.release_probe()
+                    hint = retry_after_seconds(exc)
+                    if hint is not None:
+                        breaker.set_cooldown(hint)
+                    logger.warning("429 от OpenRouter на попытке %s, Retry-After: %s", attempt, hint)
+
+                except APIConnectionError as exc:
+                    breaker.record_failure()
                     logger.warning(
-                        "5xx ошибка OpenRouter на попытке %s: %s", attempt, exc.status_code
+                        "Ошибка OpenRouter (%s) на попытке %s: %s", exc.__class__.__name__, attempt, exc
                     )
-                else:
-                    logger.exception("Неретрайбл ошибка OpenRouter: %s", exc)
+
+                except APIStatusError as exc:
+                    if 500 <= exc.status_code < 600:
+                        breaker.record_failure()
+                        hint = retry_after_seconds(exc)
+                        logger.warning(
+                            "5xx ошибка OpenRouter на попытке %s: %s", attempt, exc.status_code
+                        )
+                    else:
+                        breaker.release_probe()
+                        logger.exception("Неретрайбл ошибка OpenRouter: %s", exc)
+                        raise
+
+                except asyncio.CancelledError:
+                    breaker.release_probe()
+                    raise
+
+                except Exception:
+                    breaker.release_probe()
+                    logger.exception("Неожиданная ошибка при обращении к OpenRouter")
                     raise
 
-            except Exception:
-                logger.exception("Неожиданная ошибка при обращении к OpenRouter")
-                raise
+                if attempt > self.max_retries:
+                    raise RuntimeError("Превышено количество попыток запроса к OpenRouter")
+
+                if hint is not None:
+                    sleep_for = hint
+                else:
+                    delay = min(self.base_backoff * (2 ** (attempt - 1)), self.max_backoff)
+                    sleep_for = delay + random.uniform(0, delay / 2)
 
-            if attempt > self.max_retries:
-                raise RuntimeError("Превышено количество попыток запроса к OpenRouter")
+                if sleep_for >= self._remaining(deadline):
+                    raise LLMDeadlineExceeded(
+                        f"Повтор через {sleep_for:.1f}с не укладывается в срок запроса к OpenRouter"
+                    )
 
-            delay = min(self.base_backoff * (2 ** (attempt - 1)), self.max_backoff)
-            jitter = random.uniform(0, delay / 2)
-            sleep_for = delay + jitter
-            logger.info("Повторная попытка через %.2f секунд", sleep_for)
-            await asyncio.sleep(sleep_for)
+                metrics.increment("llm_retries")
+                metrics.observe("llm_retry_wait", sleep_for)
+                logger.info("Повторная попытка через %.2f секунд", sleep_for)
+                await asyncio.sleep(sleep_for)
+        finally:
+            if attempt > 1:
+                metrics.observe("llm_retry_time", time.monotonic() - first_started)
 
     async def close(self) -> None:
         await self.client.aclose()
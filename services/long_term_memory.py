@@ -0,0 +1,295 @@
+"""Долгая память диалогов: архив всех сообщений и поиск похожих реплик.
+
+История в промпте - скользящее окно CONTEXT_MAX_TURNS * 2 сообщений, всё
+старее забывается. Поэтому каждое сообщение ещё и дописывается в таблицу
+message_archive (отложенной записью, пачками), а по архиву собеседника
+строится индекс в памяти.
+
+Векторы - хэширующий векторизатор (основы слов от трёх букв и символьные триграммы
+в MEMORY_DIM корзин со знаком, сублинейный tf, L2-нормировка): без моделей и
+GPU, одинаковый во всех процессах. Векторы собеседника лежат одним
+непрерывным массивом float32, поиск - одно умножение матрицы на вектор
+запроса и argpartition, на 100 тысячах сообщений это единицы миллисекунд.
+
+Индекс собеседника догружается из архива по id при каждом поиске, поэтому
+видит и сообщения, записанные другими процессами. Ещё не записанные
+сообщения всё равно есть в окне истории.
+
+Архив читают и гистограммы активности (services.activity), поэтому при
+MEMORY_ENABLED=0 и ACTIVITY_ENABLED=1 он продолжает писаться, выключается
+только поиск.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from app import metrics
+from app.time_utils import to_timestamp, utc_now
+from config import (
+    ACTIVITY_ENABLED,
+    MEMORY_DIM,
+    MEMORY_ENABLED,
+    MEMORY_FLUSH_INTERVAL,
+    MEMORY_MAX_BYTES,
+    MEMORY_MIN_CHARS,
+    MEMORY_MIN_SCORE,
+    MEMORY_SNIPPET_CHARS,
+    MEMORY_TOP_K,
+)
+from database.crud import archive_messages, get_archived_messages
+from database.session import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r"\w{3,}")
+# Частые служебные слова дают ложное сходство между любыми репликами
+STOP_WORDS = frozenset(
+    "как так там тут кто что это эта этот эти все всё уже еще ещё когда где куда тоже только было была были "
+    "будет есть нет мне меня тебя тебе ему его она они оно мой моя твой твоя свой наш ваш для или над под при "
+    "про без чем чтобы потому если даже очень вот ладно снова опять какая какой какие".split()
+)
+STEM_CHARS = 5
+
+# Столько сообщений векторизуем прямо в loop, больше - в потоке
+INLINE_VECTORIZE_LIMIT = 64
+
+
+def _features(text: str):
+    for word in _WORD.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        # Грубая основа слова: "рыбалку" и "рыбалка" совпадут
+        yield word[:STEM_CHARS]
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3]
+
+
+def vectorize(texts: list[str], dim: int = MEMORY_DIM) -> np.ndarray:
+    """Матрица (len(texts), dim) float32 с единичными строками (пустой текст - нулевая строка)"""
+    rows, columns, signs = [], [], []
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            hashed = zlib.crc32(feature.encode("utf-8"))
+            rows.append(row)
+            columns.append(hashed % dim)
+            signs.append(1.0 if hashed & 0x80000000 else -1.0)
+
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    if rows:
+        np.add.at(matrix, (np.array(rows), np.array(columns)), np.array(signs, dtype=np.float32))
+    matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+class MemoryIndex:
+    """Векторы и тексты архива одного собеседника"""
+
+    def __init__(self, dim: int):
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.size = 0
+        self.entries: list[tuple[str, str, float]] = []  # (role, content, timestamp)
+        self.text_bytes = 0
+        self.last_id = 0
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.text_bytes
+
+    def add(self, vectors: np.ndarray, entries: list[tuple[str, str, float]]):
+        needed = self.size + len(entries)
+        if needed > len(self.vectors):
+            # Рост с запасом, чтобы массив оставался непрерывным без копий на каждое сообщение
+            grown = np.empty((max(needed, len(self.vectors) * 2, 64), self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        self.vectors[self.size:needed] = vectors
+        self.size = needed
+        self.entries.extend(entries)
+        self.text_bytes += sum(len(content) for _, content, _ in entries)
+
+    def search(self, query: np.ndarray, k: int, min_score: float, exclude: set[str]) -> list[tuple[float, tuple]]:
+        if not self.size or k <= 0:
+            return []
+        scores = self.vectors[:self.size] @ query
+        # Запас на исключённые (сообщения из окна истории)
+        take = min(self.size, k + len(exclude))
+        top = np.argpartition(scores, self.size - take)[self.size - take:]
+        top = top[np.argsort(-scores[top])]
+
+        found = []
+        for position in top:
+            score = float(scores[position])
+            if score < min_score:
+                break
+            entry = self.entries[position]
+            if entry[1] in exclude:
+                continue
+            found.append((score, entry))
+            if len(found) == k:
+                break
+        return found
+
+
+def format_snippet(entry: tuple[str, str, float], max_chars: int = MEMORY_SNIPPET_CHARS) -> str:
+    role, content, timestamp = entry
+    if len(content) > max_chars:
+        content = content[:max_chars].rstrip() + "…"
+    author = "собеседник" if role == "user" else "ты"
+    day = datetime.fromtimestamp(timestamp).strftime("%d.%m.%Y")
+    return f"{day}, {author}: {content}"
+
+
+class LongTermMemory:
+    def __init__(
+        self,
+        dim: int = MEMORY_DIM,
+        max_bytes: int = MEMORY_MAX_BYTES,
+        flush_interval: float = MEMORY_FLUSH_INTERVAL,
+    ):
+        self.dim = dim
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._indexes: OrderedDict[tuple[str, int], MemoryIndex] = OrderedDict()
+        self._pending: list[dict] = []
+        self._flush_lock = asyncio.Lock()
+        self.task = None
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(index.nbytes for index in self._indexes.values())
+
+    @property
+    def indexed_messages(self) -> int:
+        return sum(index.size for index in self._indexes.values())
+
+    def record(self, account_id: str, tg_id: int, role: str, content: str):
+        """Поставить сообщение в очередь на запись в архив"""
+        if self.task is None or not content:
+            return
+        self._pending.append({
+            "account_id": account_id, "tg_id": tg_id, "role": role,
+            "content": content, "created_at": utc_now(),
+        })
+
+    async def flush(self):
+        async with self._flush_lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return
+            try:
+                async with AsyncSessionLocal() as session:
+                    await archive_messages(session, rows)
+            except Exception as e:
+                logger.error("Не удалось записать %s сообщений в архив: %s", len(rows), e)
+                self._pending[:0] = rows
+
+    async def search(self, account_id: str, tg_id: int, text: str, history: list[dict]) -> list[str]:
+        """До MEMORY_TOP_K реплик из архива, похожих на text и не входящих в окно истории"""
+        if not MEMORY_ENABLED or self.task is None or not text.strip():
+            return []
+
+        started = time.perf_counter()
+        key = (account_id, tg_id)
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._indexes[key] = MemoryIndex(self.dim)
+        self._indexes.move_to_end(key)
+        index.last_used = time.monotonic()
+
+        async with index.lock:
+            await self._catch_up(key, index)
+            exclude = {message["content"] for message in history}
+            exclude.add(text)
+            found = index.search(vectorize([text], self.dim)[0], MEMORY_TOP_K, MEMORY_MIN_SCORE, exclude)
+
+        self._enforce_limit()
+        metrics.observe("memory_search_time", time.perf_counter() - started)
+        if found:
+            logger.info("Долгая память %s: %s реплик (сходство до %.2f)", tg_id, len(found), found[0][0])
+        # Старые реплики - раньше, как в диалоге
+        return [format_snippet(entry) for _, entry in sorted(found, key=lambda item: item[1][2])]
+
+    async def _catch_up(self, key: tuple[str, int], index: MemoryIndex):
+        async with AsyncSessionLocal() as session:
+            rows = await get_archived_messages(session, key[0], key[1], index.last_id)
+        if not rows:
+            return
+
+        index.last_id = rows[-1][0]
+        # Короткие реплики ("ок", "ага") в поиске бесполезны
+        rows = [row for row in rows if len(row[2]) >= MEMORY_MIN_CHARS]
+        if not rows:
+            return
+        texts = [content for _, _, content, _ in rows]
+        if len(texts) > INLINE_VECTORIZE_LIMIT:
+            vectors = await asyncio.to_thread(vectorize, texts, self.dim)
+        else:
+            vectors = vectorize(texts, self.dim)
+        index.add(vectors, [(role, content, to_timestamp(created_at)) for _, role, content, created_at in rows])
+
+    def forget(self, account_id: str, tg_id: int):
+        """Убрать индекс собеседника (после очистки истории)"""
+        self._pending = [
+            row for row in self._pending if (row["account_id"], row["tg_id"]) != (account_id, tg_id)
+        ]
+        self._indexes.pop((account_id, tg_id), None)
+
+    def evict_idle(self, max_idle: float) -> int:
+        now = time.monotonic()
+        idle = [
+            key for key, index in self._indexes.items()
+            if now - index.last_used > max_idle and not index.lock.locked()
+        ]
+        for key in idle:
+            del self._indexes[key]
+        return len(idle)
+
+    def _enforce_limit(self):
+        total = self.total_bytes
+        for key in list(self._indexes):
+            if total <= self.max_bytes:
+                break
+            index = self._indexes[key]
+            if index.lock.locked():
+                continue
+            total -= index.nbytes
+            del self._indexes[key]
+
+    def start(self):
+        if (MEMORY_ENABLED or ACTIVITY_ENABLED) and self.task is None:
+            self.task = asyncio.create_task(self._main_loop())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        await self.flush()
+        self._indexes.clear()
+
+    async def _main_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+long_term_memory = LongTermMemory()
+metrics.register_gauge("memory_index_bytes", lambda: long_term_memory.total_bytes)
+metrics.register_gauge("memory_indexed_messages", lambda: long_term_memory.indexed_messages)
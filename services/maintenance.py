@@ -0,0 +1,244 @@
+"""Обслуживание SQLite: хранение, архивация неактивных, VACUUM и ANALYZE.
+
+Раз в сутки вне WORKING_HOURS по шагам:
+- из message_archive и usage_daily удаляется всё старше сроков хранения;
+- пользователи, молчащие дольше MAINTENANCE_INACTIVE_DAYS, архивируются:
+  им не шлются ледоколы, а окно истории очищается (сообщения остаются в
+  архиве и доступны долгой памяти); новое сообщение снимает отметку;
+- свободные страницы возвращаются файловой системе через incremental_vacuum;
+- ANALYZE по выборке строк обновляет статистику планировщика.
+
+Каждый шаг - отдельная короткая транзакция (MAINTENANCE_BATCH_SIZE строк или
+MAINTENANCE_VACUUM_PAGES страниц) с паузой после неё, так что запись
+диалогов ждёт блокировку не дольше одного шага. Если начались рабочие часы,
+прогон прерывается и продолжается следующей ночью.
+
+incremental_vacuum работает только в режиме auto_vacuum=INCREMENTAL. Новая
+БД создаётся в нём сразу (database.migrations), а старую переводит команда
+.vacuum одним полным VACUUM: он переписывает весь файл и блокирует запись,
+поэтому ночной прогон его не запускает, а только пропускает шаг VACUUM.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+
+from app import metrics
+from app.time_utils import is_working_hours, utc_now
+from config import (
+    MAINTENANCE_ANALYSIS_LIMIT,
+    MAINTENANCE_ARCHIVE_RETENTION_DAYS,
+    MAINTENANCE_BATCH_SIZE,
+    MAINTENANCE_CHECK_INTERVAL,
+    MAINTENANCE_ENABLED,
+    MAINTENANCE_INACTIVE_DAYS,
+    MAINTENANCE_STEP_PAUSE,
+    MAINTENANCE_USAGE_RETENTION_DAYS,
+    MAINTENANCE_VACUUM_PAGES,
+)
+from database.crud import archive_inactive_users, delete_archived_before, delete_usage_before
+from database.models import Base
+from database.session import AsyncSessionLocal, engine
+from services.history_cache import history_cache
+
+logger = logging.getLogger(__name__)
+
+# Прогоны не чаще: ночь вне WORKING_HOURS короче суток, повторного прогона в ту же ночь не будет
+MIN_RUN_GAP = 20 * 3600
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class MaintenanceInterrupted(Exception):
+    """Начались рабочие часы"""
+
+
+class DatabaseMaintenance:
+    def __init__(
+        self,
+        interval: float = MAINTENANCE_CHECK_INTERVAL,
+        batch_size: int = MAINTENANCE_BATCH_SIZE,
+        vacuum_pages: int = MAINTENANCE_VACUUM_PAGES,
+        step_pause: float = MAINTENANCE_STEP_PAUSE,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.step_pause = step_pause
+        self.last_run: float | None = None  # time.monotonic() завершённого прогона
+        self.last_report: dict | None = None
+        self.running = False
+        self.task = None
+        self._vacuum_warned = False
+
+    async def _step_done(self, force: bool):
+        await asyncio.sleep(self.step_pause)
+        if not force and is_working_hours():
+            raise MaintenanceInterrupted
+
+    async def run(self, force: bool = False) -> dict:
+        """Один прогон; force - не прерываться в рабочие часы. Возвращает отчёт"""
+        if self.running:
+            raise RuntimeError("Обслуживание БД уже выполняется")
+        self.running = True
+        started = time.monotonic()
+        report = {
+            "archive_deleted": 0, "usage_deleted": 0, "users_archived": 0,
+            "pages_vacuumed": 0, "interrupted": False,
+        }
+        try:
+            size_before = await self._database_size()
+            await self._apply_retention(report, force)
+            await self._archive_inactive(report, force)
+            await self._vacuum(report, force)
+            await self._analyze(force)
+        except MaintenanceInterrupted:
+            report["interrupted"] = True
+        finally:
+            self.running = False
+
+        report["bytes_reclaimed"] = size_before - await self._database_size()
+        report["duration"] = time.monotonic() - started
+        self.last_report = report
+        if not report["interrupted"]:
+            self.last_run = time.monotonic()
+
+        metrics.observe("maintenance_duration", report["duration"])
+        metrics.increment("maintenance_bytes_reclaimed", max(report["bytes_reclaimed"], 0))
+        logger.info(
+            "Обслуживание БД%s за %.1fс: освобождено %.1f МБ, удалено из архива %s, из расхода %s, "
+            "архивировано пользователей %s, страниц VACUUM %s",
+            " прервано" if report["interrupted"] else "", report["duration"],
+            report["bytes_reclaimed"] / 1024 / 1024, report["archive_deleted"], report["usage_deleted"],
+            report["users_archived"], report["pages_vacuumed"],
+        )
+        return report
+
+    async def _apply_retention(self, report: dict, force: bool):
+        if MAINTENANCE_ARCHIVE_RETENTION_DAYS:
+            before = utc_now() - timedelta(days=MAINTENANCE_ARCHIVE_RETENTION_DAYS)
+            while True:
+                async with AsyncSessionLocal() as session:
+                    deleted = await delete_archived_before(session, before, self.batch_size)
+                report["archive_deleted"] += deleted
+                await self._step_done(force)
+                if deleted < self.batch_size:
+                    break
+
+        if MAINTENANCE_USAGE_RETENTION_DAYS:
+            before_day = (date.today() - timedelta(days=MAINTENANCE_USAGE_RETENTION_DAYS)).isoformat()
+            while True:
+                async with AsyncSessionLocal() as session:
+                    deleted = await delete_usage_before(session, before_day, self.batch_size)
+                report["usage_deleted"] += deleted
+                await self._step_done(force)
+                if deleted < self.batch_size:
+                    break
+
+    async def _archive_inactive(self, report: dict, force: bool):
+        if not MAINTENANCE_INACTIVE_DAYS:
+            return
+        before = utc_now() - timedelta(days=MAINTENANCE_INACTIVE_DAYS)
+        while True:
+            # Отложенная запись истории не должна лечь в окно уже после его очистки
+            await history_cache.drain()
+            async with AsyncSessionLocal() as session:
+                archived = await archive_inactive_users(session, before, self.batch_size)
+            await history_cache.drain()
+            for key in archived:
+                history_cache.invalidate(key)
+            report["users_archived"] += len(archived)
+            await self._step_done(force)
+            if len(archived) < self.batch_size:
+                break
+
+    async def _pragma(self, conn, name: str) -> int:
+        return (await conn.exec_driver_sql(f"PRAGMA {name}")).scalar() or 0
+
+    async def _database_size(self) -> int:
+        async with engine.connect() as conn:
+            return await self._pragma(conn, "page_count") * await self._pragma(conn, "page_size")
+
+    async def convert_to_incremental(self) -> int | None:
+        """Разово перевести БД в auto_vacuum=INCREMENTAL полным VACUUM.
+
+        Возвращает освобождённые байты; None - БД уже в этом режиме.
+        """
+        if self.running:
+            raise RuntimeError("Обслуживание БД уже выполняется")
+        self.running = True
+        try:
+            size_before = await self._database_size()
+            async with engine.connect() as conn:
+                # VACUUM не работает внутри транзакции
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                if await self._pragma(conn, "auto_vacuum") == AUTO_VACUUM_INCREMENTAL:
+                    return None
+                logger.warning("Перевожу БД в auto_vacuum=INCREMENTAL: полный VACUUM")
+                started = time.monotonic()
+                await conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                await conn.exec_driver_sql("VACUUM")
+            reclaimed = size_before - await self._database_size()
+            logger.info(
+                "БД переведена в auto_vacuum=INCREMENTAL за %.1fс, освобождено %.1f МБ",
+                time.monotonic() - started, reclaimed / 1024 / 1024,
+            )
+            return reclaimed
+        finally:
+            self.running = False
+
+    async def _vacuum(self, report: dict, force: bool):
+        async with engine.connect() as conn:
+            # incremental_vacuum не работает внутри транзакции
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if await self._pragma(conn, "auto_vacuum") != AUTO_VACUUM_INCREMENTAL:
+                if not self._vacuum_warned:
+                    logger.warning("БД не в режиме auto_vacuum=INCREMENTAL, шаг VACUUM пропущен: выполните .vacuum")
+                    self._vacuum_warned = True
+                return
+
+            free_pages = await self._pragma(conn, "freelist_count")
+            while free_pages:
+                await conn.exec_driver_sql(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+                left = await self._pragma(conn, "freelist_count")
+                report["pages_vacuumed"] += free_pages - left
+                free_pages = left
+                await self._step_done(force)
+
+    async def _analyze(self, force: bool):
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.exec_driver_sql(f"PRAGMA analysis_limit = {MAINTENANCE_ANALYSIS_LIMIT}")
+            for table in Base.metadata.sorted_tables:
+                await conn.exec_driver_sql(f'ANALYZE "{table.name}"')
+                await self._step_done(force)
+
+    def start(self):
+        if MAINTENANCE_ENABLED and self.task is None:
+            self.task = asyncio.create_task(self._main_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    async def _main_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if is_working_hours():
+                continue
+            if self.last_run is not None and time.monotonic() - self.last_run < MIN_RUN_GAP:
+                continue
+            try:
+                await self.run()
+            except Exception as e:
+                logger.error("Ошибка обслуживания БД: %s", e)
+
+
+db_maintenance = DatabaseMaintenance()
+metrics.register_gauge("maintenance_last", lambda: db_maintenance.last_report)
@@ -3,24 +3,47 @@ from __future__ import annotations
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.time_utils import to_timestamp
+from app.time_utils import to_timestamp, utc_now
 from database.crud import append_history, clear_history, get_history
 from database.models import User
+from services.history_cache import history_cache
+from services.long_term_memory import long_term_memory
 
 
 class MessageHistory:
     """Обертка для работы с историей диалога пользователя."""
 
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, account_id: str):
         self.session = session
+        self.account_id = account_id
 
     async def fetch(self, user: User) -> list[dict]:
-        """Получить историю сообщений."""
-        return await get_history(self.session, user)
+        """Получить историю сообщений (из кэша, если он включён)."""
+        if not history_cache.enabled:
+            return await get_history(self.session, user)
+
+        key = (self.account_id, user.tg_id)
+        history = history_cache.get(key)
+        if history is None:
+            history = await get_history(self.session, user)
+            history_cache.load(key, history)
+        return history
 
     async def append(self, user: User, role: str, content: str) -> list[dict]:
         """Добавить произвольное сообщение в историю."""
-        return await append_history(self.session, user, role, content)
+        long_term_memory.record(self.account_id, user.tg_id, role, content)
+        if history_cache.enabled:
+            last_activity = utc_now() if role == "user" else None
+            history = history_cache.append(
+                (self.account_id, user.tg_id), user.id, role, content, last_activity
+            )
+            if history is not None:
+                return history
+
+        history = await append_history(self.session, user, role, content)
+        if history_cache.enabled:
+            history_cache.load((self.account_id, user.tg_id), history)
+        return history
 
     async def append_user_message(self, user: User, content: str) -> list[dict]:
         return await self.append(user, "user", content)
@@ -30,7 +53,15 @@ class MessageHistory:
 
     async def clear(self, tg_id: int) -> bool:
         """Очистить историю пользователя."""
-        return await clear_history(self.session, tg_id)
+        key = (self.account_id, tg_id)
+        history_cache.invalidate(key)
+        # Отложенные сообщения не должны вернуть историю после очистки
+        await history_cache.drain()
+        history_cache.invalidate(key)
+        # Иначе отложенные сообщения попадут в архив уже после удаления
+        long_term_memory.forget(self.account_id, tg_id)
+        await long_term_memory.flush()
+        return await clear_history(self.session, self.account_id, tg_id)
 
     async def last_message(self, user: User) -> dict | None:
         """Вернуть последнее сообщение из истории."""
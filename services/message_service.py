@@ -7,9 +7,9 @@ from services.message_history import MessageHistory
 class MessageService:
     """Сервис для работы с сообщениями пользователей."""
 
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, account_id: str):
         self.session = session
-        self.history = MessageHistory(session)
+        self.history = MessageHistory(session, account_id)
 
     async def get_history(self, user: User) -> list[dict]:
         return await self.history.fetch(user)
@@ -0,0 +1,174 @@
+"""Учёт расхода токенов и бюджеты с переходом на дешёвую модель.
+
+Каждый ответ LLM складывается в агрегат (аккаунт, собеседник, режим, тип,
+модель, день) в памяти; раз в USAGE_FLUSH_INTERVAL агрегаты одной пачкой
+прибавляются к таблице usage_daily. После записи дневные суммы перечитываются
+из БД, поэтому бюджеты учитывают и расход воркеров очереди.
+
+Бюджеты (токены промпта и ответа за день): на собеседника, на все
+проактивные сообщения и общий. При превышении запрос уходит в
+USAGE_CHEAP_MODEL вместо основной модели.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import date
+
+from config import (
+    MODEL_PRICES,
+    USAGE_CHEAP_MODEL,
+    USAGE_FLUSH_INTERVAL,
+    USAGE_PROACTIVE_DAILY_TOKENS,
+    USAGE_TOTAL_DAILY_TOKENS,
+    USAGE_USER_DAILY_TOKENS,
+)
+from database.crud import USAGE_COUNTERS, add_usage, get_usage_totals
+from database.session import AsyncSessionLocal
+from services.llm_service import Completion
+
+logger = logging.getLogger(__name__)
+
+KIND_REPLY = "reply"
+KIND_PROACTIVE = "proactive"
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Оценка стоимости в USD по MODEL_PRICES (цена за миллион токенов)"""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class UsageTracker:
+    def __init__(self, flush_interval: float = USAGE_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.task = None
+        self._pending: dict[tuple, dict] = {}
+        self._day = date.today().isoformat()
+        # Дневные суммы токенов для бюджетов: из БД плюс ещё не записанное
+        self._user_tokens: dict[tuple[str, int], int] = {}
+        self._proactive_tokens = 0
+        self._total_tokens = 0
+        self._downgraded: set[tuple] = set()
+        self._flush_lock = asyncio.Lock()
+
+    def _rollover(self):
+        today = date.today().isoformat()
+        if today != self._day:
+            self._day = today
+            self._user_tokens.clear()
+            self._proactive_tokens = 0
+            self._total_tokens = 0
+            self._downgraded.clear()
+
+    def record(self, account_id: str, tg_id: int | None, mode: str, kind: str, model: str, completion: Completion):
+        self._rollover()
+        tokens = completion.prompt_tokens + completion.completion_tokens
+        key = (account_id, tg_id or 0, mode, kind, model, self._day)
+        row = self._pending.get(key)
+        if row is None:
+            row = self._pending[key] = dict.fromkeys(USAGE_COUNTERS, 0)
+        row["requests"] += 1
+        row["prompt_tokens"] += completion.prompt_tokens
+        row["completion_tokens"] += completion.completion_tokens
+        row["cached_tokens"] += completion.cached_tokens
+        row["latency_total"] += completion.elapsed
+        row["cost"] += estimate_cost(model, completion.prompt_tokens, completion.completion_tokens)
+
+        user_key = (account_id, tg_id or 0)
+        self._user_tokens[user_key] = self._user_tokens.get(user_key, 0) + tokens
+        if kind == KIND_PROACTIVE:
+            self._proactive_tokens += tokens
+        self._total_tokens += tokens
+
+    def select_model(self, account_id: str | None, tg_id: int | None, kind: str, default: str) -> str:
+        """Основная модель или дешёвая, если бюджет на сегодня исчерпан"""
+        self._rollover()
+        reason = None
+        if USAGE_TOTAL_DAILY_TOKENS and self._total_tokens >= USAGE_TOTAL_DAILY_TOKENS:
+            reason = "общий бюджет"
+        elif kind == KIND_PROACTIVE and USAGE_PROACTIVE_DAILY_TOKENS and self._proactive_tokens >= USAGE_PROACTIVE_DAILY_TOKENS:
+            reason = "бюджет проактивных сообщений"
+        elif (
+            USAGE_USER_DAILY_TOKENS and account_id is not None
+            and self._user_tokens.get((account_id, tg_id or 0), 0) >= USAGE_USER_DAILY_TOKENS
+        ):
+            reason = f"бюджет собеседника {tg_id}"
+
+        if reason is None:
+            return default
+
+        # Один раз в день на каждую причину
+        if (reason, kind) not in self._downgraded:
+            self._downgraded.add((reason, kind))
+            logger.warning("Исчерпан %s на сегодня, %s -> %s", reason, default, USAGE_CHEAP_MODEL)
+        return USAGE_CHEAP_MODEL
+
+    async def flush(self):
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            rows = [
+                {
+                    "account_id": account_id, "tg_id": tg_id, "mode": mode,
+                    "kind": kind, "model": model, "day": day, **counters,
+                }
+                for (account_id, tg_id, mode, kind, model, day), counters in pending.items()
+            ]
+            try:
+                async with AsyncSessionLocal() as session:
+                    await add_usage(session, rows)
+                    await self._reload_today(session)
+            except Exception as e:
+                logger.error("Не удалось записать расход токенов: %s", e)
+                # Вернуть несохранённое, чтобы не потерять при следующей записи
+                for key, counters in pending.items():
+                    row = self._pending.setdefault(key, dict.fromkeys(USAGE_COUNTERS, 0))
+                    for column, value in counters.items():
+                        row[column] += value
+
+    async def _reload_today(self, session):
+        totals = await get_usage_totals(session, self._day, ("account_id", "tg_id", "kind"))
+        user_tokens: dict[tuple[str, int], int] = {}
+        proactive = total = 0
+        for row in totals:
+            key = (row["account_id"], row["tg_id"])
+            user_tokens[key] = user_tokens.get(key, 0) + row["tokens"]
+            if row["kind"] == KIND_PROACTIVE:
+                proactive += row["tokens"]
+            total += row["tokens"]
+
+        # Расход, записанный в память во время flush
+        for (account_id, tg_id, _, kind, _, day), counters in self._pending.items():
+            if day != self._day:
+                continue
+            tokens = counters["prompt_tokens"] + counters["completion_tokens"]
+            user_tokens[(account_id, tg_id)] = user_tokens.get((account_id, tg_id), 0) + tokens
+            if kind == KIND_PROACTIVE:
+                proactive += tokens
+            total += tokens
+
+        self._user_tokens = user_tokens
+        self._proactive_tokens = proactive
+        self._total_tokens = total
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._main_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    async def _main_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+usage_tracker = UsageTracker()
@@ -2,27 +2,44 @@ from typing import Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.crud import upsert_user, get_user, set_mode, set_active, set_proactive
+from database.crud import (
+    upsert_user,
+    get_user,
+    set_mode,
+    set_active,
+    set_proactive,
+    bulk_upsert_users,
+    bulk_update_users,
+)
 from database.models import User
 
 
 class UserService:
     """Сервис для работы с пользователями."""
 
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, account_id: str):
         self.session = session
+        self.account_id = account_id
 
     async def add_or_update_user(self, tg_id: int, username: Optional[str]) -> User:
-        return await upsert_user(self.session, tg_id, username)
+        return await upsert_user(self.session, self.account_id, tg_id, username)
 
     async def get_user(self, tg_id: int) -> Optional[User]:
-        return await get_user(self.session, tg_id)
+        return await get_user(self.session, self.account_id, tg_id)
 
     async def update_mode(self, tg_id: int, mode: str) -> bool:
-        return await set_mode(self.session, tg_id, mode)
+        return await set_mode(self.session, self.account_id, tg_id, mode)
 
     async def set_active(self, tg_id: int, active: bool) -> bool:
-        return await set_active(self.session, tg_id, active)
+        return await set_active(self.session, self.account_id, tg_id, active)
 
     async def set_proactive(self, tg_id: int, enabled: bool) -> bool:
-        return await set_proactive(self.session, tg_id, enabled)
+        return await set_proactive(self.session, self.account_id, tg_id, enabled)
+
+    async def bulk_add_users(self, rows: list[dict]) -> tuple[int, int]:
+        return await bulk_upsert_users(self.session, self.account_id, rows)
+
+    async def bulk_update(
+        self, values: dict, tg_ids: list[int] | None = None, filters: dict | None = None
+    ) -> tuple[int, list[int]]:
+        return await bulk_update_users(self.session, self.account_id, values, tg_ids, filters)
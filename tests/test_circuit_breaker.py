@@ -0,0 +1,98 @@
+import pytest
+
+from services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker("test-model", failure_threshold=3, recovery_timeout=10.0)
+
+
+def test_opens_at_threshold():
+    breaker = make_breaker()
+    for _ in range(2):
+        breaker.record_failure(now=0.0)
+    assert breaker.state == CLOSED
+    breaker.before_request(now=0.0)
+
+    breaker.record_failure(now=0.0)
+    assert breaker.state == OPEN
+
+
+def test_success_resets_failure_count():
+    breaker = make_breaker()
+    breaker.record_failure(now=0.0)
+    breaker.record_failure(now=0.0)
+    breaker.record_success()
+    breaker.record_failure(now=0.0)
+    assert breaker.state == CLOSED
+
+
+def test_fails_fast_while_open():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure(now=100.0)
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(now=100.0)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(now=109.9)
+    assert breaker.state == OPEN
+
+
+def test_single_half_open_probe():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure(now=0.0)
+
+    breaker.before_request(now=10.0)
+    assert breaker.state == HALF_OPEN
+    # Пока пробный запрос не завершился, остальные получают отказ
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(now=10.0)
+
+
+def test_probe_success_closes():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure(now=0.0)
+    breaker.before_request(now=10.0)
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+    breaker.before_request(now=10.0)
+    breaker.before_request(now=10.0)
+
+
+def test_probe_failure_reopens():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure(now=0.0)
+    breaker.before_request(now=10.0)
+
+    breaker.record_failure(now=10.0)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(now=15.0)
+    breaker.before_request(now=20.0)
+    assert breaker.state == HALF_OPEN
+
+
+def test_released_probe_lets_next_request_through():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure(now=0.0)
+    breaker.before_request(now=10.0)
+
+    breaker.release_probe()
+    breaker.before_request(now=10.0)
+    assert breaker.state == HALF_OPEN
+
+
+def test_cooldown():
+    breaker = make_breaker()
+    breaker.set_cooldown(5.0, now=0.0)
+    # Более короткая подсказка не сокращает паузу
+    breaker.set_cooldown(1.0, now=0.0)
+    assert breaker.cooldown_remaining(now=2.0) == 3.0
+    assert breaker.cooldown_remaining(now=6.0) == 0.0
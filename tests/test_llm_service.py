@@ -0,0 +1,224 @@
+"""LLMService против заглушки OpenRouter на httpx.MockTransport.
+
+Заглушка отдаёт ответы по списку сценария: 429 с подсказками паузы, 5xx,
+зависание дольше срока запроса или обычный ответ.
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+from openai import AsyncOpenAI, BadRequestError, RateLimitError
+
+from services.circuit_breaker import CLOSED, OPEN, CircuitOpenError
+from services.llm_service import LLMDeadlineExceeded, LLMService, retry_after_seconds
+
+MODEL = "test-model"
+
+COMPLETION = {
+    "id": "gen-1",
+    "object": "chat.completion",
+    "created": 0,
+    "model": MODEL,
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "привет"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+}
+
+
+def ok() -> httpx.Response:
+    return httpx.Response(200, json=COMPLETION)
+
+
+def error(status: int, headers: dict | None = None) -> httpx.Response:
+    return httpx.Response(status, headers=headers, json={"error": {"message": "stub", "code": status}})
+
+
+def hang(seconds: float):
+    return ("hang", seconds)
+
+
+class StubOpenRouter:
+    """Отдаёт ответы по порядку; последний повторяется"""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        step = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        if isinstance(step, tuple) and step[0] == "hang":
+            await asyncio.sleep(step[1])
+            return ok()
+        return step
+
+
+def make_service(stub: StubOpenRouter, **kwargs) -> LLMService:
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(stub.handler))
+    client = AsyncOpenAI(base_url="http://openrouter.test/api/v1", api_key="test", http_client=http_client, max_retries=0)
+    options = {"max_retries": 3, "base_backoff": 0.01, "max_backoff": 0.02, "deadline": 2.0,
+               "breaker_failures": 3, "breaker_recovery": 60.0}
+    options.update(kwargs)
+    return LLMService(client, **options)
+
+
+async def complete(service: LLMService):
+    return await service.complete(model=MODEL, messages=[{"role": "user", "content": "привет"}])
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def rate_limit_error(headers: dict) -> RateLimitError:
+    request = httpx.Request("POST", "http://openrouter.test/api/v1/chat/completions")
+    return RateLimitError("429", response=httpx.Response(429, headers=headers, request=request), body=None)
+
+
+def test_retry_after_headers():
+    assert retry_after_seconds(rate_limit_error({"Retry-After": "3"})) == 3.0
+    assert retry_after_seconds(rate_limit_error({"Retry-After-ms": "250"})) == 0.25
+    # Retry-After-ms точнее и важнее Retry-After
+    assert retry_after_seconds(rate_limit_error({"Retry-After-ms": "250", "Retry-After": "3"})) == 0.25
+
+    reset_ms = (time.time() + 5) * 1000
+    assert 4.0 < retry_after_seconds(rate_limit_error({"X-RateLimit-Reset": str(int(reset_ms))})) <= 5.0
+    reset_s = time.time() + 5
+    assert 4.0 < retry_after_seconds(rate_limit_error({"X-RateLimit-Reset": str(int(reset_s) + 1)})) <= 6.0
+
+    assert retry_after_seconds(rate_limit_error({})) is None
+    assert retry_after_seconds(rate_limit_error({"Retry-After": "garbage"})) is None
+
+
+def test_success():
+    stub = StubOpenRouter(ok())
+    completion = run(complete(make_service(stub)))
+    assert completion.text == "привет"
+    assert (completion.prompt_tokens, completion.completion_tokens) == (10, 2)
+    assert stub.calls == 1
+
+
+def test_honours_retry_after_ms():
+    # Без подсказки пауза была бы 5с и не уложилась бы в срок запроса
+    stub = StubOpenRouter(error(429, {"Retry-After-ms": "300"}), ok())
+    service = make_service(stub, base_backoff=5.0, max_backoff=5.0)
+
+    started = time.monotonic()
+    completion = run(complete(service))
+    elapsed = time.monotonic() - started
+
+    assert completion.text == "привет"
+    assert stub.calls == 2
+    assert 0.3 <= elapsed < 1.5
+    # 429 не сбой провайдера: автомат не считает его
+    assert service.breaker_for(MODEL).failures == 0
+
+
+def test_honours_rate_limit_reset():
+    reset_ms = int((time.time() + 0.5) * 1000)
+    stub = StubOpenRouter(error(429, {"X-RateLimit-Reset": str(reset_ms)}), ok())
+    service = make_service(stub, base_backoff=5.0, max_backoff=5.0)
+
+    started = time.monotonic()
+    run(complete(service))
+    assert 0.3 <= time.monotonic() - started < 1.5
+    assert stub.calls == 2
+
+
+def test_retry_after_beyond_deadline_fails_fast():
+    stub = StubOpenRouter(error(429, {"Retry-After": "30"}))
+    service = make_service(stub, deadline=2.0)
+
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        run(complete(service))
+    assert time.monotonic() - started < 1.0
+    assert stub.calls == 1
+
+
+def test_5xx_retried_then_succeeds():
+    stub = StubOpenRouter(error(502), error(503), ok())
+    service = make_service(stub)
+    assert run(complete(service)).text == "привет"
+    assert stub.calls == 3
+    assert service.breaker_for(MODEL).state == CLOSED
+    assert service.breaker_for(MODEL).failures == 0
+
+
+def test_5xx_opens_breaker_and_fails_fast():
+    stub = StubOpenRouter(error(500))
+    service = make_service(stub, max_retries=5, breaker_failures=3)
+
+    with pytest.raises(CircuitOpenError):
+        run(complete(service))
+    # Четвёртая попытка отбита автоматом, до провайдера не дошла
+    assert stub.calls == 3
+    assert service.breaker_for(MODEL).state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        run(complete(service))
+    assert stub.calls == 3
+
+
+def test_half_open_probe_closes_on_success():
+    stub = StubOpenRouter(error(500), error(500), error(500), ok())
+    service = make_service(stub, max_retries=5, breaker_failures=3, breaker_recovery=0.2)
+    with pytest.raises(CircuitOpenError):
+        run(complete(service))
+
+    time.sleep(0.25)
+    assert run(complete(service)).text == "привет"
+    assert stub.calls == 4
+    assert service.breaker_for(MODEL).state == CLOSED
+
+
+def test_half_open_allows_single_probe():
+    stub = StubOpenRouter(error(500), error(500), error(500), hang(0.3))
+    service = make_service(stub, max_retries=0, breaker_failures=3, breaker_recovery=0.1)
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                await complete(service)
+        await asyncio.sleep(0.15)
+        return await asyncio.gather(complete(service), complete(service), return_exceptions=True)
+
+    results = run(scenario())
+    assert sum(isinstance(result, CircuitOpenError) for result in results) == 1
+    assert sum(getattr(result, "text", None) == "привет" for result in results) == 1
+    assert stub.calls == 4
+    assert service.breaker_for(MODEL).state == CLOSED
+
+
+def test_timeout_hits_total_deadline():
+    stub = StubOpenRouter(hang(5.0))
+    service = make_service(stub, deadline=0.3)
+
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        run(complete(service))
+    assert time.monotonic() - started < 1.0
+    assert stub.calls == 1
+    # Зависание провайдера - сбой для автомата
+    assert service.breaker_for(MODEL).failures == 1
+
+
+def test_deadline_covers_retries():
+    stub = StubOpenRouter(error(500))
+    service = make_service(stub, max_retries=10, base_backoff=0.2, max_backoff=0.2, deadline=0.5,
+                           breaker_failures=100)
+
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        run(complete(service))
+    assert time.monotonic() - started < 0.6
+    assert stub.calls < 10
+
+
+def test_client_error_not_retried():
+    stub = StubOpenRouter(error(400))
+    service = make_service(stub)
+    with pytest.raises(BadRequestError):
+        run(complete(service))
+    assert stub.calls == 1
+    assert service.breaker_for(MODEL).failures == 0